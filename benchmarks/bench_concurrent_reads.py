@@ -0,0 +1,103 @@
+"""
+Requests per second of `/v1alpha2/get-table-data` with N parallel clients,
+threadpool (sync engine) vs async engine reads.
+
+    python benchmarks/bench_concurrent_reads.py --clients 100 --requests 2000
+
+Pass `--connstr` to benchmark against Postgres (requires asyncpg).
+"""
+
+import argparse
+import asyncio
+import tempfile
+import time
+from typing import Optional
+
+import httpx
+import pandas as pd
+from datapipe.compute import Catalog, DataStore, Pipeline, Table
+from datapipe.store.database import DBConn, TableStoreDB
+from sqlalchemy import Column, Integer, String
+
+from datapipe_app import DatapipeAPI
+from datapipe_app.read_engine import dispose_read_engines
+from datapipe_app.settings import API_SETTINGS
+
+
+def make_app(connstr: str, n_rows: int) -> DatapipeAPI:
+    dbconn = DBConn(connstr)
+
+    catalog = Catalog(
+        {
+            "items": Table(
+                store=TableStoreDB(
+                    name="bench_items",
+                    dbconn=dbconn,
+                    data_sql_schema=[
+                        Column("id", Integer(), primary_key=True),
+                        Column("name", String(100)),
+                    ],
+                    create_table=True,
+                )
+            ),
+        }
+    )
+
+    ds = DataStore(dbconn, create_meta_table=True)
+    app = DatapipeAPI(ds, catalog, Pipeline(steps=[]))
+
+    app.ds.get_table("items").store_chunk(
+        pd.DataFrame.from_records([{"id": i, "name": f"item {i}"} for i in range(n_rows)])
+    )
+
+    return app
+
+
+async def run_clients(app: DatapipeAPI, n_clients: int, n_requests: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    queue: "asyncio.Queue[Optional[int]]" = asyncio.Queue()
+
+    for i in range(n_requests):
+        queue.put_nowait(i)
+
+    async def client() -> None:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            while not queue.empty():
+                i = queue.get_nowait()
+                res = await http.post(
+                    "/api/v1alpha2/get-table-data",
+                    json={"table": "items", "page": i % 50, "page_size": 20, "order_by": "name"},
+                )
+                res.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(n_clients)])
+
+    return n_requests / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connstr", default=None)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    # Separate read pool, pipeline SQLite engine is not meant for many threads
+    API_SETTINGS.read_pool_size = args.clients
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = make_app(args.connstr or f"sqlite:///{tmpdir}/bench.sqlite", args.rows)
+
+        for async_reads in [False, True]:
+            API_SETTINGS.async_reads = async_reads
+
+            rps = asyncio.run(run_clients(app, args.clients, args.requests))
+            dispose_read_engines()
+
+            print(f"{'async' if async_reads else 'threadpool'}: {rps:.0f} requests/s with {args.clients} clients")
+
+
+if __name__ == "__main__":
+    main()
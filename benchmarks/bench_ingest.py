@@ -0,0 +1,97 @@
+"""
+Rows per second of loading a table through `/v1alpha1/update-data` in JSON
+batches vs one streamed `/v1alpha1/ingest-data` NDJSON request.
+
+    python benchmarks/bench_ingest.py --rows 100000 --batch 1000
+"""
+
+import argparse
+import json
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List
+
+from datapipe.compute import Catalog, DataStore, Pipeline, Table
+from datapipe.store.database import DBConn, TableStoreDB
+from fastapi.testclient import TestClient
+from sqlalchemy import Column, Float, Integer, String
+
+from datapipe_app import DatapipeAPI
+
+
+def make_app(connstr: str) -> DatapipeAPI:
+    dbconn = DBConn(connstr)
+
+    catalog = Catalog(
+        {
+            "items": Table(
+                store=TableStoreDB(
+                    name="bench_items",
+                    dbconn=dbconn,
+                    data_sql_schema=[
+                        Column("id", Integer(), primary_key=True),
+                        Column("name", String(100)),
+                        Column("score", Float()),
+                    ],
+                    create_table=True,
+                )
+            ),
+        }
+    )
+
+    ds = DataStore(dbconn, create_meta_table=True)
+
+    return DatapipeAPI(ds, catalog, Pipeline(steps=[]))
+
+
+def make_rows(n_rows: int, offset: int) -> List[Dict[str, Any]]:
+    return [{"id": offset + i, "name": f"item {i}", "score": i / 3} for i in range(n_rows)]
+
+
+def update_data(client: TestClient, rows: List[Dict[str, Any]], batch: int) -> None:
+    for start in range(0, len(rows), batch):
+        upsert = rows[start:start + batch]
+        res = client.post("/api/v1alpha1/update-data", json={"table_name": "items", "upsert": upsert})
+        res.raise_for_status()
+
+
+def ingest_data(client: TestClient, rows: List[Dict[str, Any]]) -> None:
+    def body() -> Iterator[bytes]:
+        for start in range(0, len(rows), 1000):
+            yield "".join(json.dumps(row) + "\n" for row in rows[start:start + 1000]).encode()
+
+    res = client.post(
+        "/api/v1alpha1/ingest-data",
+        params={"table_name": "items"},
+        content=body(),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    res.raise_for_status()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        client = TestClient(make_app(f"sqlite:///{tmpdir}/bench.sqlite"))
+
+        rows = make_rows(args.rows, 0)
+        start = time.perf_counter()
+        update_data(client, rows, args.batch)
+        update_time = time.perf_counter() - start
+
+        rows = make_rows(args.rows, args.rows)
+        start = time.perf_counter()
+        ingest_data(client, rows)
+        ingest_time = time.perf_counter() - start
+
+    print(f"{args.rows} rows")
+    print(f"update-data, {args.batch} rows per request: {args.rows / update_time:.0f} rows/s")
+    print(f"ingest-data, NDJSON stream:   {args.rows / ingest_time:.0f} rows/s ({update_time / ingest_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
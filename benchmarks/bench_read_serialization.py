@@ -0,0 +1,100 @@
+"""
+Compare serialization of `/v1alpha2/get-table-data` pages: pandas based path
+(read_sql_query -> fillna -> to_dict -> pydantic validation -> JSON) vs rows
+from SQLAlchemy serialized directly.
+
+    python benchmarks/bench_read_serialization.py --columns 100 --rows 1000
+"""
+
+import argparse
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable
+
+import pandas as pd
+from datapipe.store.database import DBConn, TableStoreDB
+from sqlalchemy import JSON, Column, DateTime, Float, Integer, String
+
+from datapipe_app import models
+from datapipe_app.api_v1alpha2 import get_table_store_db_data, table_store_db_query
+from datapipe_app.query import apply_page
+from datapipe_app.serialization import json_response
+
+
+def make_table_store(dbconn: DBConn, n_columns: int, n_rows: int) -> TableStoreDB:
+    schema = [Column("id", Integer(), primary_key=True)]
+    for i in range(n_columns):
+        column_type = [String(100), Float(), DateTime(), JSON()][i % 4]
+        schema.append(Column(f"col_{i}", column_type))
+
+    table_store = TableStoreDB(name="wide", dbconn=dbconn, data_sql_schema=schema, create_table=True)
+
+    now = datetime(2024, 1, 1)
+    records = []
+    for row in range(n_rows):
+        record = {"id": row}
+        for i in range(n_columns):
+            value = [f"value {row}", row / 3, now + timedelta(seconds=row), {"row": row, "i": i}][i % 4]
+            # every 7th value is missing
+            record[f"col_{i}"] = None if (row + i) % 7 == 0 else value
+        records.append(record)
+
+    table_store.insert_rows(pd.DataFrame.from_records(records))
+
+    return table_store
+
+
+def pandas_path(table_store: TableStoreDB, req: models.GetDataRequest) -> bytes:
+    sql = table_store_db_query(table_store, req)
+    sql = apply_page(sql, table_store.data_table, table_store.primary_keys, None, "asc", req.page, req.page_size)
+
+    data_df = pd.read_sql_query(sql, con=table_store.dbconn.con)
+
+    resp = models.GetDataResponse(
+        page=req.page,
+        page_size=req.page_size,
+        total=None,
+        data=data_df.fillna("-").to_dict(orient="records"),
+    )
+
+    return resp.model_dump_json().encode()
+
+
+def rows_path(table_store: TableStoreDB, req: models.GetDataRequest) -> bytes:
+    return bytes(json_response(get_table_store_db_data(table_store, req)).body)
+
+
+def measure(func: Callable[[], bytes], repeat: int) -> float:
+    func()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+
+    return (time.perf_counter() - start) / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--columns", type=int, default=100)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dbconn = DBConn(f"sqlite:///{tmpdir}/bench.sqlite")
+        table_store = make_table_store(dbconn, args.columns, args.rows)
+
+        req = models.GetDataRequest(table="wide", page_size=args.rows, include_total="none")
+
+        pandas_time = measure(lambda: pandas_path(table_store, req), args.repeat)
+        rows_time = measure(lambda: rows_path(table_store, req), args.repeat)
+
+    print(f"{args.rows} rows x {args.columns} columns")
+    print(f"pandas path: {pandas_time * 1000:.1f} ms")
+    print(f"rows path:   {rows_time * 1000:.1f} ms ({pandas_time / rows_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
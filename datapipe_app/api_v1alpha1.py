@@ -1,4 +1,7 @@
-from typing import Any, Dict, List, Literal, Optional, Tuple, cast
+import asyncio
+import io
+import logging
+from typing import Any, BinaryIO, Dict, List, Literal, Optional, Tuple, Union, cast
 
 import pandas as pd
 from datapipe.compute import (
@@ -9,45 +12,40 @@ from datapipe.compute import (
     run_steps,
     run_steps_changelist,
 )
-from datapipe.step.batch_transform import BaseBatchTransformStep
+from datapipe.datatable import DataTable
 from datapipe.store.database import TableStoreDB
 from datapipe.types import ChangeList, IndexDF, Labels
-from fastapi import BackgroundTasks, FastAPI, Query, Response
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Query, Request, Response
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 from pydantic import BaseModel, Field
-from sqlalchemy.sql.expression import and_, asc, desc, select, text
-from sqlalchemy.sql.functions import count
-
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql.expression import and_, asc, desc, select
+from starlette.concurrency import run_in_threadpool
+
+from datapipe_app.cache import TTLCache
+from datapipe_app.changelist_scheduler import ChangelistScheduler, setup_changelist_scheduler
+from datapipe_app.graph import GraphSnapshotCache, downstream_steps_index
+from datapipe_app.ingest import (
+    IngestError,
+    IngestFormat,
+    RequestBodyReader,
+    ingest_chunks,
+    ingest_format,
+    iter_chunks,
+)
+from datapipe_app.job_queue import JobQueue, setup_job_queue
+from datapipe_app.models import GraphResponse, PipelineStepResponse, TableResponse  # noqa: F401
+from datapipe_app.query import apply_order, fetch_rows, filter_clause, focus_filter
+from datapipe_app.read_engine import read_engine, run_read
+from datapipe_app.result_cache import ResultCache, cached_response, setup_result_cache
+from datapipe_app.serialization import arrow_response, fill_missing, json_response, wants_arrow
 from datapipe_app.settings import API_SETTINGS
+from datapipe_app.sort_indexes import SortIndexes, setup_sort_indexes
+from datapipe_app.step_status import StepStatusCounters
+from datapipe_app.table_size import count_rows
+from datapipe_app.write_buffer import WriteBatch, WriteBuffer, setup_write_buffer
 
-
-class PipelineStepResponse(BaseModel):
-    name: str
-
-    type_: str = Field(alias="type")
-    transform_type: str
-
-    indexes: Optional[List[str]] = None
-
-    inputs: List[str]
-    outputs: List[str]
-
-    total_idx_count: Optional[int] = None
-    changed_idx_count: Optional[int] = None
-
-
-class TableResponse(BaseModel):
-    name: str
-
-    indexes: List[str]
-
-    size: int
-    store_class: str
-
-
-class GraphResponse(BaseModel):
-    catalog: Dict[str, TableResponse]
-    pipeline: List[PipelineStepResponse]
+logger = logging.getLogger("datapipe_app.api_v1alpha1")
 
 
 class UpdateDataRequest(BaseModel):
@@ -61,21 +59,49 @@ class UpdateDataRequest(BaseModel):
 
 class UpdateDataResponse(BaseModel):
     result: str
+    # Background job running steps on the update, see /jobs/{job_id}
+    job_id: Optional[str] = None
+    # Steps downstream of the table which were run on the update
+    steps: Optional[List[str]] = None
+
+
+class IngestDataResponse(BaseModel):
+    result: str
+    rows: int
+    chunks: int
+    # Time spent on parsing and storing the body, without running steps
+    seconds: float
+    rows_per_second: float
+    # Background job running steps on the ingested rows, see /jobs/{job_id}
+    job_id: Optional[str] = None
+    # Steps downstream of the table which were run on the ingested rows
+    steps: Optional[List[str]] = None
+
+
+class JobResponse(BaseModel):
+    job_id: str
+    status: Literal["pending", "running", "done", "failed"]
+    attempts: int
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
 
 
 class GetDataRequest(BaseModel):
     table: str
     filters: Dict[str, Any] = {}
-    page: int = 0
-    page_size: int = 20
+    page: int = Field(0, ge=0)
+    page_size: int = Field(20, ge=1)
     order_by: Optional[str] = None
     order: Literal["asc", "desc"] = "asc"
+    include_total: Literal["exact", "estimate", "none"] = "exact"
 
 
 class GetDataResponse(BaseModel):
     page: int
     page_size: int
-    total: int
+    total: Optional[int] = None
+    total_is_estimate: bool = False
     data: List[Dict]
 
 
@@ -92,6 +118,80 @@ def filter_steps_by_labels(steps: List[ComputeStep], labels: Labels = [], name_p
     return res
 
 
+def run_changelist(
+    ds: DataStore,
+    steps: List[ComputeStep],
+    changelist: ChangeList,
+    step_counters: Optional[StepStatusCounters] = None,
+    result_cache: Optional[ResultCache] = None,
+    scheduler: Optional[ChangelistScheduler] = None,
+) -> None:
+    def run(steps: List[ComputeStep], changelist: ChangeList) -> None:
+        run_steps_changelist(ds=ds, steps=steps, changelist=changelist)
+
+        if step_counters is not None:
+            step_counters.mark_processed(steps, changelist)
+
+        if result_cache is not None:
+            result_cache.invalidate_steps(steps)
+
+    if scheduler is not None:
+        scheduler.run(steps, changelist, run)
+    else:
+        run(steps, changelist)
+
+
+def process_changelist(
+    ds: DataStore,
+    steps: List[ComputeStep],
+    background_tasks: BackgroundTasks,
+    table_name: str,
+    changelist: ChangeList,
+    background: bool,
+    enable_changelist: bool = True,
+    step_counters: Optional[StepStatusCounters] = None,
+    result_cache: Optional[ResultCache] = None,
+    job_queue: Optional[JobQueue] = None,
+    scheduler: Optional[ChangelistScheduler] = None,
+) -> Optional[str]:
+    """
+    Account `changelist` of `table_name` written by the API and run `steps`
+    on it, in background if requested. Returns id of the background job if
+    it was queued to `job_queue`.
+    """
+
+    if step_counters is not None:
+        step_counters.mark_changed(changelist)
+
+    if result_cache is not None:
+        result_cache.invalidate(table_name)
+
+    if enable_changelist:
+        if background and job_queue is not None:
+            return job_queue.submit(steps, changelist)
+        elif background:
+            background_tasks.add_task(
+                run_changelist,
+                ds=ds,
+                steps=steps,
+                changelist=changelist,
+                step_counters=step_counters,
+                result_cache=result_cache,
+                scheduler=scheduler,
+            )
+        else:
+            run_changelist(
+                ds=ds,
+                steps=steps,
+                changelist=changelist,
+                step_counters=step_counters,
+                result_cache=result_cache,
+                scheduler=scheduler,
+            )
+
+    return None
+
+
 def update_data(
     ds: DataStore,
     catalog: Catalog,
@@ -101,6 +201,10 @@ def update_data(
     upsert: Optional[List[Dict]],
     background: bool,
     enable_changelist: bool = True,
+    step_counters: Optional[StepStatusCounters] = None,
+    result_cache: Optional[ResultCache] = None,
+    job_queue: Optional[JobQueue] = None,
+    scheduler: Optional[ChangelistScheduler] = None,
 ) -> UpdateDataResponse:
     dt = catalog.get_datatable(ds, table_name)
 
@@ -117,13 +221,183 @@ def update_data(
     #     )
 
     #     cl.append(dt.name, idx)
-    if enable_changelist:
-        if background:
-            background_tasks.add_task(run_steps_changelist, ds=ds, steps=steps, changelist=cl)
-        else:
-            run_steps_changelist(ds=ds, steps=steps, changelist=cl)
+    job_id = process_changelist(
+        ds=ds,
+        steps=steps,
+        background_tasks=background_tasks,
+        table_name=dt.name,
+        changelist=cl,
+        background=background,
+        enable_changelist=enable_changelist,
+        step_counters=step_counters,
+        result_cache=result_cache,
+        scheduler=scheduler,
+        job_queue=job_queue,
+    )
+
+    return UpdateDataResponse(
+        result="ok",
+        job_id=job_id,
+        steps=[step.name for step in steps] if enable_changelist else None,
+    )
 
-    return UpdateDataResponse(result="ok")
+
+async def buffered_update_data(
+    write_buffer: WriteBuffer,
+    ds: DataStore,
+    catalog: Catalog,
+    steps: List[ComputeStep],
+    table_name: str,
+    upsert: Optional[List[Dict]],
+    background: bool,
+    enable_changelist: bool = True,
+) -> UpdateDataResponse:
+    """
+    Add `upsert` to the current batch of the table in `write_buffer`. With
+    `background` responds right away, otherwise after the batch was stored
+    and steps ran on it.
+    """
+
+    dt = catalog.get_datatable(ds, table_name)
+
+    if upsert is not None and len(upsert) > 0:
+        future = write_buffer.add(dt.name, dt.primary_keys, upsert, steps, enable_changelist)
+
+        if not background:
+            await asyncio.wrap_future(future)
+
+    return UpdateDataResponse(result="ok", steps=[step.name for step in steps] if enable_changelist else None)
+
+
+def ingest_data(
+    ds: DataStore,
+    catalog: Catalog,
+    steps: List[ComputeStep],
+    background_tasks: BackgroundTasks,
+    table_name: str,
+    body: BinaryIO,
+    format: IngestFormat,
+    background: bool,
+    enable_changelist: bool = True,
+    step_counters: Optional[StepStatusCounters] = None,
+    result_cache: Optional[ResultCache] = None,
+    job_queue: Optional[JobQueue] = None,
+    scheduler: Optional[ChangelistScheduler] = None,
+) -> IngestDataResponse:
+    dt = catalog.get_datatable(ds, table_name)
+
+    try:
+        cl, rows, chunks, seconds = ingest_chunks(dt, iter_chunks(body, format, API_SETTINGS.ingest_chunk_size))
+    except IngestError as e:
+        # Chunks stored before the failure stay in the table, steps run on them
+        if e.rows > 0:
+            process_changelist(
+                ds=ds,
+                steps=steps,
+                background_tasks=background_tasks,
+                table_name=dt.name,
+                changelist=e.changelist,
+                background=background,
+                enable_changelist=enable_changelist,
+                step_counters=step_counters,
+                result_cache=result_cache,
+                scheduler=scheduler,
+                job_queue=job_queue,
+            )
+
+        if isinstance(e.error, (ValueError, UnicodeDecodeError)):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Failed to parse {format} body, {e.rows} rows before the error were stored: {e.error}",
+            )
+
+        raise e.error
+
+    rows_per_second = rows / seconds if seconds > 0 else float(rows)
+    logger.info(f"Ingested {rows} rows into {dt.name} in {chunks} chunks, {rows_per_second:.0f} rows/s")
+
+    job_id = process_changelist(
+        ds=ds,
+        steps=steps,
+        background_tasks=background_tasks,
+        table_name=dt.name,
+        changelist=cl,
+        background=background,
+        enable_changelist=enable_changelist,
+        step_counters=step_counters,
+        result_cache=result_cache,
+        scheduler=scheduler,
+        job_queue=job_queue,
+    )
+
+    return IngestDataResponse(
+        result="ok",
+        rows=rows,
+        chunks=chunks,
+        seconds=seconds,
+        rows_per_second=rows_per_second,
+        job_id=job_id,
+        steps=[step.name for step in steps] if enable_changelist else None,
+    )
+
+
+def can_join_meta(ds: DataStore, dt: DataTable) -> bool:
+    """
+    Whether data table of `dt` is stored in the same database as meta tables.
+    """
+
+    return isinstance(dt.table_store, TableStoreDB) and dt.table_store.dbconn.connstr == ds.meta_dbconn.connstr
+
+
+def get_data_joined_pd(
+    table_store: TableStoreDB,
+    meta_sql: Any,
+    meta_tbl: Any,
+    page: int,
+    page_size: int,
+    order_by: Optional[List[str]],
+    order: Literal["asc", "desc"],
+    conn: Optional[Connection] = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Read a page of meta and data rows with a single join, for data tables which
+    live in the same database as meta tables, see `can_join_meta`.
+
+    `meta_sql` is the filtered query of `meta_tbl`.
+    """
+
+    data_tbl = table_store.data_table
+    primary_keys = table_store.primary_keys
+
+    meta_columns = [column for column in meta_tbl.columns if column.name not in primary_keys]
+    # Meta columns are labeled so that they do not clash with data columns
+    sql: Any = meta_sql.with_only_columns(
+        *[data_tbl.c[column.name] for column in table_store.data_sql_schema],
+        *[column.label(f"__meta_{column.name}") for column in meta_columns],
+    ).join_from(
+        meta_tbl,
+        data_tbl,
+        and_(*[meta_tbl.c[key] == data_tbl.c[key] for key in primary_keys]),
+    )
+
+    order_columns = [meta_tbl.c[column] for column in order_by or []]
+    order_columns.extend(meta_tbl.c[key] for key in primary_keys if key not in (order_by or []))
+
+    if order == "desc":
+        sql = sql.order_by(*[column.desc() for column in order_columns])
+    else:
+        sql = sql.order_by(*[column.asc() for column in order_columns])
+
+    sql = sql.offset(page * page_size).limit(page_size)
+
+    df = pd.read_sql_query(sql, con=conn if conn is not None else read_engine(table_store.dbconn))
+
+    data_df = df[[column.name for column in table_store.data_sql_schema]]
+    meta_df = df[primary_keys + [f"__meta_{column.name}" for column in meta_columns]].rename(
+        columns={f"__meta_{column.name}": column.name for column in meta_columns}
+    )
+
+    return meta_df, data_df
 
 
 def get_data_get_pd(
@@ -135,8 +409,17 @@ def get_data_get_pd(
     filters: Optional[IndexDF],
     order_by: Optional[List[str]],
     order: Literal["asc", "desc"],
-) -> Tuple[int, pd.DataFrame, pd.DataFrame]:
+    include_total: Literal["exact", "estimate", "none"] = "exact",
+    count_cache: Optional[TTLCache[int]] = None,
+    conn: Optional[Connection] = None,
+) -> Tuple[Optional[int], bool, pd.DataFrame, pd.DataFrame]:
+    """
+    Read a page of meta and data rows of the table. If the table can be read
+    with a join (see `can_join_meta`), all queries run on `conn` if given.
+    """
+
     dt = catalog.get_datatable(ds, table)
+    bind = conn if conn is not None and can_join_meta(ds, dt) else read_engine(ds.meta_dbconn)
 
     meta_schema = dt.meta_table.sql_schema
     meta_tbl = dt.meta_table.sql_table
@@ -152,16 +435,18 @@ def get_data_get_pd(
         )
     else:
         sql = sql.where(meta_tbl.c["delete_ts"].is_(None))
-    sql_count = select(count()).select_from(sql)
-    with ds.meta_dbconn.con.begin() as conn:
-        total_count = conn.execute(sql_count).scalar()
 
-    assert total_count is not None
+    total_count, total_is_estimate = count_rows(bind, sql, include_total, count_cache)
 
     data_df: pd.DataFrame
-    if page * page_size > total_count:
+    if total_count is not None and not total_is_estimate and page * page_size > total_count:
         meta_df = pd.DataFrame(columns=[x.name for x in meta_schema])  # type: ignore
         data_df = dt.get_data(cast(IndexDF, meta_df))
+    elif can_join_meta(ds, dt):
+        assert isinstance(dt.table_store, TableStoreDB)
+        meta_df, data_df = get_data_joined_pd(
+            dt.table_store, sql, meta_tbl, page, page_size, order_by, order, conn
+        )
     else:
         if order_by is not None:
             if order == "asc":
@@ -175,7 +460,7 @@ def get_data_get_pd(
         sql = sql.offset(page * page_size).limit(page_size)
         meta_df = pd.read_sql_query(
             sql,
-            con=ds.meta_dbconn.con,
+            con=read_engine(ds.meta_dbconn),
         )
 
         if not meta_df.empty:
@@ -184,7 +469,7 @@ def get_data_get_pd(
         else:
             data_df = pd.DataFrame(columns=[x.name for x in meta_schema])  # type: ignore
 
-    return total_count, meta_df, data_df
+    return total_count, total_is_estimate, meta_df, data_df
 
 
 def get_data_get(
@@ -196,11 +481,14 @@ def get_data_get(
     filters: Optional[IndexDF] = None,
     order_by: Optional[List[str]] = None,
     order: Optional[Literal["asc", "desc"]] = None,
+    include_total: Literal["exact", "estimate", "none"] = "exact",
+    count_cache: Optional[TTLCache[int]] = None,
+    conn: Optional[Connection] = None,
 ) -> GetDataResponse:
     if order is None:
         order = "asc"
 
-    total_count, meta_df, data_df = get_data_get_pd(
+    total_count, total_is_estimate, meta_df, data_df = get_data_get_pd(
         ds=ds,
         catalog=catalog,
         table=table,
@@ -209,138 +497,336 @@ def get_data_get(
         filters=filters,
         order_by=order_by,
         order=order,
+        include_total=include_total,
+        count_cache=count_cache,
+        conn=conn,
     )
     return GetDataResponse(
         page=page,
         page_size=page_size,
         total=total_count,
+        total_is_estimate=total_is_estimate,
         data=data_df.fillna("").to_dict(orient="records"),
     )
 
 
-def get_data_post(ds: DataStore, catalog: Catalog, req: GetDataRequest) -> GetDataResponse:
-    dt = catalog.get_datatable(ds, req.table)
-
-    assert isinstance(dt.table_store, TableStoreDB)
+def get_data_post_sql(table_store: TableStoreDB, req: GetDataRequest) -> Tuple[Any, Any]:
+    """
+    Returns filtered query for counting and the query of the requested page.
+    """
 
-    sql_schema = dt.table_store.data_sql_schema
-    sql_table = dt.table_store.data_table
+    sql_schema = table_store.data_sql_schema
+    sql_table = table_store.data_table
 
     sql = select(*sql_schema).select_from(sql_table)
     # Data table has no delete_ts
     # sql = sql.where(sql_table.c.delete_ts.is_(None))
-    if req.order_by:
-        sql = sql.where(text(f"{req.order_by} is not null"))
-        sql = sql.order_by(text(f"{req.order_by} {req.order}"))
-    sql = sql.offset(req.page * req.page_size).limit(req.page_size)
-
     for col, val in req.filters.items():
-        sql = sql.where(sql_table.c[col] == val)
+        sql = sql.where(filter_clause(sql_table, col, val))
 
-    sql_count = select(count()).select_from(sql_table)
-    for col, val in req.filters.items():
-        sql_count = sql_count.where(sql_table.c[col] == val)
+    page_sql = apply_order(sql, sql_table, table_store.primary_keys, req.order_by, req.order)
+    page_sql = page_sql.offset(req.page * req.page_size).limit(req.page_size)
+
+    return sql, page_sql
+
+
+def get_data_post_page(
+    ds: DataStore,
+    catalog: Catalog,
+    req: GetDataRequest,
+    count_cache: Optional[TTLCache[int]] = None,
+    conn: Optional[Connection] = None,
+) -> Tuple[List[str], GetDataResponse]:
+    """
+    Read a page of the table as column names and response with raw rows
+    (without missing values filled). Queries run on `conn` if given, on
+    `read_engine` otherwise.
+    """
+
+    dt = catalog.get_datatable(ds, req.table)
+
+    assert isinstance(dt.table_store, TableStoreDB)
+
+    sql, page_sql = get_data_post_sql(dt.table_store, req)
 
-    meta_df = pd.read_sql_query(
-        sql,
-        con=ds.meta_dbconn.con,
+    bind = conn if conn is not None else read_engine(dt.table_store.dbconn)
+
+    total, total_is_estimate = count_rows(bind, sql, req.include_total, count_cache)
+
+    columns, rows = fetch_rows(bind, page_sql)
+
+    return columns, GetDataResponse.model_construct(
+        page=req.page,
+        page_size=req.page_size,
+        total=total,
+        total_is_estimate=total_is_estimate,
+        data=rows,
     )
 
-    if not meta_df.empty:
-        data_df: pd.DataFrame = dt.get_data(cast(IndexDF, meta_df))
-        if req.order_by is not None:
-            ascending = req.order == "asc"
-            data_df.sort_values(by=req.order_by, ascending=ascending, inplace=True)
-    else:
-        data_df = pd.DataFrame()
 
-    with dt.table_store.dbconn.con.begin() as conn:
-        total_res = conn.execute(sql_count).fetchone()
-        assert total_res is not None
-        return GetDataResponse(
-            page=req.page,
-            page_size=req.page_size,
-            total=total_res[0],
-            data=data_df.fillna("").to_dict(orient="records"),
-        )
+def get_data_post(
+    ds: DataStore,
+    catalog: Catalog,
+    req: GetDataRequest,
+    count_cache: Optional[TTLCache[int]] = None,
+) -> GetDataResponse:
+    _, resp = get_data_post_page(ds, catalog, req, count_cache)
+    resp.data = fill_missing(resp.data, "")
+
+    return resp
+
 
+def get_focus_data(
+    ds: DataStore,
+    catalog: Catalog,
+    table_name: str,
+    page: int,
+    page_size: int,
+    items_idx: Optional[List[Dict]] = None,
+    count_cache: Optional[TTLCache[int]] = None,
+) -> GetDataResponse:
+    """
+    Page of existing rows of the table, optionally restricted to `items_idx`.
+    Ordering, paging and counting are done on the meta table in the database.
+    """
+
+    dt = catalog.get_datatable(ds, table_name)
+
+    meta_tbl = dt.meta_table.sql_table
+    primary_keys = dt.primary_keys
+
+    with read_engine(dt.meta_table.dbconn).connect() as conn, focus_filter(
+        conn, meta_tbl, primary_keys, items_idx
+    ) as focus:
+        sql: Any = select(*[meta_tbl.c[key] for key in primary_keys]).where(meta_tbl.c.delete_ts.is_(None))
+        if focus is not None:
+            sql = sql.where(focus)
+
+        total, _ = count_rows(conn, sql, cache=count_cache)
+
+        page_sql = apply_order(sql, meta_tbl, primary_keys, None, "asc").offset(page * page_size).limit(page_size)
+        idx_df = pd.read_sql_query(page_sql, con=conn)
 
-def make_app(ds: DataStore, catalog: Catalog, pipeline: Pipeline, steps: List[ComputeStep]) -> FastAPI:
+    data_df: pd.DataFrame = dt.get_data(cast(IndexDF, idx_df))
+    if not idx_df.empty:
+        data_df = idx_df.merge(data_df)[data_df.columns]  # save order
+
+    return GetDataResponse(
+        page=page,
+        page_size=page_size,
+        total=total,
+        data=data_df.to_dict(orient="records"),
+    )
+
+
+def make_app(
+    ds: DataStore,
+    catalog: Catalog,
+    pipeline: Pipeline,
+    steps: List[ComputeStep],
+    graph_cache: Optional[GraphSnapshotCache] = None,
+    step_counters: Optional[StepStatusCounters] = None,
+    result_cache: Optional[ResultCache] = None,
+    sort_indexes: Optional[SortIndexes] = None,
+    job_queue: Optional[JobQueue] = None,
+    scheduler: Optional[ChangelistScheduler] = None,
+) -> FastAPI:
     app = FastAPI()
 
-    @app.get("/graph", response_model=GraphResponse)
-    def get_graph() -> GraphResponse:
-        def table_response(table_name) -> TableResponse:
-            tbl = catalog.get_datatable(ds, table_name)
-
-            return TableResponse(
-                name=tbl.name,
-                indexes=tbl.primary_keys,
-                size=tbl.get_size(),
-                store_class=tbl.table_store.__class__.__name__,
-            )
+    if scheduler is None:
+        scheduler = setup_changelist_scheduler()
 
-        def pipeline_step_response(step: ComputeStep) -> PipelineStepResponse:
-            inputs = [i.dt.name for i in step.input_dts]
-            outputs = [i.name for i in step.output_dts]
+    # Writes to a table run only steps downstream of it
+    downstream_steps = downstream_steps_index(steps)
 
-            if isinstance(step, BaseBatchTransformStep):
+    if result_cache is None:
+        result_cache = setup_result_cache()
 
-                step_status = step.get_status(ds=ds) if API_SETTINGS.show_step_status else None
+    if sort_indexes is None:
+        sort_indexes = setup_sort_indexes()
 
-                return PipelineStepResponse(
-                    type="transform",
-                    transform_type=step.__class__.__name__,
-                    name=step.get_name(),
-                    indexes=step.transform_keys,
-                    inputs=inputs,
-                    outputs=outputs,
-                    total_idx_count=step_status.total_idx_count if step_status else None,
-                    changed_idx_count=step_status.changed_idx_count if step_status else None,
-                )
+    def flush_batch(batch: WriteBatch) -> None:
+        update_data(
+            ds=ds,
+            catalog=catalog,
+            steps=batch.steps,
+            background_tasks=BackgroundTasks(),
+            table_name=batch.table_name,
+            upsert=list(batch.rows.values()),
+            background=False,
+            enable_changelist=batch.enable_changelist,
+            step_counters=step_counters,
+            result_cache=result_cache,
+            scheduler=scheduler,
+        )
 
-            else:
-                return PipelineStepResponse(
-                    type="transform",
-                    transform_type=step.__class__.__name__,
-                    name=step.get_name(),
-                    inputs=inputs,
-                    outputs=outputs,
-                )
+    write_buffer = setup_write_buffer(flush_batch)
+    app.state.write_buffer = write_buffer
+
+    if write_buffer is not None:
+        # Flush upserts which were already acknowledged. Events of mounted apps
+        # are not run, DatapipeAPI registers the same handler
+        app.router.add_event_handler("shutdown", write_buffer.stop)
 
-        return GraphResponse(
-            catalog={table_name: table_response(table_name) for table_name in catalog.catalog.keys()},
-            pipeline=[pipeline_step_response(step) for step in steps],
+    def run_job(job_steps: List[ComputeStep], changelist: ChangeList) -> None:
+        run_changelist(
+            ds=ds,
+            steps=job_steps,
+            changelist=changelist,
+            step_counters=step_counters,
+            result_cache=result_cache,
+            scheduler=scheduler,
         )
 
+    # Only the queue created here is stopped on shutdown. Events of mounted
+    # apps are not run, DatapipeAPI registers the same handler
+    app.state.job_queue = None
+
+    if job_queue is None:
+        job_queue = app.state.job_queue = setup_job_queue(steps, run_job)
+
+        if job_queue is not None:
+            app.router.add_event_handler("shutdown", job_queue.stop)
+
+    if graph_cache is None:
+        graph_cache = GraphSnapshotCache(
+            ds,
+            catalog,
+            steps,
+            refresh_interval=API_SETTINGS.graph_refresh_interval,
+            max_workers=API_SETTINGS.graph_max_workers,
+            item_timeout=API_SETTINGS.graph_item_timeout,
+            step_counters=step_counters,
+        )
+
+    @app.get("/graph", response_model=GraphResponse)
+    async def get_graph() -> GraphResponse:
+        return await graph_cache.get_async()
+
     @app.post("/update-data", response_model=UpdateDataResponse)
-    def update_data_api(
+    async def update_data_api(
         req: UpdateDataRequest,
         background_tasks: BackgroundTasks,
     ) -> UpdateDataResponse:
-        return update_data(
+        if write_buffer is not None:
+            return await buffered_update_data(
+                write_buffer,
+                ds=ds,
+                catalog=catalog,
+                steps=filter_steps_by_labels(downstream_steps.get(req.table_name, []), labels=req.labels),
+                table_name=req.table_name,
+                upsert=req.upsert,
+                background=req.background,
+                enable_changelist=req.enable_changelist,
+            )
+
+        return await run_in_threadpool(
+            update_data,
             ds=ds,
             catalog=catalog,
-            steps=filter_steps_by_labels(steps, labels=req.labels),
+            steps=filter_steps_by_labels(downstream_steps.get(req.table_name, []), labels=req.labels),
             background_tasks=background_tasks,
             table_name=req.table_name,
             upsert=req.upsert,
             background=req.background,
             enable_changelist=req.enable_changelist,
+            step_counters=step_counters,
+            result_cache=result_cache,
+            scheduler=scheduler,
+            job_queue=job_queue,
         )
 
+    @app.get("/jobs/{job_id}", response_model=JobResponse)
+    def get_job(job_id: str) -> JobResponse:
+        job = job_queue.get(job_id) if job_queue is not None else None
+
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+        return JobResponse(**job)
+
     # /table/<table_name>?page=1&id=111&another_filter=value&sort=<+|->column_name
+    count_cache: Optional[TTLCache[int]] = None
+    if API_SETTINGS.count_cache_ttl is not None:
+        count_cache = TTLCache(ttl=API_SETTINGS.count_cache_ttl)
+
     @app.get("/get-data", response_model=GetDataResponse)
-    def get_data_get_api(
+    async def get_data_get_api(
+        request: Request,
         table: str,
-        page: int = 0,
-        page_size: int = 20,
-    ) -> GetDataResponse:
-        return get_data_get(ds, catalog, table, page, page_size)
+        page: int = Query(0, ge=0),
+        page_size: int = Query(20, ge=1),
+        include_total: Literal["exact", "estimate", "none"] = "exact",
+    ) -> Union[GetDataResponse, Response]:
+        def read(conn: Optional[Connection] = None) -> Tuple[Optional[int], bool, pd.DataFrame, pd.DataFrame]:
+            return get_data_get_pd(
+                ds=ds,
+                catalog=catalog,
+                table=table,
+                page=page,
+                page_size=page_size,
+                filters=None,
+                order_by=None,
+                order="asc",
+                include_total=include_total,
+                count_cache=count_cache,
+                conn=conn,
+            )
+
+        # Other stores are read with DataTable.get_data which is sync only
+        if can_join_meta(ds, catalog.get_datatable(ds, table)):
+            total_count, total_is_estimate, _, data_df = await run_read(
+                ds.meta_dbconn, read, request, API_SETTINGS.read_query_timeout
+            )
+        else:
+            total_count, total_is_estimate, _, data_df = await run_in_threadpool(read)
+
+        if wants_arrow(request):
+            data_df = data_df.astype(object).where(data_df.notna(), None)
+            return arrow_response(list(data_df.columns), data_df.to_dict(orient="records"), total=total_count)
+
+        return GetDataResponse(
+            page=page,
+            page_size=page_size,
+            total=total_count,
+            total_is_estimate=total_is_estimate,
+            data=data_df.fillna("").to_dict(orient="records"),
+        )
 
     @app.post("/get-data", response_model=GetDataResponse)
-    def get_data_post_api(req: GetDataRequest) -> GetDataResponse:
-        return get_data_post(ds, catalog, req)
+    async def get_data_post_api(req: GetDataRequest, request: Request) -> Response:
+        dt = catalog.get_datatable(ds, req.table)
+        table_store = dt.table_store
+        assert isinstance(table_store, TableStoreDB)
+
+        arrow = wants_arrow(request)
+
+        def read(conn: Connection) -> Response:
+            columns, resp = get_data_post_page(ds, catalog, req, count_cache, conn)
+
+            if arrow:
+                return arrow_response(columns, resp.data, total=resp.total)
+
+            resp.data = fill_missing(resp.data, "")
+            return json_response(resp)
+
+        response = await run_read(
+            table_store.dbconn,
+            lambda conn: cached_response(
+                result_cache,
+                dt,
+                ("v1alpha1/get-data", req.model_dump_json(), arrow),
+                lambda: read(conn),
+                conn,
+            ),
+            request,
+            API_SETTINGS.read_query_timeout,
+        )
+
+        if sort_indexes is not None and req.order_by:
+            sort_indexes.record(table_store.dbconn, table_store.data_table, req.order_by, table_store.primary_keys)
+
+        return response
 
     class FocusFilter(BaseModel):
         table_name: str
@@ -356,28 +842,14 @@ def make_app(ds: DataStore, catalog: Catalog, pipeline: Pipeline, steps: List[Co
 
     @app.post("/get-data-with-focus", response_model=GetDataResponse)
     def get_data_with_focus(req: GetDataWithFocusRequest) -> GetDataResponse:
-        dt = catalog.get_datatable(ds, req.table_name)
-
-        if req.focus is not None:
-            idx = cast(
-                IndexDF,
-                pd.DataFrame.from_records(
-                    [{k: v for item in req.focus.items_idx for k, v in item.items() if k in dt.primary_keys}]
-                ).dropna(),
-            )
-        else:
-            idx = None
-
-        existing_idx = dt.meta_table.get_existing_idx(idx=idx)
-
-        start_index = req.page * req.page_size
-        end_index = (req.page + 1) * req.page_size
-        data_df: pd.DataFrame = dt.get_data(cast(IndexDF, existing_idx.iloc[start_index:end_index]))
-        return GetDataResponse(
-            page=req.page,
-            page_size=req.page_size,
-            total=len(existing_idx),
-            data=data_df.to_dict(orient="records"),
+        return get_focus_data(
+            ds,
+            catalog,
+            req.table_name,
+            req.page,
+            req.page_size,
+            items_idx=req.focus.items_idx if req.focus is not None else None,
+            count_cache=count_cache,
         )
 
     class GetDataByIdxRequest(BaseModel):
@@ -396,10 +868,13 @@ def make_app(ds: DataStore, catalog: Catalog, pipeline: Pipeline, steps: List[Co
     def run():
         run_steps(ds=ds, steps=steps)
 
+        if result_cache is not None:
+            result_cache.invalidate_steps(steps)
+
     # TODO refactor out to component based extension system
     # TODO automatic setup of webhook on project creation
     @app.post("/labelstudio-webhook")
-    def labelstudio_webhook(
+    async def labelstudio_webhook(
         request: Dict,
         background_tasks: BackgroundTasks,
         table_name: str = Query(..., title="Input table name"),
@@ -413,14 +888,60 @@ def make_app(ds: DataStore, catalog: Catalog, pipeline: Pipeline, steps: List[Co
             }
         ]
 
-        return update_data(
+        if write_buffer is not None:
+            return await buffered_update_data(
+                write_buffer,
+                ds=ds,
+                catalog=catalog,
+                steps=downstream_steps.get(table_name, []),
+                table_name=table_name,
+                upsert=upsert,
+                background=background,
+            )
+
+        return await run_in_threadpool(
+            update_data,
             ds=ds,
             catalog=catalog,
-            steps=steps,
+            steps=downstream_steps.get(table_name, []),
             background_tasks=background_tasks,
             table_name=table_name,
             upsert=upsert,
             background=background,
+            step_counters=step_counters,
+            result_cache=result_cache,
+            scheduler=scheduler,
+            job_queue=job_queue,
+        )
+
+    @app.post("/ingest-data", response_model=IngestDataResponse)
+    async def ingest_data_api(
+        request: Request,
+        background_tasks: BackgroundTasks,
+        table_name: str = Query(..., title="Input table name"),
+        format: Optional[IngestFormat] = Query(None, title="Body format, taken from Content-Type by default"),
+        background: bool = Query(False, title="Run as Background Task (default = False)"),
+        enable_changelist: bool = Query(True, title="Run steps on ingested rows (default = True)"),
+    ) -> IngestDataResponse:
+        if format is None:
+            format = ingest_format(request.headers.get("content-type"))
+
+        # Body is parsed in threadpool while it is being received
+        return await run_in_threadpool(
+            ingest_data,
+            ds=ds,
+            catalog=catalog,
+            steps=downstream_steps.get(table_name, []),
+            background_tasks=background_tasks,
+            table_name=table_name,
+            body=io.BufferedReader(RequestBodyReader(request.stream())),
+            format=format,
+            background=background,
+            enable_changelist=enable_changelist,
+            step_counters=step_counters,
+            result_cache=result_cache,
+            scheduler=scheduler,
+            job_queue=job_queue,
         )
 
     @app.get("/get-file")
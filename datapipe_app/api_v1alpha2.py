@@ -1,8 +1,8 @@
 import asyncio
 import copy
 import math
-from datetime import datetime
-from typing import Any, Dict, List, Optional, Set
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Literal, Optional, Set, Tuple, Union
 
 import pandas as pd
 from datapipe.compute import Catalog, ComputeStep, DataStore, Pipeline, run_steps
@@ -10,105 +10,318 @@ from datapipe.run_config import RunConfig
 from datapipe.step.batch_transform import BaseBatchTransformStep
 from datapipe.store.database import TableStoreDB
 from datapipe.types import IndexDF, Labels
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
-from sqlalchemy.sql.expression import and_, or_, select, text
-from sqlalchemy.sql.functions import count, func
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql.expression import select
+from sqlalchemy.sql.functions import func
 
 from datapipe_app import models
+from datapipe_app.cache import TTLCache
+from datapipe_app.graph import GraphSnapshotCache
+from datapipe_app.query import (
+    apply_order,
+    apply_page,
+    connect,
+    encode_cursor,
+    fetch_rows,
+    filter_clause,
+    focus_filter,
+    is_filter_operators,
+    iter_query_batches,
+)
+from datapipe_app.read_engine import read_engine, run_read
+from datapipe_app.result_cache import ResultCache, cached_response, setup_result_cache
+from datapipe_app.serialization import (
+    arrow_response,
+    fill_missing,
+    iter_csv,
+    iter_ndjson,
+    json_response,
+    parse_datetime,
+    truncate_records,
+    wants_arrow,
+)
 from datapipe_app.settings import API_SETTINGS
+from datapipe_app.sort_indexes import SortIndexes, setup_sort_indexes
+from datapipe_app.step_status import StepStatusCounters
+from datapipe_app.table_size import check_full_scan, count_rows
 
 
-def get_table_store_db_data(table_store: TableStoreDB, req: models.GetDataRequest) -> models.GetDataResponse:
+def table_store_db_query(
+    table_store: TableStoreDB,
+    req: models.GetDataRequest,
+    focus: Optional[Any] = None,
+) -> Any:
+    """
+    Filtered query of `table_store`, `focus` is a clause from `focus_filter`
+    for `req.focus`.
+    """
+
     sql_schema = table_store.data_sql_schema
     sql_table = table_store.data_table
 
     sql = select(*sql_schema).select_from(sql_table)
-    if req.focus is not None:
-        filtered_focus_idx = [
-            {k: v for k, v in row.items() if k in table_store.primary_keys} for row in req.focus.items_idx
-        ]
-        primary_key_selectors = [and_(*[sql_table.c[k] == v for k, v in row.items()]) for row in filtered_focus_idx]
-        sql = sql.where(or_(*primary_key_selectors))
+    if focus is not None:
+        sql = sql.where(focus)
 
     for col, val in req.filters.items():
-        sql = sql.where(sql_table.c[col] == val)
+        sql = sql.where(filter_clause(sql_table, col, val))
+
+    return sql
+
+
+def get_table_store_db_page(
+    table_store: TableStoreDB,
+    req: models.GetDataRequest,
+    count_cache: Optional[TTLCache[int]] = None,
+    conn: Optional[Connection] = None,
+) -> Tuple[List[str], models.GetDataResponse]:
+    """
+    Read a page of `table_store` as column names and response with raw rows
+    (without missing values filled). Queries run on `conn` if given, on
+    `read_engine` otherwise.
+    """
+
+    page_size = min(req.page_size, API_SETTINGS.max_page_size)
+    sql_table = table_store.data_table
+
+    with connect(conn if conn is not None else read_engine(table_store.dbconn)) as conn, focus_filter(
+        conn, sql_table, table_store.primary_keys, req.focus.items_idx if req.focus is not None else None
+    ) as focus:
+        sql = table_store_db_query(table_store, req, focus)
 
-    sql_count = select(count()).select_from(sql.subquery())
+        if req.filters:
+            check_full_scan(conn, table_store.dbconn, sql, sql_table)
 
-    if req.order_by:
-        sql = sql.where(text(f"{req.order_by} is not null"))
-        sql = sql.order_by(text(f"{req.order_by} {req.order}"))
+        total, total_is_estimate = count_rows(conn, sql, req.include_total, count_cache)
 
-    sql.offset(req.page * req.page_size).limit(req.page_size)
+        sql = apply_page(
+            sql, sql_table, table_store.primary_keys, req.order_by, req.order, req.page, page_size, req.cursor
+        )
 
-    data_df = pd.read_sql_query(sql, con=table_store.dbconn.con)
+        columns, rows = fetch_rows(conn, sql)
 
-    with table_store.dbconn.con.begin() as conn:
-        total = conn.execute(sql_count).scalar_one_or_none()
-        assert total is not None
+    data, truncated = truncate_records(rows, API_SETTINGS.max_response_bytes)
 
-    return models.GetDataResponse(
+    next_cursor = None
+    if len(data) > 0 and (truncated or len(data) == page_size):
+        next_cursor = encode_cursor(data[-1], sql_table, table_store.primary_keys, req.order_by, req.order)
+
+    return columns, models.GetDataResponse.model_construct(
         page=req.page,
-        page_size=req.page_size,
+        page_size=page_size,
         total=total,
-        data=data_df.fillna("-").to_dict(orient="records"),
+        total_is_estimate=total_is_estimate,
+        data=data,
+        next_cursor=next_cursor,
+        truncated=truncated,
     )
 
 
-def get_table_data(ds: DataStore, catalog: Catalog, req: models.GetDataRequest) -> models.GetDataResponse:
+def get_table_store_db_data(
+    table_store: TableStoreDB,
+    req: models.GetDataRequest,
+    count_cache: Optional[TTLCache[int]] = None,
+) -> models.GetDataResponse:
+    _, resp = get_table_store_db_page(table_store, req, count_cache)
+    resp.data = fill_missing(resp.data, "-")
+
+    return resp
+
+
+def get_table_data(
+    ds: DataStore,
+    catalog: Catalog,
+    req: models.GetDataRequest,
+    count_cache: Optional[TTLCache[int]] = None,
+    arrow: bool = False,
+) -> Union[models.GetDataResponse, Response]:
     dt = catalog.get_datatable(ds, req.table)
     table_store = dt.table_store
 
     if isinstance(table_store, TableStoreDB):
-        return get_table_store_db_data(table_store, req)
+        if arrow:
+            columns, resp = get_table_store_db_page(table_store, req, count_cache)
+            return arrow_response(columns, resp.data, total=resp.total, next_cursor=resp.next_cursor)
+
+        return get_table_store_db_data(table_store, req, count_cache)
 
     raise HTTPException(status_code=500, detail="Not implemented")
 
 
-def get_transform_data(step: BaseBatchTransformStep, req: models.GetDataRequest) -> models.GetDataResponse:
+def _process_ts_value(value: Any) -> Any:
+    # process_ts is stored as unix timestamp and returned as ISO datetime
+    if isinstance(value, str):
+        return parse_datetime(value).timestamp()
+
+    return value
+
+
+def transform_data_query(
+    step: BaseBatchTransformStep,
+    req: models.GetDataRequest,
+    focus: Optional[Any] = None,
+) -> Any:
+    """
+    Filtered query of transform meta table, `focus` is a clause from
+    `focus_filter` for `req.focus`.
+    """
+
     sql_table = step.meta_table.sql_table
     sql_schema = step.meta_table.sql_schema
 
     sql = select(*sql_schema).select_from(sql_table)
 
-    if req.focus is not None:
-        filtered_focus_idx = [
-            {k: v for k, v in row.items() if k in step.meta_table.primary_keys} for row in req.focus.items_idx
-        ]
-        primary_key_selectors = [and_(*[sql_table.c[k] == v for k, v in row.items()]) for row in filtered_focus_idx]
-        sql = sql.where(or_(*primary_key_selectors))
+    if focus is not None:
+        sql = sql.where(focus)
 
     for col, val in req.filters.items():
-        if col == "process_ts":
-            val = datetime.fromisoformat(val).timestamp()
+        if col == "process_ts" and not is_filter_operators(val):
+            try:
+                val = _process_ts_value(val)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid value of filter of process_ts: {e}")
+
+            if not isinstance(val, (int, float)):
+                raise HTTPException(status_code=400, detail="Filter of process_ts expects ISO datetime or timestamp")
+
             # Postgres 7 digits precision, datetime.timestamp() has 6 digits so we need to add some tolerance
             sql = sql.where(func.abs(sql_table.c[col] - val) < 0.000001)
+        elif col == "process_ts":
+            sql = sql.where(filter_clause(sql_table, col, val, convert=_process_ts_value))
         else:
-            sql = sql.where(sql_table.c[col] == val)
+            sql = sql.where(filter_clause(sql_table, col, val))
+
+    return sql
 
-    sql_count = select(count()).select_from(sql.subquery())
 
-    if req.order_by:
-        sql = sql.where(text(f"{req.order_by} is not null"))
-        sql = sql.order_by(text(f"{req.order_by} {req.order}"))
+def get_transform_page(
+    step: BaseBatchTransformStep,
+    req: models.GetDataRequest,
+    count_cache: Optional[TTLCache[int]] = None,
+    conn: Optional[Connection] = None,
+) -> Tuple[List[str], models.GetDataResponse]:
+    """
+    Read a page of transform meta table as column names and response with raw
+    rows (without missing values filled). Queries run on `conn` if given, on
+    `read_engine` otherwise.
+    """
+
+    page_size = min(req.page_size, API_SETTINGS.max_page_size)
+    sql_table = step.meta_table.sql_table
+
+    with connect(conn if conn is not None else read_engine(step.meta_table.dbconn)) as conn, focus_filter(
+        conn, sql_table, step.meta_table.primary_keys, req.focus.items_idx if req.focus is not None else None
+    ) as focus:
+        sql = transform_data_query(step, req, focus)
 
-    sql = sql.offset(req.page * req.page_size).limit(req.page_size)
+        if req.filters:
+            check_full_scan(conn, step.meta_table.dbconn, sql, sql_table)
 
-    transform_data = pd.read_sql_query(sql, con=step.meta_table.dbconn.con)
+        total, total_is_estimate = count_rows(conn, sql, req.include_total, count_cache)
+
+        sql = apply_page(
+            sql, sql_table, step.meta_table.primary_keys, req.order_by, req.order, req.page, page_size, req.cursor
+        )
 
-    transform_data = transform_data.drop("priority", axis=1)
-    transform_data["process_ts"] = pd.to_datetime(transform_data["process_ts"], unit="s", utc=True)
+        columns, rows = fetch_rows(conn, sql)
 
-    with step.meta_table.dbconn.con.begin() as conn:
-        total = conn.execute(sql_count).scalar_one_or_none()
-        assert total is not None
+    data, truncated = truncate_records(rows, API_SETTINGS.max_response_bytes)
 
-    return models.GetDataResponse(
+    next_cursor = None
+    if len(data) > 0 and (truncated or len(data) == page_size):
+        next_cursor = encode_cursor(data[-1], sql_table, step.meta_table.primary_keys, req.order_by, req.order)
+
+    for row in data:
+        del row["priority"]
+        if row["process_ts"] is not None:
+            row["process_ts"] = datetime.fromtimestamp(row["process_ts"], tz=timezone.utc)
+
+    return [column for column in columns if column != "priority"], models.GetDataResponse.model_construct(
         page=req.page,
-        page_size=req.page_size,
+        page_size=page_size,
         total=total,
-        data=transform_data.fillna("-").to_dict(orient="records"),
+        total_is_estimate=total_is_estimate,
+        data=data,
+        next_cursor=next_cursor,
+        truncated=truncated,
+    )
+
+
+def get_transform_data(
+    step: BaseBatchTransformStep,
+    req: models.GetDataRequest,
+    count_cache: Optional[TTLCache[int]] = None,
+) -> models.GetDataResponse:
+    _, resp = get_transform_page(step, req, count_cache)
+    resp.data = fill_missing(resp.data, "-")
+
+    return resp
+
+
+def export_response(
+    columns: List[str],
+    batches: Iterator[List[Dict[str, Any]]],
+    format: Literal["ndjson", "csv"],
+    filename: str,
+) -> StreamingResponse:
+    if format == "csv":
+        return StreamingResponse(
+            iter_csv(columns, batches),
+            media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="{filename}.csv"'},
+        )
+
+    return StreamingResponse(
+        iter_ndjson(batches),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}.ndjson"'},
+    )
+
+
+def export_table_store_db_data(
+    table_store: TableStoreDB,
+    format: Literal["ndjson", "csv"],
+) -> StreamingResponse:
+    sql_table = table_store.data_table
+
+    sql = select(*table_store.data_sql_schema).select_from(sql_table)
+    sql = apply_order(sql, sql_table, table_store.primary_keys, None, "asc")
+
+    return export_response(
+        columns=[column.name for column in table_store.data_sql_schema],
+        batches=iter_query_batches(read_engine(table_store.dbconn), sql, API_SETTINGS.export_batch_size),
+        format=format,
+        filename=table_store.name,
+    )
+
+
+def export_transform_data(
+    step: BaseBatchTransformStep,
+    format: Literal["ndjson", "csv"],
+) -> StreamingResponse:
+    sql_table = step.meta_table.sql_table
+    columns = [column.name for column in sql_table.columns if column.name != "priority"]
+
+    sql = select(*[sql_table.c[column] for column in columns]).select_from(sql_table)
+    sql = apply_order(sql, sql_table, step.meta_table.primary_keys, None, "asc")
+
+    def process_ts_to_datetime(batches: Iterator[List[Dict[str, Any]]]) -> Iterator[List[Dict[str, Any]]]:
+        for batch in batches:
+            for row in batch:
+                if row["process_ts"] is not None:
+                    row["process_ts"] = datetime.fromtimestamp(row["process_ts"], tz=timezone.utc)
+            yield batch
+
+    return export_response(
+        columns=columns,
+        batches=process_ts_to_datetime(
+            iter_query_batches(read_engine(step.meta_table.dbconn), sql, API_SETTINGS.export_batch_size)
+        ),
+        format=format,
+        filename=step.get_name(),
     )
 
 
@@ -189,6 +402,8 @@ def run_step(
     step: BaseBatchTransformStep,
     transform_state: models.RunStepResponse,
     filters: Optional[List[Dict]],
+    step_counters: Optional[StepStatusCounters] = None,
+    result_cache: Optional[ResultCache] = None,
 ) -> None:
     # Before we progress callback to datapipe-core we need to do this shenanigans 💀
     _step = copy.copy(step)
@@ -212,6 +427,8 @@ def run_step(
                     end = (i + 1) * _step.chunk_size
                     yield IndexDF(idx.iloc[start:end])
                     transform_state.processed += _step.chunk_size
+                    if step_counters is not None:
+                        step_counters.mark_step_processed(_step, len(idx.iloc[start:end]))
 
             return idx_total, updating_idx_gen()
 
@@ -231,6 +448,8 @@ def run_step(
                 for idx in idx_gen:
                     yield idx
                     transform_state.processed += _step.chunk_size
+                    if step_counters is not None:
+                        step_counters.mark_step_processed(_step, len(idx))
 
             return idx_total, updating_idx_gen()
 
@@ -238,65 +457,89 @@ def run_step(
     _step.get_full_process_ids = get_full_process_ids  # type: ignore
     run_steps(ds=ds, steps=[_step])
 
+    if result_cache is not None:
+        result_cache.invalidate_steps([_step])
+
+    if step_counters is not None and filters is None:
+        step_counters.mark_step_processed(_step)
+
 
 def make_app(
     ds: DataStore,
     catalog: Catalog,
     pipeline: Pipeline,
     steps: List[ComputeStep],
+    graph_cache: Optional[GraphSnapshotCache] = None,
+    step_counters: Optional[StepStatusCounters] = None,
+    result_cache: Optional[ResultCache] = None,
+    sort_indexes: Optional[SortIndexes] = None,
 ) -> FastAPI:
     app = FastAPI()
 
-    @app.get("/graph", response_model=models.GraphResponse)
-    def get_graph() -> models.GraphResponse:
-        def table_response(table_name) -> models.TableResponse:
-            tbl = catalog.get_datatable(ds, table_name)
-
-            return models.TableResponse(
-                name=tbl.name,
-                indexes=tbl.primary_keys,
-                size=tbl.get_size(),
-                store_class=tbl.table_store.__class__.__name__,
-            )
+    if result_cache is None:
+        result_cache = setup_result_cache()
+
+    if sort_indexes is None:
+        sort_indexes = setup_sort_indexes()
+
+    if graph_cache is None:
+        graph_cache = GraphSnapshotCache(
+            ds,
+            catalog,
+            steps,
+            refresh_interval=API_SETTINGS.graph_refresh_interval,
+            max_workers=API_SETTINGS.graph_max_workers,
+            item_timeout=API_SETTINGS.graph_item_timeout,
+            step_counters=step_counters,
+        )
 
-        def pipeline_step_response(step: ComputeStep) -> models.PipelineStepResponse:
-            inputs = [i.dt.name for i in step.input_dts]
-            outputs = [i.name for i in step.output_dts]
-
-            if isinstance(step, BaseBatchTransformStep):
-                step_status = step.get_status(ds=ds) if API_SETTINGS.show_step_status else None
-
-                return models.PipelineStepResponse(
-                    type="transform",
-                    transform_type=step.__class__.__name__,
-                    name=step.get_name(),
-                    indexes=step.transform_keys,
-                    inputs=inputs,
-                    outputs=outputs,
-                    total_idx_count=(step_status.total_idx_count if step_status else None),
-                    changed_idx_count=(step_status.changed_idx_count if step_status else None),
-                )
+    @app.get("/graph", response_model=models.GraphResponse)
+    async def get_graph() -> models.GraphResponse:
+        return await graph_cache.get_async()
 
-            else:
-                return models.PipelineStepResponse(
-                    type="transform",
-                    transform_type=step.__class__.__name__,
-                    name=step.get_name(),
-                    inputs=inputs,
-                    outputs=outputs,
-                )
+    count_cache: Optional[TTLCache[int]] = None
+    if API_SETTINGS.count_cache_ttl is not None:
+        count_cache = TTLCache(ttl=API_SETTINGS.count_cache_ttl)
 
-        return models.GraphResponse(
-            catalog={table_name: table_response(table_name) for table_name in catalog.catalog.keys()},
-            pipeline=[pipeline_step_response(step) for step in steps],
+    @app.post("/get-table-data", response_model=models.GetDataResponse)
+    async def get_data_post_api(req: models.GetDataRequest, request: Request) -> Response:
+        dt = catalog.get_datatable(ds, req.table)
+        table_store = dt.table_store
+
+        if not isinstance(table_store, TableStoreDB):
+            raise HTTPException(status_code=500, detail="Not implemented")
+
+        arrow = wants_arrow(request)
+
+        def read(conn: Connection) -> Response:
+            columns, resp = get_table_store_db_page(table_store, req, count_cache, conn)
+
+            if arrow:
+                return arrow_response(columns, resp.data, total=resp.total, next_cursor=resp.next_cursor)
+
+            resp.data = fill_missing(resp.data, "-")
+            return json_response(resp)
+
+        response = await run_read(
+            table_store.dbconn,
+            lambda conn: cached_response(
+                result_cache,
+                dt,
+                ("v1alpha2/get-table-data", req.model_dump_json(), arrow),
+                lambda: read(conn),
+                conn,
+            ),
+            request,
+            API_SETTINGS.read_query_timeout,
         )
 
-    @app.post("/get-table-data", response_model=models.GetDataResponse)
-    def get_data_post_api(req: models.GetDataRequest) -> models.GetDataResponse:
-        return get_table_data(ds, catalog, req)
+        if sort_indexes is not None and req.order_by:
+            sort_indexes.record(table_store.dbconn, table_store.data_table, req.order_by, table_store.primary_keys)
+
+        return response
 
-    @app.post("/get-transform-data")
-    def get_meta_data_api(req: models.GetDataRequest) -> models.GetDataResponse:
+    @app.post("/get-transform-data", response_model=models.GetDataResponse)
+    async def get_meta_data_api(req: models.GetDataRequest, request: Request) -> Response:
         filtered_steps = filter_steps_by_labels(steps, name_prefix=req.table)
         if len(filtered_steps) != 1:
             raise HTTPException(status_code=404, detail="Step not found")
@@ -304,14 +547,53 @@ def make_app(
 
         # maybe infer on type or smth?
         if not isinstance(step, BaseBatchTransformStep):
-            return models.GetDataResponse(
-                page=req.page,
-                page_size=req.page_size,
-                total=0,
-                data=[],
+            return json_response(
+                models.GetDataResponse(
+                    page=req.page,
+                    page_size=req.page_size,
+                    total=0,
+                    data=[],
+                )
             )
 
-        return get_transform_data(step, req)
+        columns, resp = await run_read(
+            step.meta_table.dbconn,
+            lambda conn: get_transform_page(step, req, count_cache, conn),
+            request,
+            API_SETTINGS.read_query_timeout,
+        )
+
+        if sort_indexes is not None and req.order_by:
+            sort_indexes.record(
+                step.meta_table.dbconn, step.meta_table.sql_table, req.order_by, step.meta_table.primary_keys
+            )
+
+        if wants_arrow(request):
+            return arrow_response(columns, resp.data, total=resp.total, next_cursor=resp.next_cursor)
+
+        resp.data = fill_missing(resp.data, "-")
+        return json_response(resp)
+
+    @app.get("/export-table-data")
+    def export_table_data_api(table: str, format: Literal["ndjson", "csv"] = "ndjson") -> StreamingResponse:
+        table_store = catalog.get_datatable(ds, table).table_store
+
+        if not isinstance(table_store, TableStoreDB):
+            raise HTTPException(status_code=500, detail="Not implemented")
+
+        return export_table_store_db_data(table_store, format)
+
+    @app.get("/export-transform-data")
+    def export_transform_data_api(transform: str, format: Literal["ndjson", "csv"] = "ndjson") -> StreamingResponse:
+        filtered_steps = filter_steps_by_labels(steps, name_prefix=transform)
+        if len(filtered_steps) != 1:
+            raise HTTPException(status_code=404, detail="Step not found")
+        step = filtered_steps[0]
+
+        if not isinstance(step, BaseBatchTransformStep):
+            raise HTTPException(status_code=400, detail="Step has no transform meta table")
+
+        return export_transform_data(step, format)
 
     _running_steps_helper = RunningStepsHelper()
 
@@ -345,7 +627,13 @@ def make_app(
                     )
                     _ = asyncio.create_task(_running_steps_helper.update_transform_status(transform=transform))
                     run_step_thread = asyncio.to_thread(
-                        run_step, ds, step, _running_steps_helper[transform], json_data.filters
+                        run_step,
+                        ds,
+                        step,
+                        _running_steps_helper[transform],
+                        json_data.filters,
+                        step_counters,
+                        result_cache,
                     )
                     run_steps_task = asyncio.create_task(run_step_thread)
                     run_steps_task.add_done_callback(lambda _: _running_steps_helper.set_job_as_finished(transform))
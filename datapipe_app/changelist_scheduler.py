@@ -0,0 +1,126 @@
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+from datapipe.compute import ComputeStep
+from datapipe.types import ChangeList, IndexDF
+
+from datapipe_app.settings import API_SETTINGS
+
+
+def merge_changelists(a: ChangeList, b: ChangeList) -> ChangeList:
+    """
+    Union of `a` and `b` without duplicate indices.
+    """
+
+    res = ChangeList()
+
+    for table_name in {**a.changes, **b.changes}:
+        idxs = [cl.changes[table_name] for cl in (a, b) if table_name in cl.changes]
+        res.append(table_name, IndexDF(pd.concat(idxs, axis="index").drop_duplicates().reset_index(drop=True)))
+
+    return res
+
+
+@dataclass
+class _PendingRun:
+    changelist: ChangeList
+    # Set when the previous run finished and this one may start
+    ready: threading.Event = field(default_factory=threading.Event)
+    future: "Future[None]" = field(default_factory=Future)
+
+
+@dataclass
+class _StepsState:
+    pending: Optional[_PendingRun] = None
+
+
+class ChangelistScheduler:
+    """
+    Keeps at most one running and one pending changelist run per set of
+    steps. Changelists which arrive while a run is in flight are merged into
+    the pending run. It is run by the caller which created it once the
+    current run finishes, other callers merged into it wait for its result.
+    """
+
+    def __init__(self) -> None:
+        self._states: Dict[Tuple[str, ...], _StepsState] = {}
+        self._lock = threading.Lock()
+
+    def run(
+        self,
+        steps: List[ComputeStep],
+        changelist: ChangeList,
+        func: Callable[[List[ComputeStep], ChangeList], None],
+    ) -> None:
+        """
+        Run `func` on `changelist`, merged with others if `steps` are busy.
+        Returns once the run which contains `changelist` finished, raises if
+        it failed.
+        """
+
+        key = tuple(step.name for step in steps)
+        pending: Optional[_PendingRun] = None
+        leader = True
+
+        with self._lock:
+            state = self._states.get(key)
+
+            if state is None:
+                self._states[key] = _StepsState()
+            elif state.pending is None:
+                pending = state.pending = _PendingRun(changelist)
+            else:
+                state.pending.changelist = merge_changelists(state.pending.changelist, changelist)
+                pending = state.pending
+                leader = False
+
+        if pending is None:
+            try:
+                func(steps, changelist)
+            finally:
+                self._start_next(key)
+            return
+
+        if not leader:
+            pending.future.result()
+            return
+
+        pending.ready.wait()
+
+        try:
+            func(steps, pending.changelist)
+        except Exception as e:
+            pending.future.set_exception(e)
+            raise
+        else:
+            pending.future.set_result(None)
+        finally:
+            self._start_next(key)
+
+    def _start_next(self, key: Tuple[str, ...]) -> None:
+        with self._lock:
+            state = self._states[key]
+
+            if state.pending is None:
+                del self._states[key]
+                return
+
+            # No more changelists are merged into the run once it is started
+            pending = state.pending
+            state.pending = None
+
+        pending.ready.set()
+
+
+def setup_changelist_scheduler() -> Optional[ChangelistScheduler]:
+    """
+    Create `ChangelistScheduler` if it is enabled in `API_SETTINGS`.
+    """
+
+    if not API_SETTINGS.merge_changelist_runs:
+        return None
+
+    return ChangelistScheduler()
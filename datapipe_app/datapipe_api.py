@@ -11,7 +11,15 @@ from fastapi.staticfiles import StaticFiles
 
 import datapipe_app.api_v1alpha1 as api_v1alpha1
 import datapipe_app.api_v1alpha2 as api_v1alpha2
+from datapipe_app.graph import GraphSnapshotCache
+from datapipe_app.job_queue import JobQueue
 from datapipe_app.metrics import setup_prometheus_metrics
+from datapipe_app.read_engine import setup_read_replica
+from datapipe_app.result_cache import setup_result_cache
+from datapipe_app.settings import API_SETTINGS
+from datapipe_app.sort_indexes import setup_sort_indexes
+from datapipe_app.step_status import StepStatusCounters
+from datapipe_app.write_buffer import WriteBuffer
 
 
 class DatapipeAPI(FastAPI, DatapipeApp):
@@ -45,21 +53,75 @@ class DatapipeAPI(FastAPI, DatapipeApp):
 
         self.api = FastAPI()
 
+        if API_SETTINGS.read_replica_uri is not None:
+            setup_read_replica(self.ds.meta_dbconn, API_SETTINGS.read_replica_uri)
+
+        self.step_counters: Optional[StepStatusCounters] = None
+        if API_SETTINGS.step_status_reconcile_interval is not None:
+            self.step_counters = StepStatusCounters(
+                self.ds,
+                self.steps,
+                reconcile_interval=API_SETTINGS.step_status_reconcile_interval,
+            )
+            self.step_counters.start()
+
+        # Shared by both API versions, so that writes of one invalidate reads
+        # of the other
+        self.result_cache = setup_result_cache()
+        self.sort_indexes = setup_sort_indexes()
+
+        self.graph_cache = GraphSnapshotCache(
+            self.ds,
+            self.catalog,
+            self.steps,
+            refresh_interval=API_SETTINGS.graph_refresh_interval,
+            max_workers=API_SETTINGS.graph_max_workers,
+            item_timeout=API_SETTINGS.graph_item_timeout,
+            step_counters=self.step_counters,
+        )
+
         setup_prometheus_metrics(
             app=self,
             app_name="datapipe",
             datapipe_app=self,
+            step_counters=self.step_counters,
         )
 
-        self.api.mount(
-            "/v1alpha1",
-            api_v1alpha1.make_app(self.ds, self.catalog, self.pipeline, self.steps),
-            name="v1alpha1",
+        api_v1alpha1_app = api_v1alpha1.make_app(
+            self.ds,
+            self.catalog,
+            self.pipeline,
+            self.steps,
+            graph_cache=self.graph_cache,
+            step_counters=self.step_counters,
+            result_cache=self.result_cache,
+            sort_indexes=self.sort_indexes,
         )
 
+        # Buffered upserts are flushed on shutdown
+        self.write_buffer: Optional[WriteBuffer] = api_v1alpha1_app.state.write_buffer
+        if self.write_buffer is not None:
+            self.router.add_event_handler("shutdown", self.write_buffer.stop)
+
+        # Running jobs are waited for on shutdown, queued ones stay pending
+        self.job_queue: Optional[JobQueue] = api_v1alpha1_app.state.job_queue
+        if self.job_queue is not None:
+            self.router.add_event_handler("shutdown", self.job_queue.stop)
+
+        self.api.mount("/v1alpha1", api_v1alpha1_app, name="v1alpha1")
+
         self.api.mount(
             "/v1alpha2",
-            api_v1alpha2.make_app(self.ds, self.catalog, self.pipeline, self.steps),
+            api_v1alpha2.make_app(
+                self.ds,
+                self.catalog,
+                self.pipeline,
+                self.steps,
+                graph_cache=self.graph_cache,
+                step_counters=self.step_counters,
+                result_cache=self.result_cache,
+                sort_indexes=self.sort_indexes,
+            ),
             name="v1alpha2",
         )
 
@@ -0,0 +1,345 @@
+import asyncio
+import threading
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from datapipe.compute import Catalog, ComputeStep, DataStore, StepStatus
+from datapipe.step.batch_transform import BaseBatchTransformStep
+from starlette.concurrency import run_in_threadpool
+
+from datapipe_app import models
+from datapipe_app.periodic import PeriodicTask
+from datapipe_app.read_engine import run_read
+from datapipe_app.settings import API_SETTINGS
+from datapipe_app.step_status import StepStatusCounters, get_step_status
+from datapipe_app.table_size import get_table_size
+
+
+def table_response(
+    ds: DataStore,
+    catalog: Catalog,
+    table_name: str,
+    size: Optional[Tuple[int, bool]],
+    timed_out: bool = False,
+) -> models.TableResponse:
+    tbl = catalog.get_datatable(ds, table_name)
+
+    return models.TableResponse(
+        name=tbl.name,
+        indexes=tbl.primary_keys,
+        size=size[0] if size is not None else None,
+        size_is_estimate=size[1] if size is not None else False,
+        store_class=tbl.table_store.__class__.__name__,
+        timed_out=timed_out,
+    )
+
+
+def pipeline_step_response(
+    step: ComputeStep,
+    step_status: Optional[StepStatus],
+    timed_out: bool = False,
+) -> models.PipelineStepResponse:
+    inputs = [i.dt.name for i in step.input_dts]
+    outputs = [i.name for i in step.output_dts]
+
+    if isinstance(step, BaseBatchTransformStep):
+        return models.PipelineStepResponse(
+            type="transform",
+            transform_type=step.__class__.__name__,
+            name=step.get_name(),
+            indexes=step.transform_keys,
+            inputs=inputs,
+            outputs=outputs,
+            total_idx_count=(step_status.total_idx_count if step_status else None),
+            changed_idx_count=(step_status.changed_idx_count if step_status else None),
+            timed_out=timed_out,
+        )
+
+    else:
+        return models.PipelineStepResponse(
+            type="transform",
+            transform_type=step.__class__.__name__,
+            name=step.get_name(),
+            inputs=inputs,
+            outputs=outputs,
+        )
+
+
+def downstream_steps_index(steps: List[ComputeStep]) -> Dict[str, List[ComputeStep]]:
+    """
+    Steps transitively downstream of every table read by `steps`, in order of
+    `steps`.
+    """
+
+    readers: Dict[str, List[int]] = {}
+    for i, step in enumerate(steps):
+        for inp in step.input_dts:
+            readers.setdefault(inp.dt.name, []).append(i)
+
+    index = {}
+
+    for table_name in readers:
+        visited: Set[int] = set()
+        queue = [table_name]
+
+        while len(queue) > 0:
+            for i in readers.get(queue.pop(), []):
+                if i not in visited:
+                    visited.add(i)
+                    queue.extend(dt.name for dt in steps[i].output_dts)
+
+        index[table_name] = [steps[i] for i in sorted(visited)]
+
+    return index
+
+
+def _get_table_size(ds: DataStore, catalog: Catalog, table_name: str) -> Tuple[int, bool]:
+    return get_table_size(
+        catalog.get_datatable(ds, table_name),
+        approximate=API_SETTINGS.approximate_table_sizes,
+        exact_threshold=API_SETTINGS.approximate_table_sizes_threshold,
+    )
+
+
+def graph_response(
+    ds: DataStore,
+    catalog: Catalog,
+    steps: List[ComputeStep],
+    table_sizes: Dict[str, Tuple[Optional[Tuple[int, bool]], bool]],
+    step_statuses: Dict[str, Tuple[Optional[StepStatus], bool]],
+    computed_at: datetime,
+) -> models.GraphResponse:
+    return models.GraphResponse(
+        catalog={
+            table_name: table_response(ds, catalog, table_name, *table_sizes[table_name])
+            for table_name in catalog.catalog.keys()
+        },
+        pipeline=[pipeline_step_response(step, *step_statuses.get(step.name, (None, False))) for step in steps],
+        computed_at=computed_at,
+    )
+
+
+def build_graph(
+    ds: DataStore,
+    catalog: Catalog,
+    steps: List[ComputeStep],
+    executor: Optional[Executor] = None,
+    item_timeout: Optional[float] = None,
+    step_counters: Optional[StepStatusCounters] = None,
+) -> models.GraphResponse:
+    """
+    Build `GraphResponse` for the pipeline.
+
+    Table sizes and step statuses are independent queries, when `executor` is
+    given they are computed in parallel. Items which are not ready within
+    `item_timeout` seconds from the start are returned with empty counters and
+    `timed_out` flag.
+
+    If `step_counters` is given, step statuses are taken from it instead of
+    querying the database.
+    """
+
+    computed_at = datetime.now(tz=timezone.utc)
+
+    def get_status(step: ComputeStep) -> StepStatus:
+        if step_counters is not None:
+            return step_counters.get_status(step)
+        return get_step_status(ds, step)
+
+    status_steps = [
+        step for step in steps if isinstance(step, BaseBatchTransformStep) and API_SETTINGS.show_step_status
+    ]
+
+    if executor is None:
+        table_sizes: Dict[str, Tuple[Optional[Tuple[int, bool]], bool]] = {
+            table_name: (_get_table_size(ds, catalog, table_name), False) for table_name in catalog.catalog.keys()
+        }
+        step_statuses: Dict[str, Tuple[Optional[StepStatus], bool]] = {
+            step.name: (get_status(step), False) for step in status_steps
+        }
+
+    else:
+        size_futures = {
+            table_name: executor.submit(_get_table_size, ds, catalog, table_name)
+            for table_name in catalog.catalog.keys()
+        }
+        status_futures = {step.name: executor.submit(get_status, step) for step in status_steps}
+
+        all_futures: List[Future] = [*size_futures.values(), *status_futures.values()]
+        wait(all_futures, timeout=item_timeout)
+
+        def _result(future: Future) -> Tuple[Any, bool]:
+            if future.done():
+                return future.result(), False
+
+            # Do not occupy the pool with items nobody waits for anymore
+            future.cancel()
+            return None, True
+
+        table_sizes = {table_name: _result(future) for table_name, future in size_futures.items()}
+        step_statuses = {step_name: _result(future) for step_name, future in status_futures.items()}
+
+    return graph_response(ds, catalog, steps, table_sizes, step_statuses, computed_at)
+
+
+async def build_graph_async(
+    ds: DataStore,
+    catalog: Catalog,
+    steps: List[ComputeStep],
+    item_timeout: Optional[float] = None,
+    step_counters: Optional[StepStatusCounters] = None,
+    max_concurrency: int = 8,
+) -> models.GraphResponse:
+    """
+    Same as `build_graph`, but table sizes and step statuses are computed
+    concurrently with `run_read`, at most `max_concurrency` at once. Without
+    async engines reads run in the shared threadpool, so they must not take
+    all of it.
+    """
+
+    computed_at = datetime.now(tz=timezone.utc)
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def get_size(table_name: str) -> Tuple[int, bool]:
+        dt = catalog.get_datatable(ds, table_name)
+
+        async with semaphore:
+            return await run_read(
+                dt.meta_table.dbconn,
+                lambda conn: get_table_size(
+                    dt,
+                    approximate=API_SETTINGS.approximate_table_sizes,
+                    exact_threshold=API_SETTINGS.approximate_table_sizes_threshold,
+                    conn=conn,
+                ),
+            )
+
+    async def get_status(step: ComputeStep) -> StepStatus:
+        async with semaphore:
+            if step_counters is not None:
+                return await run_in_threadpool(step_counters.get_status, step)
+            return await run_read(ds.meta_dbconn, lambda conn: get_step_status(ds, step, conn))
+
+    status_steps = [
+        step for step in steps if isinstance(step, BaseBatchTransformStep) and API_SETTINGS.show_step_status
+    ]
+
+    size_tasks = {table_name: asyncio.ensure_future(get_size(table_name)) for table_name in catalog.catalog.keys()}
+    status_tasks = {step.name: asyncio.ensure_future(get_status(step)) for step in status_steps}
+
+    all_tasks: List[asyncio.Future] = [*size_tasks.values(), *status_tasks.values()]
+    if len(all_tasks) > 0:
+        await asyncio.wait(all_tasks, timeout=item_timeout)
+
+    def _result(task: asyncio.Future) -> Tuple[Any, bool]:
+        if task.done():
+            return task.result(), False
+
+        task.cancel()
+        return None, True
+
+    table_sizes = {table_name: _result(task) for table_name, task in size_tasks.items()}
+    step_statuses = {step_name: _result(task) for step_name, task in status_tasks.items()}
+
+    return graph_response(ds, catalog, steps, table_sizes, step_statuses, computed_at)
+
+
+class GraphSnapshotCache:
+    """
+    Keeps the last computed `GraphResponse` in memory and refreshes it in
+    background every `refresh_interval` seconds.
+
+    If `refresh_interval` is None, graph is computed on every request.
+
+    Table sizes and step statuses are computed by a pool of `max_workers`
+    threads, see `build_graph` for `item_timeout` semantics.
+    """
+
+    def __init__(
+        self,
+        ds: DataStore,
+        catalog: Catalog,
+        steps: List[ComputeStep],
+        refresh_interval: Optional[float] = None,
+        max_workers: int = 8,
+        item_timeout: Optional[float] = None,
+        step_counters: Optional[StepStatusCounters] = None,
+    ) -> None:
+        self.ds = ds
+        self.catalog = catalog
+        self.steps = steps
+        self.refresh_interval = refresh_interval
+        self.item_timeout = item_timeout
+        self.step_counters = step_counters
+        self.max_workers = max_workers
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="datapipe-app-graph")
+
+        self._snapshot: Optional[models.GraphResponse] = None
+        self._lock = threading.Lock()
+        self._refresh_task: Optional[PeriodicTask] = None
+
+        if refresh_interval is not None:
+            self._refresh_task = PeriodicTask(
+                name="datapipe-app-graph-refresh",
+                interval=refresh_interval,
+                func=self.refresh,
+            )
+
+    def _build(self) -> models.GraphResponse:
+        return build_graph(
+            self.ds,
+            self.catalog,
+            self.steps,
+            executor=self._executor,
+            item_timeout=self.item_timeout,
+            step_counters=self.step_counters,
+        )
+
+    def refresh(self) -> models.GraphResponse:
+        graph = self._build()
+
+        if self.refresh_interval is not None:
+            assert graph.computed_at is not None
+            graph.stale_after = graph.computed_at + timedelta(seconds=self.refresh_interval)
+
+        self._snapshot = graph
+
+        return graph
+
+    async def get_async(self) -> models.GraphResponse:
+        if self._refresh_task is None:
+            return await build_graph_async(
+                self.ds,
+                self.catalog,
+                self.steps,
+                item_timeout=self.item_timeout,
+                step_counters=self.step_counters,
+                max_concurrency=self.max_workers,
+            )
+
+        if self._snapshot is None:
+            return await run_in_threadpool(self.get)
+
+        return self._snapshot
+
+    def get(self) -> models.GraphResponse:
+        if self._refresh_task is None:
+            return self._build()
+
+        if self._snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self.refresh()
+                    self._refresh_task.start()
+
+        assert self._snapshot is not None
+        return self._snapshot
+
+    def stop(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.stop()
+
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,170 @@
+import io
+import json
+import shutil
+import tempfile
+import time
+from typing import Any, AsyncIterator, BinaryIO, Dict, Iterator, List, Literal, Optional, Tuple
+
+import anyio.from_thread
+import pandas as pd
+from datapipe.datatable import DataTable
+from datapipe.types import ChangeList, IndexDF
+from fastapi import HTTPException
+
+IngestFormat = Literal["ndjson", "csv", "parquet", "arrow"]
+
+# Request content types of ingest formats
+INGEST_MEDIA_TYPES: Dict[str, IngestFormat] = {
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "text/csv": "csv",
+    "application/vnd.apache.parquet": "parquet",
+    "application/x-parquet": "parquet",
+    "application/vnd.apache.arrow.stream": "arrow",
+}
+
+
+def ingest_format(content_type: Optional[str]) -> IngestFormat:
+    media_type = (content_type or "").split(";")[0].strip().lower()
+
+    if media_type not in INGEST_MEDIA_TYPES:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Unsupported content type {media_type!r}, expected one of {', '.join(INGEST_MEDIA_TYPES)}",
+        )
+
+    return INGEST_MEDIA_TYPES[media_type]
+
+
+class RequestBodyReader(io.RawIOBase):
+    """
+    Blocking file-like view of a request body stream, so that sync parsers
+    running in threadpool can read the body while it is being received.
+    """
+
+    def __init__(self, stream: AsyncIterator[bytes]) -> None:
+        self._stream = stream
+        self._buffer = b""
+        self._eof = False
+
+    async def _next(self) -> bytes:
+        try:
+            return await self._stream.__anext__()
+        except StopAsyncIteration:
+            self._eof = True
+            return b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        while len(self._buffer) == 0 and not self._eof:
+            self._buffer = anyio.from_thread.run(self._next)
+
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+
+        return size
+
+
+def _iter_ndjson(body: BinaryIO, chunk_size: int) -> Iterator[pd.DataFrame]:
+    records: List[Dict[str, Any]] = []
+
+    for line in io.TextIOWrapper(body, encoding="utf-8"):
+        if line.strip() == "":
+            continue
+
+        records.append(json.loads(line))
+
+        if len(records) >= chunk_size:
+            yield pd.DataFrame.from_records(records)
+            records = []
+
+    if len(records) > 0:
+        yield pd.DataFrame.from_records(records)
+
+
+def _iter_arrow_batches(batches: Iterator[Any], chunk_size: int) -> Iterator[pd.DataFrame]:
+    for batch in batches:
+        for offset in range(0, batch.num_rows, chunk_size):
+            yield batch.slice(offset, chunk_size).to_pandas()
+
+
+def iter_chunks(body: BinaryIO, format: IngestFormat, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """
+    Parse `body` incrementally into DataFrames of at most `chunk_size` rows.
+
+    Parquet keeps its metadata at the end of the file, so the body is spooled
+    to a temporary file first.
+    """
+
+    if format == "ndjson":
+        yield from _iter_ndjson(body, chunk_size)
+        return
+
+    if format == "csv":
+        yield from pd.read_csv(body, chunksize=chunk_size)
+        return
+
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise HTTPException(status_code=415, detail=f"{format} format requires pyarrow, install datapipe-app[arrow]")
+
+    if format == "arrow":
+        yield from _iter_arrow_batches(iter(pa.ipc.open_stream(body)), chunk_size)
+        return
+
+    with tempfile.TemporaryFile() as file:
+        shutil.copyfileobj(body, file)
+        file.seek(0)
+
+        yield from _iter_arrow_batches(pq.ParquetFile(file).iter_batches(batch_size=chunk_size), chunk_size)
+
+
+class IngestError(Exception):
+    """
+    Failure of ingest after `rows` rows in `chunks` chunks were already stored,
+    their indexes are in `changelist`.
+    """
+
+    def __init__(self, error: Exception, changelist: ChangeList, rows: int, chunks: int) -> None:
+        super().__init__(str(error))
+        self.error = error
+        self.changelist = changelist
+        self.rows = rows
+        self.chunks = chunks
+
+
+def _changelist(dt: DataTable, idxs: List[IndexDF]) -> ChangeList:
+    cl = ChangeList()
+    if len(idxs) > 0:
+        cl.append(dt.name, IndexDF(pd.concat(idxs, axis="index")))
+
+    return cl
+
+
+def ingest_chunks(dt: DataTable, chunks: Iterator[pd.DataFrame]) -> Tuple[ChangeList, int, int, float]:
+    """
+    Store `chunks` into `dt` one by one.
+
+    Returns one changelist of all stored chunks, number of rows, number of
+    chunks and seconds it took. Raises `IngestError` with chunks stored so
+    far if parsing or storing fails midway.
+    """
+
+    start = time.monotonic()
+
+    idxs: List[IndexDF] = []
+    rows = 0
+
+    try:
+        for chunk in chunks:
+            idxs.append(dt.store_chunk(chunk))
+            rows += len(chunk)
+    except Exception as e:
+        raise IngestError(e, _changelist(dt, idxs), rows, len(idxs)) from e
+
+    return _changelist(dt, idxs), rows, len(idxs), time.monotonic() - start
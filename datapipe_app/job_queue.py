@@ -0,0 +1,239 @@
+import io
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Literal, Optional
+
+import pandas as pd
+import sqlalchemy as sa
+from datapipe.compute import ComputeStep
+from datapipe.types import ChangeList, IndexDF
+
+from datapipe_app.settings import API_SETTINGS
+
+logger = logging.getLogger("datapipe_app.job_queue")
+
+JobStatus = Literal["pending", "running", "done", "failed"]
+
+
+def dump_changelist(changelist: ChangeList) -> str:
+    """
+    Serialize `changelist` as JSON with dtypes of the indexes preserved, so
+    that datetime and other non-JSON keys match the stored rows when the job
+    runs.
+    """
+
+    return json.dumps(
+        {
+            table_name: {
+                "dtypes": {column: str(dtype) for column, dtype in idx.dtypes.items()},
+                # Table schema keeps types which plain JSON loses, dtypes
+                # restore the rest (datetime resolution, string dtype)
+                "data": pd.DataFrame(idx).to_json(orient="table", index=False, date_unit="ns"),
+            }
+            for table_name, idx in changelist.changes.items()
+        }
+    )
+
+
+def load_changelist(data: str) -> ChangeList:
+    cl = ChangeList()
+
+    for table_name, item in json.loads(data).items():
+        idx = pd.read_json(io.StringIO(item["data"]), orient="table").astype(item["dtypes"])
+        cl.append(table_name, IndexDF(idx))
+
+    return cl
+
+
+class JobQueue:
+    """
+    Durable queue of changelist runs, stored in a database at `uri` and
+    processed by at most `max_workers` threads.
+
+    Jobs which were running when the process stopped are retried on `start`,
+    up to `max_attempts` runs per job. Queue database must not be shared by
+    several processes.
+    """
+
+    def __init__(
+        self,
+        uri: str,
+        steps: List[ComputeStep],
+        run_func: Callable[[List[ComputeStep], ChangeList], None],
+        max_workers: int = 4,
+        max_attempts: int = 3,
+        retention: float = 7 * 24 * 3600,
+    ) -> None:
+        self.steps = steps
+        self.run_func = run_func
+        self.max_attempts = max_attempts
+        self.retention = retention
+
+        self.engine = sa.create_engine(uri)
+
+        self.metadata = sa.MetaData()
+        self.jobs = sa.Table(
+            "datapipe_app_jobs",
+            self.metadata,
+            sa.Column("job_id", sa.String(32), primary_key=True),
+            sa.Column("status", sa.String(16), nullable=False, index=True),
+            sa.Column("steps", sa.Text(), nullable=False),
+            # Indexes as JSON, see `dump_changelist`
+            sa.Column("changelist", sa.Text(), nullable=False),
+            sa.Column("attempts", sa.Integer(), nullable=False, default=0),
+            sa.Column("error", sa.Text()),
+            sa.Column("created_at", sa.Float(), nullable=False),
+            sa.Column("updated_at", sa.Float(), nullable=False),
+        )
+        self.metadata.create_all(self.engine)
+
+        # SQLite allows one writer at a time
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job-queue")
+
+    def start(self) -> None:
+        """
+        Re-submit jobs left pending or interrupted by the previous run.
+        """
+
+        with self._lock, self.engine.begin() as conn:
+            conn.execute(
+                self.jobs.update()
+                .where(self.jobs.c.status == "running", self.jobs.c.attempts >= self.max_attempts)
+                .values(status="failed", error="Interrupted too many times", updated_at=time.time())
+            )
+            conn.execute(self.jobs.update().where(self.jobs.c.status == "running").values(status="pending"))
+
+            job_ids = conn.execute(
+                sa.select(self.jobs.c.job_id).where(self.jobs.c.status == "pending").order_by(self.jobs.c.created_at)
+            ).scalars().all()
+
+        if len(job_ids) > 0:
+            logger.info(f"Resuming {len(job_ids)} jobs")
+
+        for job_id in job_ids:
+            self._executor.submit(self._run, job_id)
+
+    def submit(self, steps: List[ComputeStep], changelist: ChangeList) -> str:
+        """
+        Store job which runs `steps` on `changelist` and queue it, returns job id.
+        """
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+
+        with self._lock, self.engine.begin() as conn:
+            conn.execute(
+                self.jobs.insert().values(
+                    job_id=job_id,
+                    status="pending",
+                    steps=json.dumps([step.name for step in steps]),
+                    changelist=dump_changelist(changelist),
+                    attempts=0,
+                    created_at=now,
+                    updated_at=now,
+                )
+            )
+
+        self._executor.submit(self._run, job_id)
+
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                sa.select(
+                    self.jobs.c.job_id,
+                    self.jobs.c.status,
+                    self.jobs.c.attempts,
+                    self.jobs.c.error,
+                    self.jobs.c.created_at,
+                    self.jobs.c.updated_at,
+                ).where(self.jobs.c.job_id == job_id)
+            ).first()
+
+        return dict(row._mapping) if row is not None else None
+
+    def _set_status(self, job_id: str, status: JobStatus, **values: Any) -> None:
+        with self._lock, self.engine.begin() as conn:
+            conn.execute(
+                self.jobs.update()
+                .where(self.jobs.c.job_id == job_id)
+                .values(status=status, updated_at=time.time(), **values)
+            )
+
+    def _run(self, job_id: str) -> None:
+        with self._lock, self.engine.begin() as conn:
+            job = conn.execute(
+                sa.select(self.jobs.c.steps, self.jobs.c.changelist, self.jobs.c.attempts).where(
+                    self.jobs.c.job_id == job_id, self.jobs.c.status == "pending"
+                )
+            ).first()
+
+            if job is None:
+                return
+
+            conn.execute(
+                self.jobs.update()
+                .where(self.jobs.c.job_id == job_id)
+                .values(status="running", attempts=job.attempts + 1, updated_at=time.time())
+            )
+
+        # Steps are referenced by name, the ones gone from the pipeline are skipped
+        step_names = set(json.loads(job.steps))
+        steps = [step for step in self.steps if step.name in step_names]
+
+        try:
+            self.run_func(steps, load_changelist(job.changelist))
+        except Exception as e:
+            logger.exception(f"Job {job_id} failed")
+            self._set_status(job_id, "failed", error=repr(e))
+        else:
+            self._set_status(job_id, "done")
+
+        self._purge()
+
+    def _purge(self) -> None:
+        with self._lock, self.engine.begin() as conn:
+            conn.execute(
+                self.jobs.delete().where(
+                    self.jobs.c.status.in_(["done", "failed"]),
+                    self.jobs.c.updated_at < time.time() - self.retention,
+                )
+            )
+
+    def stop(self) -> None:
+        """
+        Wait for running jobs, queued ones stay pending until the next start.
+        """
+
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def setup_job_queue(
+    steps: List[ComputeStep],
+    run_func: Callable[[List[ComputeStep], ChangeList], None],
+) -> Optional[JobQueue]:
+    """
+    Create and start `JobQueue` configured by `API_SETTINGS`, None if it is
+    disabled.
+    """
+
+    if API_SETTINGS.job_queue_uri is None:
+        return None
+
+    job_queue = JobQueue(
+        API_SETTINGS.job_queue_uri,
+        steps,
+        run_func,
+        max_workers=API_SETTINGS.job_queue_max_workers,
+        max_attempts=API_SETTINGS.job_queue_max_attempts,
+        retention=API_SETTINGS.job_queue_retention,
+    )
+    job_queue.start()
+
+    return job_queue
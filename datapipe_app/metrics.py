@@ -1,27 +1,94 @@
-from typing import Iterable
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
 
-from datapipe.compute import DatapipeApp
+from datapipe.compute import DatapipeApp, StepStatus
 from fastapi import FastAPI
 from prometheus_client import Metric
 from prometheus_client.core import REGISTRY, GaugeMetricFamily
 from prometheus_client.registry import Collector
 from starlette_exporter import PrometheusMiddleware, handle_metrics
 
+from datapipe_app.periodic import PeriodicTask
+from datapipe_app.read_engine import ReadPoolCollector, read_pool_enabled
 from datapipe_app.settings import API_SETTINGS
+from datapipe_app.step_status import StepStatusCounters, get_step_status
+
+
+@dataclass
+class StepStatusSnapshot:
+    computed_at: float
+    statuses: Dict[str, StepStatus]
+    durations: Dict[str, float]
 
 
 class PipelineStatusCollector(Collector):
+    """
+    Exports step statuses as Prometheus metrics.
+
+    By default statuses are computed during the scrape. If `snapshot_interval`
+    is set, statuses are computed by a background thread every
+    `snapshot_interval` seconds and scrape only emits the last snapshot.
+
+    If `step_counters` is given, statuses are taken from it instead of
+    querying the database.
+    """
+
     def __init__(
         self,
         datapipe_app: DatapipeApp,
+        snapshot_interval: Optional[float] = None,
+        step_counters: Optional[StepStatusCounters] = None,
     ) -> None:
         super().__init__()
 
         self.datapipe_app = datapipe_app
+        self.snapshot_interval = snapshot_interval
+        self.step_counters = step_counters
+
+        self._snapshot: Optional[StepStatusSnapshot] = None
+        self._snapshot_task: Optional[PeriodicTask] = None
+
+        if snapshot_interval is not None:
+            self._snapshot_task = PeriodicTask(
+                name="datapipe-app-status-snapshot",
+                interval=snapshot_interval,
+                func=self.refresh,
+                run_immediately=True,
+            )
+            self._snapshot_task.start()
 
     def describe(self) -> Iterable[Metric]:
         return []
 
+    def compute_snapshot(self) -> StepStatusSnapshot:
+        statuses = {}
+        durations = {}
+
+        for step in self.datapipe_app.steps:
+            start = time.monotonic()
+            try:
+                if self.step_counters is not None:
+                    statuses[step.name] = self.step_counters.get_status(step)
+                else:
+                    statuses[step.name] = get_step_status(self.datapipe_app.ds, step)
+            except NotImplementedError:
+                continue
+            durations[step.name] = time.monotonic() - start
+
+        return StepStatusSnapshot(
+            computed_at=time.time(),
+            statuses=statuses,
+            durations=durations,
+        )
+
+    def refresh(self) -> None:
+        self._snapshot = self.compute_snapshot()
+
+    def stop(self) -> None:
+        if self._snapshot_task is not None:
+            self._snapshot_task.stop()
+
     def collect(self) -> Iterable[Metric]:
         total_counts = GaugeMetricFamily(
             "datapipe_step_total_idx_count",
@@ -35,23 +102,40 @@ class PipelineStatusCollector(Collector):
             labels=["step_name"],
         )
 
-        for step in self.datapipe_app.steps:
-            try:
-                step_status = step.get_status(self.datapipe_app.ds)
+        durations = GaugeMetricFamily(
+            "datapipe_step_status_duration_seconds",
+            "Time spent computing status of datapipe step",
+            labels=["step_name"],
+        )
 
-                total_counts.add_metric([step.name], step_status.total_idx_count)
-                changed_counts.add_metric([step.name], step_status.changed_idx_count)
-            except NotImplementedError:
-                pass
+        if self._snapshot_task is None:
+            snapshot: Optional[StepStatusSnapshot] = self.compute_snapshot()
+        else:
+            snapshot = self._snapshot
+
+        if snapshot is not None:
+            for step_name, step_status in snapshot.statuses.items():
+                total_counts.add_metric([step_name], step_status.total_idx_count)
+                changed_counts.add_metric([step_name], step_status.changed_idx_count)
+                durations.add_metric([step_name], snapshot.durations[step_name])
 
         yield total_counts
         yield changed_counts
+        yield durations
+
+        if self._snapshot_task is not None and snapshot is not None:
+            yield GaugeMetricFamily(
+                "datapipe_step_status_snapshot_age_seconds",
+                "Age of the last computed step status snapshot",
+                value=time.time() - snapshot.computed_at,
+            )
 
 
 def setup_prometheus_metrics(
     app: FastAPI,
     app_name: str,
     datapipe_app: DatapipeApp,
+    step_counters: Optional[StepStatusCounters] = None,
 ):
     app.add_middleware(
         PrometheusMiddleware,
@@ -69,5 +153,14 @@ def setup_prometheus_metrics(
     )
     app.add_route("/metrics", handle_metrics)
 
+    if read_pool_enabled():
+        REGISTRY.register(ReadPoolCollector())
+
     if API_SETTINGS.show_step_status:
-        REGISTRY.register(PipelineStatusCollector(datapipe_app))
+        REGISTRY.register(
+            PipelineStatusCollector(
+                datapipe_app,
+                snapshot_interval=API_SETTINGS.metrics_snapshot_interval,
+                step_counters=step_counters,
+            )
+        )
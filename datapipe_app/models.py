@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import Any, Dict, List, Literal, Optional
 
 from pydantic import BaseModel, Field
@@ -17,20 +18,31 @@ class PipelineStepResponse(BaseModel):
     total_idx_count: Optional[int] = None
     changed_idx_count: Optional[int] = None
 
+    # Step status was not computed in time
+    timed_out: bool = False
+
 
 class TableResponse(BaseModel):
     name: str
 
     indexes: List[str]
 
-    size: int
+    size: Optional[int] = None
+    # Size is taken from database statistics and is not exact
+    size_is_estimate: bool = False
     store_class: str
 
+    # Table size was not computed in time
+    timed_out: bool = False
+
 
 class GraphResponse(BaseModel):
     catalog: Dict[str, TableResponse]
     pipeline: List[PipelineStepResponse]
 
+    computed_at: Optional[datetime] = None
+    stale_after: Optional[datetime] = None
+
 
 class FocusFilter(BaseModel):
     table_name: str
@@ -40,18 +52,29 @@ class FocusFilter(BaseModel):
 class GetDataRequest(BaseModel):
     table: str
     filters: Dict[str, Any] = {}
-    page: int = 0
-    page_size: int = 20
+    page: int = Field(0, ge=0)
+    page_size: int = Field(20, ge=1)
     order_by: Optional[str] = None
     order: Literal["asc", "desc"] = "asc"
     focus: Optional[FocusFilter] = None
+    # How to compute `GetDataResponse.total`: exact COUNT, planner estimate
+    # (falls back to exact where not supported) or not at all
+    include_total: Literal["exact", "estimate", "none"] = "exact"
+    # Opaque cursor from `GetDataResponse.next_cursor`, when set `page` is
+    # ignored and the page starts right after the cursor
+    cursor: Optional[str] = None
 
 
 class GetDataResponse(BaseModel):
     page: int
     page_size: int
-    total: int
+    total: Optional[int] = None
+    total_is_estimate: bool = False
     data: List[Dict]
+    # Cursor of the next page, None if this page is the last one
+    next_cursor: Optional[str] = None
+    # Page was cut short to fit into `max_response_bytes`
+    truncated: bool = False
 
 
 class RunStepRequest(BaseModel):
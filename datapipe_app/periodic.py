@@ -0,0 +1,53 @@
+import logging
+import threading
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """
+    Runs `func` in a daemon thread every `interval` seconds until stopped.
+
+    If `run_immediately` is set, first run happens right after `start`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        interval: float,
+        func: Callable[[], Any],
+        run_immediately: bool = False,
+    ) -> None:
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.run_immediately = run_immediately
+
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def _run_once(self) -> None:
+        try:
+            self.func()
+        except Exception:
+            logger.exception(f"Periodic task {self.name} failed")
+
+    def _run(self) -> None:
+        if self.run_immediately:
+            self._run_once()
+
+        while not self._stop_event.wait(self.interval):
+            self._run_once()
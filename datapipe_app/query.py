@@ -0,0 +1,404 @@
+import base64
+import hashlib
+import json
+import operator
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterator, List, Literal, Optional, Tuple, Union
+
+import sqlalchemy as sa
+from fastapi import HTTPException
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.sql.expression import tuple_
+
+from datapipe_app.serialization import json_default, parse_datetime
+from datapipe_app.settings import API_SETTINGS
+
+
+@contextmanager
+def connect(bind: Union[Engine, Connection]) -> Iterator[Connection]:
+    """
+    Use `bind` if it is already a connection, open a new one otherwise.
+    """
+
+    if isinstance(bind, Connection):
+        yield bind
+    else:
+        with bind.connect() as conn:
+            yield conn
+
+
+def _python_value(column: sa.Column, value: Any) -> Any:
+    if value is None:
+        return None
+
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+
+    if python_type is datetime and isinstance(value, str):
+        return parse_datetime(value)
+
+    if python_type is date and isinstance(value, str):
+        return date.fromisoformat(value)
+
+    return value
+
+
+# Comparison operators of `GetDataRequest.filters`
+COMPARISON_OPERATORS = {
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+}
+
+FILTER_OPERATORS = {"in", "between", "prefix", "is_null", *COMPARISON_OPERATORS}
+
+
+def is_filter_operators(value: Any) -> bool:
+    return isinstance(value, dict) and len(value) > 0 and all(key in FILTER_OPERATORS for key in value)
+
+
+def _is_string_column(column: sa.Column) -> bool:
+    try:
+        return column.type.python_type is str
+    except NotImplementedError:
+        return False
+
+
+def _is_scalar_column(column: sa.Column) -> bool:
+    if isinstance(column.type, sa.JSON):
+        return False
+
+    try:
+        return column.type.python_type not in (dict, list)
+    except NotImplementedError:
+        return False
+
+
+def filter_clause(
+    sql_table: sa.Table,
+    name: str,
+    value: Any,
+    convert: Optional[Callable[[Any], Any]] = None,
+) -> Any:
+    """
+    Translate filter of column `name` into a where clause. `value` is either
+    compared for equality or is a dict of operators, all of which must match:
+
+    * `{"in": [a, b]}`
+    * `{"between": [a, b]}` - inclusive on both ends
+    * `{"gt": a}`, `{"gte": a}`, `{"lt": a}`, `{"lte": a}`
+    * `{"prefix": "abc"}` - string columns only
+    * `{"is_null": true}`
+
+    Operands are passed through `convert` (ISO strings are parsed for date
+    and datetime columns by default). Operands which can not be converted
+    and unknown operators return 400, dicts and lists are compared for
+    equality only on JSON columns.
+    """
+
+    if name not in sql_table.c:
+        raise HTTPException(status_code=400, detail=f"Unknown filter column {name}")
+
+    column = sql_table.c[name]
+
+    if convert is None:
+
+        def convert(value: Any) -> Any:
+            return _python_value(column, value)
+
+    scalar = _is_scalar_column(column)
+
+    def operand(arg: Any, op: str) -> Any:
+        if (op != "eq" or scalar) and isinstance(arg, (dict, list)):
+            raise HTTPException(status_code=400, detail=f"Filter `{op}` of {name} expects a scalar value")
+
+        try:
+            return convert(arg)
+        except (TypeError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid value of filter `{op}` of {name}: {e}")
+
+    if not is_filter_operators(value):
+        if scalar and isinstance(value, dict) and len(value) > 0:
+            unknown = ", ".join(sorted(key for key in value if key not in FILTER_OPERATORS))
+            raise HTTPException(status_code=400, detail=f"Unknown filter operator(s) {unknown} of {name}")
+
+        return column == operand(value, "eq")
+
+    clauses: List[Any] = []
+
+    for op, arg in value.items():
+        if op == "in":
+            if not isinstance(arg, list):
+                raise HTTPException(status_code=400, detail=f"Filter `in` of {name} expects a list")
+
+            clauses.append(column.in_([operand(item, op) for item in arg]))
+
+        elif op == "between":
+            if not isinstance(arg, list) or len(arg) != 2:
+                raise HTTPException(status_code=400, detail=f"Filter `between` of {name} expects [from, to]")
+
+            clauses.append(column.between(operand(arg[0], op), operand(arg[1], op)))
+
+        elif op == "prefix":
+            if not isinstance(arg, str) or not _is_string_column(column):
+                raise HTTPException(status_code=400, detail=f"Filter `prefix` of {name} expects a string column")
+
+            clauses.append(column.startswith(arg, autoescape=True))
+
+        elif op == "is_null":
+            clauses.append(column.is_(None) if arg else column.isnot(None))
+
+        else:
+            clauses.append(COMPARISON_OPERATORS[op](column, operand(arg, op)))
+
+    return sa.and_(*clauses)
+
+
+def order_columns(
+    sql_table: sa.Table,
+    primary_keys: List[str],
+    order_by: Optional[str],
+) -> List[sa.Column]:
+    """
+    Columns which define a stable order of rows: `order_by` column (if any)
+    followed by primary keys as a tiebreaker.
+    """
+
+    columns = []
+
+    if order_by:
+        if order_by not in sql_table.c:
+            raise HTTPException(status_code=400, detail=f"Unknown order_by column {order_by}")
+
+        columns.append(sql_table.c[order_by])
+
+    columns.extend(sql_table.c[key] for key in primary_keys if key != order_by)
+
+    return columns
+
+
+def apply_order(
+    sql: Any,
+    sql_table: sa.Table,
+    primary_keys: List[str],
+    order_by: Optional[str],
+    order: Literal["asc", "desc"],
+) -> Any:
+    columns = order_columns(sql_table, primary_keys, order_by)
+
+    if order_by:
+        sql = sql.where(columns[0].isnot(None))
+
+    if order == "desc":
+        return sql.order_by(*[column.desc() for column in columns])
+    else:
+        return sql.order_by(*[column.asc() for column in columns])
+
+
+def apply_page(
+    sql: Any,
+    sql_table: sa.Table,
+    primary_keys: List[str],
+    order_by: Optional[str],
+    order: Literal["asc", "desc"],
+    page: int,
+    page_size: int,
+    cursor: Optional[str] = None,
+) -> Any:
+    """
+    Order `sql` and restrict it to a single page, either after `cursor` or by
+    `page` number.
+    """
+
+    sql = apply_order(sql, sql_table, primary_keys, order_by, order)
+
+    if cursor is not None:
+        sql = apply_cursor(sql, cursor, sql_table, primary_keys, order_by, order)
+    else:
+        sql = sql.offset(page * page_size)
+
+    return sql.limit(page_size)
+
+
+def encode_cursor(
+    row: Dict[str, Any],
+    sql_table: sa.Table,
+    primary_keys: List[str],
+    order_by: Optional[str],
+    order: Literal["asc", "desc"],
+) -> str:
+    """
+    Build opaque cursor which points right after `row`.
+    """
+
+    columns = order_columns(sql_table, primary_keys, order_by)
+
+    payload = {
+        "order_by": order_by,
+        "order": order,
+        "values": [row[column.name] for column in columns],
+    }
+
+    return base64.urlsafe_b64encode(json.dumps(payload, default=json_default).encode()).decode()
+
+
+def apply_cursor(
+    sql: Any,
+    cursor: str,
+    sql_table: sa.Table,
+    primary_keys: List[str],
+    order_by: Optional[str],
+    order: Literal["asc", "desc"],
+) -> Any:
+    """
+    Restrict `sql` to rows after `cursor` in the order defined by `order_by`
+    and primary keys. Together with `apply_order` this turns every page into
+    an index seek instead of OFFSET scan.
+    """
+
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if payload.get("order_by") != order_by or payload.get("order") != order:
+        raise HTTPException(status_code=400, detail="Cursor does not match order_by/order of the request")
+
+    columns = order_columns(sql_table, primary_keys, order_by)
+    values = payload.get("values")
+
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    try:
+        values = [_python_value(column, value) for column, value in zip(columns, values)]
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if order == "desc":
+        return sql.where(tuple_(*columns) < tuple_(*values))
+    else:
+        return sql.where(tuple_(*columns) > tuple_(*values))
+
+
+def _focus_rows(items_idx: List[Dict[str, Any]], keys: List[str]) -> List[Dict[str, Any]]:
+    # Deduplicated in order, temporary table has a primary key
+    unique = {tuple(row[key] for key in keys): None for row in items_idx}
+
+    return [dict(zip(keys, values)) for values in unique]
+
+
+@contextmanager
+def focus_filter(
+    conn: Connection,
+    sql_table: sa.Table,
+    primary_keys: List[str],
+    items_idx: Optional[List[Dict[str, Any]]],
+) -> Iterator[Optional[Any]]:
+    """
+    Build a where clause which restricts `sql_table` to focused `items_idx`.
+    Only primary keys present in every item are used. Yields None if there is
+    nothing to filter.
+
+    Strategy depends on the number of items so that SQL stays small:
+
+    * up to `API_SETTINGS.focus_in_max_items` - tuple IN with a list of values
+    * up to `API_SETTINGS.focus_values_max_items` on Postgres - IN with a
+      VALUES list
+    * otherwise items are bulk-inserted into a temporary table on `conn`,
+      which is dropped on exit, so the query has to be executed on `conn`
+      inside the block. Read-only Postgres connections (read pool, replicas)
+      can not create tables and always use VALUES list
+    """
+
+    if items_idx is None:
+        yield None
+        return
+
+    if len(items_idx) == 0:
+        yield sa.false()
+        return
+
+    keys = [key for key in primary_keys if all(key in row for row in items_idx)]
+    if len(keys) == 0:
+        yield None
+        return
+
+    rows = _focus_rows(items_idx, keys)
+    columns = tuple_(*[sql_table.c[key] for key in keys])
+
+    if len(rows) <= API_SETTINGS.focus_in_max_items:
+        yield columns.in_([tuple(row[key] for key in keys) for row in rows])
+        return
+
+    read_only = conn.get_execution_options().get("postgresql_readonly", False)
+
+    if conn.dialect.name == "postgresql" and (read_only or len(rows) <= API_SETTINGS.focus_values_max_items):
+        values = sa.values(*[sa.column(key, sql_table.c[key].type) for key in keys], name="focus_idx").data(
+            [tuple(row[key] for key in keys) for row in rows]
+        )
+        yield columns.in_(sa.select(*values.c))
+        return
+
+    # Temporary tables are private to the connection. Name is derived from the
+    # items, so that counts of the same focus hit the count cache
+    digest = hashlib.md5(json.dumps([list(row.values()) for row in rows], default=json_default).encode()).hexdigest()
+
+    focus_table = sa.Table(
+        f"focus_idx_{digest[:16]}",
+        sa.MetaData(),
+        *[sa.Column(key, sql_table.c[key].type, primary_key=True) for key in keys],
+        prefixes=["TEMPORARY"],
+    )
+
+    # Table lives in a transaction of its own, or in a savepoint if the caller
+    # already has one, which is rolled back on exit
+    own_transaction = not conn.in_transaction()
+    transaction = conn.begin() if own_transaction else conn.begin_nested()
+
+    try:
+        focus_table.create(conn)
+        conn.execute(focus_table.insert(), rows)
+
+        yield columns.in_(sa.select(*focus_table.c))
+    finally:
+        transaction.rollback()
+
+        # Postgres drops the table with the rollback, pysqlite runs DDL
+        # outside of transactions
+        if own_transaction:
+            with conn.begin():
+                focus_table.drop(conn, checkfirst=True)
+        else:
+            focus_table.drop(conn, checkfirst=True)
+
+
+def fetch_rows(bind: Union[Engine, Connection], sql: Any) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """
+    Execute `sql` and return column names and rows as dicts.
+    """
+
+    with connect(bind) as conn:
+        result = conn.execute(sql)
+
+        return list(result.keys()), [dict(row) for row in result.mappings()]
+
+
+def iter_query_batches(engine: Engine, sql: Any, batch_size: int) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Execute `sql` with a server-side cursor and yield rows in batches of
+    `batch_size`, so memory does not depend on the size of the result.
+    """
+
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(sql)
+
+        for partition in result.mappings().partitions(batch_size):
+            yield [dict(row) for row in partition]
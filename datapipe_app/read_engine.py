@@ -0,0 +1,382 @@
+import asyncio
+import importlib
+import logging
+import threading
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, Optional, TypeVar
+
+from datapipe.store.database import DBConn
+from fastapi import HTTPException, Request
+from prometheus_client import Counter, Metric
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.pool import NullPool, QueuePool
+from starlette.concurrency import run_in_threadpool
+
+from datapipe_app.settings import API_SETTINGS
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger("datapipe_app.read_engine")
+
+T = TypeVar("T")
+
+# Async drivers by database backend
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+}
+
+READ_QUERIES_TIMED_OUT = Counter(
+    "datapipe_app_read_queries_timed_out",
+    "Number of API reads cancelled by timeout",
+)
+READ_QUERIES_CANCELLED = Counter(
+    "datapipe_app_read_queries_cancelled",
+    "Number of API reads cancelled because the client disconnected",
+)
+
+_engines: Dict[str, Engine] = {}
+_async_engines: Dict[str, Optional["AsyncEngine"]] = {}
+_replicas: Dict[str, str] = {}
+_lock = threading.Lock()
+
+
+def read_pool_enabled() -> bool:
+    return API_SETTINGS.read_pool_size is not None or len(_replicas) > 0
+
+
+def setup_read_replica(dbconn: DBConn, replica_uri: str) -> None:
+    """
+    Route API reads of tables stored in `dbconn` to `replica_uri`.
+    """
+
+    with _lock:
+        _replicas[dbconn.connstr] = replica_uri
+        _engines.pop(dbconn.connstr, None)
+        _async_engines.pop(dbconn.connstr, None)
+
+
+def _create_read_engine(dbconn: DBConn) -> Engine:
+    connstr = _replicas.get(dbconn.connstr, dbconn.connstr)
+
+    if connstr.startswith("sqlite") or connstr.startswith("pysqlite"):
+        # SQLite connections are cheap, SingletonThreadPool closes connections
+        # of other threads once there are more than `pool_size` of them
+        return create_engine(
+            connstr,
+            **{
+                **dbconn.create_engine_kwargs,
+                "poolclass": NullPool,
+            },
+        )
+
+    # Read pool settings override the ones of `dbconn`
+    return create_engine(
+        connstr,
+        **{
+            **dbconn.create_engine_kwargs,
+            "poolclass": QueuePool,
+            "pool_size": API_SETTINGS.read_pool_size or 5,
+            "max_overflow": API_SETTINGS.read_pool_max_overflow,
+            "pool_timeout": API_SETTINGS.read_pool_timeout,
+            "pool_pre_ping": True,
+            "pool_recycle": 3600,
+            "execution_options": {
+                **dbconn.create_engine_kwargs.get("execution_options", {}),
+                "postgresql_readonly": True,
+            },
+        },
+    )
+
+
+def read_engine(dbconn: DBConn) -> Engine:
+    """
+    Engine for API reads of tables stored in `dbconn`.
+
+    When read pool is enabled (`read_pool_size` or a read replica is set),
+    reads go through a separate pool (read-only on Postgres), so that API
+    and running transforms do not compete for connections. Otherwise the
+    engine of `dbconn` is used.
+    """
+
+    if not read_pool_enabled():
+        return dbconn.con
+
+    with _lock:
+        engine = _engines.get(dbconn.connstr)
+
+        if engine is None:
+            engine = _create_read_engine(dbconn)
+            _engines[dbconn.connstr] = engine
+
+        return engine
+
+
+def _create_async_read_engine(dbconn: DBConn) -> Optional["AsyncEngine"]:
+    url = make_url(_replicas.get(dbconn.connstr, dbconn.connstr))
+
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        return None
+
+    try:
+        # Requires greenlet
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        importlib.import_module(driver)
+    except ImportError as e:
+        logger.warning(f"Async reads of {url.get_backend_name()} are not available, using threadpool: {e}")
+        return None
+
+    url = url.set(drivername=f"{url.get_backend_name()}+{driver}")
+
+    if url.get_backend_name() == "sqlite":
+        # SQLite connections are cheap and aiosqlite connections can not be
+        # shared between event loops
+        return create_async_engine(url, poolclass=NullPool)
+
+    return create_async_engine(
+        url,
+        pool_size=API_SETTINGS.read_pool_size or 5,
+        max_overflow=API_SETTINGS.read_pool_max_overflow,
+        pool_timeout=API_SETTINGS.read_pool_timeout,
+        pool_pre_ping=True,
+        pool_recycle=3600,
+        execution_options={"postgresql_readonly": True},
+    )
+
+
+def async_read_engine(dbconn: DBConn) -> Optional["AsyncEngine"]:
+    """
+    Async engine for API reads of tables stored in `dbconn`, None if async
+    reads are disabled or there is no async driver for the database.
+    """
+
+    if not API_SETTINGS.async_reads:
+        return None
+
+    with _lock:
+        if dbconn.connstr not in _async_engines:
+            _async_engines[dbconn.connstr] = _create_async_read_engine(dbconn)
+
+        return _async_engines[dbconn.connstr]
+
+
+class ReadCancelled(Exception):
+    pass
+
+
+class _RunningRead:
+    """
+    Connection of a running read, which can be cancelled from the event loop:
+    running statement is interrupted by the driver (SQLite `interrupt`,
+    psycopg `cancel` which is what `pg_cancel_backend` does) and following
+    statements are not started.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._connection: Any = None
+        self.cancelled = False
+
+    def _check_cancelled(self, *args: Any) -> None:
+        if self.cancelled:
+            raise ReadCancelled()
+
+    @contextmanager
+    def attach(self, conn: Connection) -> Iterator[None]:
+        with self._lock:
+            self._check_cancelled()
+            self._connection = conn.connection
+
+        event.listen(conn, "before_cursor_execute", self._check_cancelled)
+        try:
+            yield
+        finally:
+            event.remove(conn, "before_cursor_execute", self._check_cancelled)
+
+            # Connection goes back to the pool, it must not be cancelled
+            with self._lock:
+                self._connection = None
+
+    def cancel(self) -> bool:
+        """
+        Returns False if the running statement can not be interrupted.
+        """
+
+        with self._lock:
+            self.cancelled = True
+
+            if self._connection is None:
+                return True
+
+            dbapi_connection = self._connection.dbapi_connection
+            driver_connection = self._connection.driver_connection
+
+            if hasattr(dbapi_connection, "interrupt"):
+                # sqlite3
+                dbapi_connection.interrupt()
+            elif hasattr(dbapi_connection, "cancel"):
+                # psycopg2, psycopg
+                dbapi_connection.cancel()
+            elif hasattr(driver_connection, "interrupt"):
+                # aiosqlite, runs in the event loop
+                asyncio.ensure_future(driver_connection.interrupt())
+            else:
+                return False
+
+            return True
+
+
+async def _wait_read(
+    task: "asyncio.Future[T]",
+    cancel: Callable[[], Any],
+    request: Optional[Request],
+    timeout: Optional[float],
+) -> T:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout if timeout is not None else None
+
+    async def cancel_and_wait() -> None:
+        cancel()
+        await asyncio.wait({task})
+
+        # Error of the cancelled query is expected
+        if not task.cancelled():
+            task.exception()
+
+    try:
+        while True:
+            wait = API_SETTINGS.read_disconnect_poll_interval if request is not None else None
+            if deadline is not None:
+                wait = deadline - loop.time() if wait is None else min(wait, deadline - loop.time())
+
+            done, _ = await asyncio.wait({task}, timeout=wait)
+            if done:
+                return task.result()
+
+            if deadline is not None and loop.time() >= deadline:
+                READ_QUERIES_TIMED_OUT.inc()
+                await cancel_and_wait()
+                raise HTTPException(status_code=504, detail="Read query timed out")
+
+            if request is not None and await request.is_disconnected():
+                READ_QUERIES_CANCELLED.inc()
+                await cancel_and_wait()
+                raise HTTPException(status_code=499, detail="Client closed request")
+
+    except asyncio.CancelledError:
+        cancel()
+        raise
+
+
+async def run_read(
+    dbconn: DBConn,
+    func: Callable[[Connection], T],
+    request: Optional[Request] = None,
+    timeout: Optional[float] = None,
+) -> T:
+    """
+    Call `func` with a read connection to `dbconn`.
+
+    With async engine `func` runs in the event loop on top of the async
+    driver (`AsyncConnection.run_sync`), so slow queries do not hold threads.
+    Otherwise `func` runs in threadpool with a connection of `read_engine`.
+    `func` must not use other connections.
+
+    Queries are cancelled after `timeout` seconds (504) and when the client
+    of `request` disconnects (499).
+    """
+
+    async_engine = async_read_engine(dbconn)
+    running = _RunningRead()
+
+    def run_attached(conn: Connection) -> T:
+        with running.attach(conn):
+            return func(conn)
+
+    if async_engine is None:
+
+        def run() -> T:
+            with read_engine(dbconn).connect() as conn:
+                return run_attached(conn)
+
+        return await _wait_read(asyncio.ensure_future(run_in_threadpool(run)), running.cancel, request, timeout)
+
+    async def run_async() -> T:
+        async with async_engine.connect() as conn:
+            return await conn.run_sync(run_attached)
+
+    task = asyncio.ensure_future(run_async())
+
+    def cancel() -> None:
+        # asyncpg cancels the running query with the task
+        if not running.cancel():
+            task.cancel()
+
+    return await _wait_read(task, cancel, request, timeout)
+
+
+def dispose_read_engines() -> None:
+    """
+    Close connections of all read pools.
+    """
+
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose()
+
+        for async_engine in _async_engines.values():
+            if async_engine is not None:
+                # Connections belong to the event loop, they are not closed
+                async_engine.sync_engine.dispose(close=False)
+
+        _engines.clear()
+        _async_engines.clear()
+
+
+class ReadPoolCollector(Collector):
+    """
+    Exports usage of read pools as Prometheus metrics.
+    """
+
+    def describe(self) -> Iterable[Metric]:
+        return []
+
+    def collect(self) -> Iterable[Metric]:
+        size = GaugeMetricFamily(
+            "datapipe_app_read_pool_size",
+            "Number of connections kept in the read pool",
+            labels=["database"],
+        )
+        checked_out = GaugeMetricFamily(
+            "datapipe_app_read_pool_checked_out",
+            "Number of read pool connections in use",
+            labels=["database"],
+        )
+        overflow = GaugeMetricFamily(
+            "datapipe_app_read_pool_overflow",
+            "Number of read pool connections opened over the pool size",
+            labels=["database"],
+        )
+
+        with _lock:
+            engines = list(_engines.values())
+            engines.extend(engine.sync_engine for engine in _async_engines.values() if engine is not None)
+
+        for engine in engines:
+            pool = engine.pool
+            database = engine.url.render_as_string(hide_password=True)
+
+            if isinstance(pool, QueuePool):
+                size.add_metric([database], pool.size())
+                checked_out.add_metric([database], pool.checkedout())
+                overflow.add_metric([database], max(0, pool.overflow()))
+
+        yield size
+        yield checked_out
+        yield overflow
@@ -0,0 +1,195 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+import sqlalchemy as sa
+from datapipe.compute import ComputeStep
+from datapipe.datatable import DataTable
+from datapipe.store.database import TableStoreDB
+from fastapi import Response
+from sqlalchemy.engine import Connection
+
+from datapipe_app.query import connect
+from datapipe_app.read_engine import read_engine
+from datapipe_app.settings import API_SETTINGS
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    media_type: Optional[str]
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    def to_response(self) -> Response:
+        return Response(content=self.body, media_type=self.media_type, headers=self.headers)
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache of serialized responses of table reads, limited by
+    `max_entries` and total `max_bytes` of bodies.
+
+    Entries are keyed by table version: counter bumped by API writes with
+    `invalidate` and max `update_ts` of the meta table, which catches writes
+    done outside of the API. Max `update_ts` is re-read at most once per
+    `version_check_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        version_check_interval: float = 1.0,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.version_check_interval = version_check_interval
+
+        self._data: "OrderedDict[Tuple[str, Hashable], Tuple[Hashable, CachedResponse]]" = OrderedDict()
+        self._size = 0
+        self._versions: Dict[str, int] = {}
+        self._update_ts: Dict[str, Tuple[float, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self, table_name: str) -> None:
+        with self._lock:
+            self._versions[table_name] = self._versions.get(table_name, 0) + 1
+            self._update_ts.pop(table_name, None)
+
+            for key in [key for key in self._data if key[0] == table_name]:
+                self._pop(key)
+
+    def invalidate_steps(self, steps: Iterable[ComputeStep]) -> None:
+        """
+        Invalidate output tables of `steps` after they were run.
+        """
+
+        for step in steps:
+            for dt in step.output_dts:
+                self.invalidate(dt.name)
+
+    def table_version(self, dt: DataTable, conn: Optional[Connection] = None) -> Hashable:
+        """
+        Current version of `dt`. `conn` is used for the check if given, it must
+        be connected to the database of `dt` meta table.
+        """
+
+        now = time.monotonic()
+
+        with self._lock:
+            version = self._versions.get(dt.name, 0)
+            checked = self._update_ts.get(dt.name)
+
+        if checked is not None and now - checked[0] < self.version_check_interval:
+            return version, checked[1]
+
+        meta_tbl = dt.meta_table.sql_table
+
+        with connect(conn if conn is not None else read_engine(dt.meta_table.dbconn)) as meta_conn:
+            update_ts = meta_conn.execute(sa.select(sa.func.max(meta_tbl.c.update_ts))).scalar()
+
+        with self._lock:
+            # Writes which happened during the check must not be lost
+            if self._versions.get(dt.name, 0) == version:
+                self._update_ts[dt.name] = (now, update_ts)
+
+        return version, update_ts
+
+    def _pop(self, key: Tuple[str, Hashable]) -> None:
+        _, value = self._data.pop(key)
+        self._size -= len(value.body)
+
+    def get(self, table_name: str, key: Hashable, version: Hashable) -> Optional[CachedResponse]:
+        with self._lock:
+            item = self._data.get((table_name, key))
+
+            if item is None:
+                return None
+
+            item_version, value = item
+
+            if item_version != version:
+                self._pop((table_name, key))
+                return None
+
+            self._data.move_to_end((table_name, key))
+            return value
+
+    def set(self, table_name: str, key: Hashable, version: Hashable, value: CachedResponse) -> None:
+        if len(value.body) > self.max_bytes:
+            return
+
+        with self._lock:
+            if (table_name, key) in self._data:
+                self._pop((table_name, key))
+
+            self._data[(table_name, key)] = (version, value)
+            self._size += len(value.body)
+
+            while len(self._data) > self.max_entries or self._size > self.max_bytes:
+                self._pop(next(iter(self._data)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+
+def setup_result_cache() -> Optional[ResultCache]:
+    """
+    Create result cache configured by `API_SETTINGS`, None if it is disabled.
+    """
+
+    if API_SETTINGS.result_cache_max_bytes is None:
+        return None
+
+    return ResultCache(
+        max_entries=API_SETTINGS.result_cache_max_entries,
+        max_bytes=API_SETTINGS.result_cache_max_bytes,
+        version_check_interval=API_SETTINGS.result_cache_version_check_interval,
+    )
+
+
+def cached_response(
+    cache: Optional[ResultCache],
+    dt: DataTable,
+    key: Hashable,
+    func: Callable[[], Response],
+    conn: Optional[Connection] = None,
+) -> Response:
+    """
+    Serve response of `func` for `key` of table `dt` from `cache` while the
+    table does not change.
+
+    `conn` is a read connection to the database of `dt` data table, it is
+    reused for the version check if meta table is stored there too.
+    """
+
+    if cache is None:
+        return func()
+
+    same_db = isinstance(dt.table_store, TableStoreDB) and dt.table_store.dbconn.connstr == dt.meta_table.dbconn.connstr
+    version = cache.table_version(dt, conn if same_db else None)
+
+    cached = cache.get(dt.name, key, version)
+    if cached is not None:
+        return cached.to_response()
+
+    response = func()
+
+    # Streaming responses are not cached
+    if isinstance(response.body, bytes):
+        cache.set(
+            dt.name,
+            key,
+            version,
+            CachedResponse(
+                body=response.body,
+                media_type=response.media_type,
+                headers={k: v for k, v in response.headers.items() if k.lower().startswith("x-")},
+            ),
+        )
+
+    return response
@@ -0,0 +1,212 @@
+import csv
+import io
+import json
+import math
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException, Request, Response
+from pydantic import BaseModel
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+def json_default(value: Any) -> Any:
+    # UTC is written as Z, same as orjson does with OPT_UTC_Z
+    if isinstance(value, datetime) and value.utcoffset() == timedelta(0):
+        return value.replace(tzinfo=None).isoformat() + "Z"
+
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+
+    # numpy scalars
+    if hasattr(value, "item"):
+        return value.item()
+
+    return str(value)
+
+
+def parse_datetime(value: str) -> datetime:
+    """
+    Parse ISO datetime as written by `json_default`, `fromisoformat` accepts
+    Z suffix only since Python 3.11.
+    """
+
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+
+    return datetime.fromisoformat(value)
+
+
+def dumps_json(content: Any) -> bytes:
+    """
+    Serialize `content` with orjson if it is installed, stdlib json otherwise.
+    """
+
+    try:
+        import orjson
+    except ImportError:
+        return json.dumps(content, default=json_default).encode()
+
+    return orjson.dumps(
+        content,
+        default=json_default,
+        option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+    )
+
+
+def json_response(model: BaseModel) -> Response:
+    """
+    Serialize response model without FastAPI validation and encoding passes.
+
+    Model must not use field aliases, rows in `data` are expected to be plain
+    dicts prepared with `fill_missing`.
+    """
+
+    content = {name: getattr(model, name) for name in type(model).model_fields}
+
+    return Response(content=dumps_json(content), media_type="application/json")
+
+
+def fill_missing(rows: List[Dict[str, Any]], fill_value: Any) -> List[Dict[str, Any]]:
+    """
+    Replace None and NaN values in `rows` with `fill_value` in place, same as
+    `DataFrame.fillna` did for pandas based reads.
+    """
+
+    for row in rows:
+        for key, value in row.items():
+            if value is None or (isinstance(value, float) and math.isnan(value)):
+                row[key] = fill_value
+
+    return rows
+
+
+def _json_size(record: Dict[str, Any]) -> int:
+    return len(json.dumps(record, default=str))
+
+
+def truncate_records(
+    records: List[Dict[str, Any]],
+    max_bytes: Optional[int],
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Keep leading `records` which fit into `max_bytes` of JSON. At least one
+    record is always kept so that pagination can progress.
+
+    Returns kept records and whether any were dropped.
+    """
+
+    if max_bytes is None:
+        return records, False
+
+    total = 0
+    for i, record in enumerate(records):
+        total += _json_size(record)
+
+        if total > max_bytes and i > 0:
+            return records[:i], True
+
+    return records, False
+
+
+def _finite_or_none(value: Any) -> Any:
+    # NaN and infinity are not valid JSON
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+
+    return value
+
+
+def iter_ndjson(batches: Iterable[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    """
+    Serialize `batches` of rows as NDJSON, non-finite floats are written as
+    null.
+    """
+
+    for batch in batches:
+        yield "".join(
+            json.dumps({key: _finite_or_none(value) for key, value in row.items()}, default=json_default) + "\n"
+            for row in batch
+        ).encode()
+
+
+def _csv_value(value: Any) -> Any:
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=json_default)
+
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+
+    return value
+
+
+def iter_csv(columns: List[str], batches: Iterable[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(columns)
+
+    for batch in batches:
+        writer.writerows([_csv_value(row.get(column)) for column in columns] for row in batch)
+
+        yield buffer.getvalue().encode()
+
+        buffer.seek(0)
+        buffer.truncate()
+
+    # Header of an empty result
+    if buffer.tell() > 0:
+        yield buffer.getvalue().encode()
+
+
+def wants_arrow(request: Request) -> bool:
+    return ARROW_STREAM_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def _arrow_value(value: Any) -> Any:
+    # JSON columns are sent as JSON strings, Arrow can not represent
+    # heterogeneous objects
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=json_default)
+
+    return value
+
+
+def to_arrow_ipc(columns: List[str], rows: List[Dict[str, Any]]) -> bytes:
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise HTTPException(status_code=406, detail="Arrow format requires pyarrow, install datapipe-app[arrow]")
+
+    table = pa.table({column: [_arrow_value(row[column]) for row in rows] for column in columns})
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return sink.getvalue().to_pybytes()
+
+
+def arrow_response(
+    columns: List[str],
+    rows: List[Dict[str, Any]],
+    total: Optional[int] = None,
+    next_cursor: Optional[str] = None,
+) -> Response:
+    """
+    Page of rows as Arrow IPC stream, pagination info goes to `X-Total-Count`
+    and `X-Next-Cursor` headers.
+    """
+
+    headers = {}
+    if total is not None:
+        headers["X-Total-Count"] = str(total)
+    if next_cursor is not None:
+        headers["X-Next-Cursor"] = next_cursor
+
+    return Response(
+        content=to_arrow_ipc(columns, rows),
+        media_type=ARROW_STREAM_MEDIA_TYPE,
+        headers=headers,
+    )
@@ -1,3 +1,5 @@
+from typing import Literal, Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -6,5 +8,119 @@ class APISettings(BaseSettings):
 
     show_step_status: bool = False  # "DATAPIPE_APP_SHOW_STEP_STATUS" in .env
 
+    # Seconds between background refreshes of /graph snapshot, None computes
+    # graph on every request
+    graph_refresh_interval: Optional[float] = None
+
+    # Size of thread pool which computes table sizes and step statuses for
+    # /graph
+    graph_max_workers: int = 8
+
+    # Seconds to wait for a table size or step status in /graph, items which
+    # did not make it are returned with `timed_out` flag
+    graph_item_timeout: Optional[float] = None
+
+    # Seconds between background computations of step statuses for prometheus
+    # metrics, None computes statuses during the scrape
+    metrics_snapshot_interval: Optional[float] = None
+
+    # Seconds between full recomputations of step statuses. When set, step
+    # statuses for /graph and metrics are served from in-app counters updated
+    # by API writes in between
+    step_status_reconcile_interval: Optional[float] = None
+
+    # Take table sizes for /graph from database statistics instead of exact
+    # COUNT. Tables with less than `approximate_table_sizes_threshold`
+    # estimated rows are still counted exactly
+    approximate_table_sizes: bool = False
+    approximate_table_sizes_threshold: int = 100_000
+
+    # Upper bound for `page_size` of v1alpha2 reads
+    max_page_size: int = 1000
+
+    # Upper bound for JSON size of rows in v1alpha2 reads, page is cut short
+    # and marked as `truncated` when exceeded
+    max_response_bytes: Optional[int] = None
+
+    # Seconds to keep exact totals of get-data requests, same table and filters
+    # are not re-counted while paging. None disables the cache
+    count_cache_ttl: Optional[float] = None
+
+    # Number of rows fetched from the database at once by export endpoints
+    export_batch_size: int = 1000
+
+    # Focus filters with up to `focus_in_max_items` items are sent as tuple IN
+    # list, larger ones as VALUES list (Postgres only, up to
+    # `focus_values_max_items`) or through a temporary table
+    focus_in_max_items: int = 1000
+    focus_values_max_items: int = 10_000
+
+    # Size of a separate connection pool for API reads (read-only on
+    # Postgres), None uses engines of the pipeline
+    read_pool_size: Optional[int] = None
+    read_pool_max_overflow: int = 10
+    read_pool_timeout: float = 30
+
+    # Database URI of a read replica of the pipeline meta database, API reads
+    # of meta tables and data tables stored in the same database go there
+    read_replica_uri: Optional[str] = None
+
+    # Run read queries of get-data endpoints and /graph on SQLAlchemy async
+    # engine (aiosqlite, asyncpg) instead of threadpool
+    async_reads: bool = False
+
+    # Seconds after which read queries of get-data endpoints are cancelled
+    # (504), None does not limit them. Queries of clients which disconnected
+    # are cancelled too (499), disconnects are checked every
+    # `read_disconnect_poll_interval` seconds
+    read_query_timeout: Optional[float] = None
+    read_disconnect_poll_interval: float = 0.5
+
+    # Size limit in bytes of in-process cache of get-table-data / get-data
+    # responses, None disables the cache. Cached pages are served until the
+    # table is written by the API or its max `update_ts` changes, which is
+    # checked at most once per `result_cache_version_check_interval` seconds
+    result_cache_max_bytes: Optional[int] = None
+    result_cache_max_entries: int = 1024
+    result_cache_version_check_interval: float = 1.0
+
+    # Check plans of filtered get-table-data / get-transform-data reads with
+    # EXPLAIN and warn about or reject (400) the ones which would scan the
+    # whole table of at least `full_scan_guard_min_rows` estimated rows
+    full_scan_guard: Literal["off", "warn", "reject"] = "off"
+    full_scan_guard_min_rows: int = 100_000
+
+    # Create indexes on columns of catalog data tables and transform meta
+    # tables which get-data requests were sorted by at least
+    # `auto_sort_index_min_requests` times
+    auto_sort_indexes: bool = False
+    auto_sort_index_min_requests: int = 100
+
+    # Number of rows stored at once by /v1alpha1/ingest-data
+    ingest_chunk_size: int = 10_000
+
+    # Seconds to collect upserts of a table from update-data and
+    # labelstudio-webhook into one store_chunk and changelist run (last write
+    # wins per primary key), None writes every request on its own. Batch is
+    # flushed earlier once it has `write_buffer_max_rows` rows. Requests with
+    # `background` are acknowledged right away, others wait for the flush
+    write_buffer_window: Optional[float] = None
+    write_buffer_max_rows: int = 10_000
+
+    # SQLAlchemy URI of a database for background changelist runs of
+    # update-data and ingest-data, e.g. "sqlite:///jobs.sqlite". Jobs are run
+    # by `job_queue_max_workers` threads and ones interrupted by a restart are
+    # retried up to `job_queue_max_attempts` runs. Finished jobs are kept for
+    # `job_queue_retention` seconds. None runs them as FastAPI background tasks
+    job_queue_uri: Optional[str] = None
+    job_queue_max_workers: int = 4
+    job_queue_max_attempts: int = 3
+    job_queue_retention: float = 7 * 24 * 3600
+
+    # Keep at most one running and one pending changelist run per set of
+    # steps, changelists of writes which arrive during a run are merged into
+    # one follow-up run
+    merge_changelist_runs: bool = False
+
 
 API_SETTINGS = APISettings()
@@ -0,0 +1,130 @@
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+import sqlalchemy as sa
+from datapipe.store.database import DBConn
+from sqlalchemy.engine import Connection
+
+from datapipe_app.settings import API_SETTINGS
+
+logger = logging.getLogger("datapipe_app.sort_indexes")
+
+# Postgres limit of identifier length
+MAX_INDEX_NAME_LENGTH = 63
+
+
+def sort_index_name(table: sa.Table, column: str) -> str:
+    name = f"ix_{table.name}_{column}_sort"
+
+    if len(name) > MAX_INDEX_NAME_LENGTH:
+        digest = hashlib.md5(name.encode()).hexdigest()[:8]
+        name = f"{name[:MAX_INDEX_NAME_LENGTH - 9]}_{digest}"
+
+    return name
+
+
+def has_leading_index(conn: Connection, table: sa.Table, column: str) -> bool:
+    """
+    Whether primary key or any index of `table` starts with `column`.
+    """
+
+    inspector = sa.inspect(conn)
+
+    primary_key = inspector.get_pk_constraint(table.name, schema=table.schema)["constrained_columns"]
+    if primary_key[:1] == [column]:
+        return True
+
+    indexes = inspector.get_indexes(table.name, schema=table.schema)
+
+    return any(index["column_names"][:1] == [column] for index in indexes)
+
+
+def create_sort_index(dbconn: DBConn, table: sa.Table, column: str, primary_keys: List[str]) -> bool:
+    """
+    Create index on `column` followed by `primary_keys`, which serves both
+    ORDER BY and keyset pagination of get-data reads sorted by `column`.
+
+    Postgres index is built CONCURRENTLY, so writes of the pipeline are not
+    blocked. Returns False if `table` already has an index which starts with
+    `column`.
+    """
+
+    # Index is built on a copy, so that it does not end up in metadata of
+    # the pipeline
+    table = table.to_metadata(sa.MetaData())
+
+    index = sa.Index(
+        sort_index_name(table, column),
+        table.c[column],
+        *[table.c[key] for key in primary_keys if key != column],
+        postgresql_concurrently=True,
+    )
+
+    with dbconn.con.connect() as conn:
+        # CREATE INDEX CONCURRENTLY can not run inside a transaction
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+
+        if has_leading_index(conn, table, column):
+            return False
+
+        index.create(conn, checkfirst=True)
+
+    return True
+
+
+class SortIndexes:
+    """
+    Counts get-data requests sorted by each column of API-managed tables and
+    creates an index in background for columns sorted at least
+    `min_requests` times.
+    """
+
+    def __init__(self, min_requests: int = 100) -> None:
+        self.min_requests = min_requests
+
+        self._counts: Dict[Tuple[str, str, str], int] = {}
+        self._requested: Set[Tuple[str, str, str]] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sort-indexes")
+
+    def record(self, dbconn: DBConn, table: sa.Table, column: str, primary_keys: List[str]) -> None:
+        key = (dbconn.connstr, table.fullname, column)
+
+        with self._lock:
+            if key in self._requested:
+                return
+
+            count = self._counts.get(key, 0) + 1
+
+            if count < self.min_requests:
+                self._counts[key] = count
+                return
+
+            self._counts.pop(key, None)
+            self._requested.add(key)
+
+        self._executor.submit(self._create, dbconn, table, column, primary_keys)
+
+    def _create(self, dbconn: DBConn, table: sa.Table, column: str, primary_keys: List[str]) -> None:
+        try:
+            if create_sort_index(dbconn, table, column, primary_keys):
+                logger.info(f"Created index {sort_index_name(table, column)} for sorting {table.name} by {column}")
+        except Exception:
+            logger.exception(f"Failed to create index for sorting {table.name} by {column}")
+
+    def stop(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+def setup_sort_indexes() -> Optional[SortIndexes]:
+    """
+    Create `SortIndexes` configured by `API_SETTINGS`, None if it is disabled.
+    """
+
+    if not API_SETTINGS.auto_sort_indexes:
+        return None
+
+    return SortIndexes(min_requests=API_SETTINGS.auto_sort_index_min_requests)
@@ -0,0 +1,171 @@
+import threading
+from typing import Dict, List, Optional
+
+import sqlalchemy as sa
+from datapipe.compute import ComputeStep, DataStore, StepStatus
+from datapipe.meta.sql_meta import build_changed_idx_sql
+from datapipe.step.batch_transform import BaseBatchTransformStep
+from datapipe.types import ChangeList, IndexDF
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql.functions import count
+
+from datapipe_app.periodic import PeriodicTask
+from datapipe_app.query import connect
+from datapipe_app.read_engine import read_engine
+
+
+def get_step_status(ds: DataStore, step: ComputeStep, conn: Optional[Connection] = None) -> StepStatus:
+    """
+    Same as `step.get_status`, but queries run on `conn` if given, on
+    `read_engine` otherwise.
+    """
+
+    if not isinstance(step, BaseBatchTransformStep):
+        raise NotImplementedError
+
+    _, changed_sql = build_changed_idx_sql(
+        ds=ds,
+        meta_table=step.meta_table,
+        input_dts=step.input_dts,
+        transform_keys=step.transform_keys,
+        run_config=step._apply_filters_to_run_config(None),
+    )
+
+    with connect(conn if conn is not None else read_engine(ds.meta_dbconn)) as conn:
+        total_idx_count = conn.execute(sa.select(count()).select_from(step.meta_table.sql_table)).scalar_one()
+        changed_idx_count = conn.execute(sa.select(count()).select_from(changed_sql.subquery())).scalar_one()
+
+    return StepStatus(
+        name=step.name,
+        total_idx_count=total_idx_count,
+        changed_idx_count=changed_idx_count,
+    )
+
+
+def _count_step_idx(step: BaseBatchTransformStep, idx: IndexDF) -> int:
+    keys = [key for key in step.transform_keys if key in idx.columns]
+
+    if len(keys) == 0 or len(keys) != len(step.transform_keys):
+        return len(idx)
+
+    return len(idx[keys].drop_duplicates())
+
+
+class StepStatusCounters:
+    """
+    In-app store of `StepStatus` for every `BaseBatchTransformStep`.
+
+    Counters are computed with `get_step_status` every `reconcile_interval`
+    seconds and updated incrementally in between by API write paths:
+    `mark_changed` when new data is stored and `mark_processed` when indices
+    are processed by a step. Incremental updates are approximate (overlapping
+    writes are counted twice, `total_idx_count` is not updated), reconciliation
+    brings counters back to exact values.
+    """
+
+    def __init__(
+        self,
+        ds: DataStore,
+        steps: List[ComputeStep],
+        reconcile_interval: float,
+    ) -> None:
+        self.ds = ds
+        self.steps = [step for step in steps if isinstance(step, BaseBatchTransformStep)]
+
+        self._statuses: Dict[str, StepStatus] = {}
+        self._lock = threading.Lock()
+
+        self._reconcile_task = PeriodicTask(
+            name="datapipe-app-step-status-reconcile",
+            interval=reconcile_interval,
+            func=self.reconcile,
+            run_immediately=True,
+        )
+
+    def start(self) -> None:
+        self._reconcile_task.start()
+
+    def stop(self) -> None:
+        self._reconcile_task.stop()
+
+    def reconcile(self) -> None:
+        for step in self.steps:
+            self.reconcile_step(step)
+
+    def reconcile_step(self, step: BaseBatchTransformStep) -> StepStatus:
+        step_status = get_step_status(self.ds, step)
+
+        with self._lock:
+            self._statuses[step.name] = step_status
+
+        return step_status
+
+    def get_status(self, step: ComputeStep) -> StepStatus:
+        if not isinstance(step, BaseBatchTransformStep):
+            raise NotImplementedError
+
+        step_status = self._statuses.get(step.name)
+
+        if step_status is None:
+            # Not reconciled yet
+            return self.reconcile_step(step)
+
+        return StepStatus(
+            name=step_status.name,
+            total_idx_count=step_status.total_idx_count,
+            changed_idx_count=step_status.changed_idx_count,
+        )
+
+    def _add_changed(self, step_name: str, delta: int) -> None:
+        with self._lock:
+            step_status = self._statuses.get(step_name)
+
+            if step_status is None:
+                return
+
+            step_status.changed_idx_count = max(0, step_status.changed_idx_count + delta)
+
+    def mark_changed(self, changelist: ChangeList) -> None:
+        """
+        Account new data in tables from `changelist` for steps which read them.
+        """
+
+        for step in self.steps:
+            for inp in step.input_dts:
+                idx = changelist.changes.get(inp.dt.name)
+
+                if idx is not None:
+                    self._add_changed(step.name, _count_step_idx(step, idx))
+
+    def mark_processed(self, steps: List[ComputeStep], changelist: ChangeList) -> None:
+        """
+        Account that `steps` processed changes from `changelist`.
+        """
+
+        step_names = set(step.name for step in steps)
+
+        for step in self.steps:
+            if step.name not in step_names:
+                continue
+
+            for inp in step.input_dts:
+                idx = changelist.changes.get(inp.dt.name)
+
+                if idx is not None:
+                    self._add_changed(step.name, -_count_step_idx(step, idx))
+
+    def mark_step_processed(self, step: ComputeStep, processed_count: Optional[int] = None) -> None:
+        """
+        Account that `step` processed `processed_count` indices, or all changed
+        indices if `processed_count` is None.
+        """
+
+        if processed_count is not None:
+            self._add_changed(step.name, -processed_count)
+            return
+
+        with self._lock:
+            step_status = self._statuses.get(step.name)
+
+            if step_status is not None:
+                step_status.changed_idx_count = 0
@@ -0,0 +1,271 @@
+import json
+import logging
+import re
+from typing import Any, Dict, Iterator, Literal, Optional, Set, Tuple, Union
+
+import sqlalchemy as sa
+from datapipe.datatable import DataTable
+from datapipe.store.database import DBConn
+from fastapi import HTTPException
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.base import Executable
+from sqlalchemy.sql.elements import ClauseElement
+from sqlalchemy.sql.functions import count
+
+from datapipe_app.cache import TTLCache
+from datapipe_app.query import connect
+from datapipe_app.read_engine import read_engine
+from datapipe_app.settings import API_SETTINGS
+
+logger = logging.getLogger("datapipe_app.table_size")
+
+
+def estimate_table_rows(dbconn: DBConn, table: sa.Table, conn: Optional[Connection] = None) -> Optional[int]:
+    """
+    Get number of rows in `table` from planner statistics of the database.
+
+    Returns None if statistics are not available: table was never analyzed or
+    database engine is not supported.
+    """
+
+    bind = conn if conn is not None else read_engine(dbconn)
+    dialect = bind.dialect.name
+
+    try:
+        with connect(bind) as conn:
+            if dialect == "postgresql":
+                table_name = f"{table.schema}.{table.name}" if table.schema else table.name
+
+                # Failed statement should not abort the transaction of `conn`
+                with conn.begin_nested():
+                    reltuples = conn.execute(
+                        sa.text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(:table_name)"),
+                        {"table_name": table_name},
+                    ).scalar()
+
+                # -1 means that table was never vacuumed or analyzed
+                if reltuples is None or reltuples < 0:
+                    return None
+
+                return int(reltuples)
+
+            elif dialect == "sqlite":
+                # sqlite_stat1 exists only after ANALYZE
+                stat = conn.execute(
+                    sa.text("SELECT stat FROM sqlite_stat1 WHERE tbl = :table_name LIMIT 1"),
+                    {"table_name": table.name},
+                ).scalar()
+
+                if stat is None:
+                    return None
+
+                # First number of stat is the number of rows in the table
+                return int(str(stat).split()[0])
+
+    except DBAPIError:
+        return None
+
+    return None
+
+
+def get_table_size(
+    dt: DataTable,
+    approximate: bool = False,
+    exact_threshold: int = 0,
+    conn: Optional[Connection] = None,
+) -> Tuple[int, bool]:
+    """
+    Get number of rows in `dt` and whether this number is an estimate.
+
+    With `approximate` set, size is taken from planner statistics of the meta
+    table (which includes deleted rows), small tables with less than
+    `exact_threshold` estimated rows and tables without statistics are counted
+    exactly.
+
+    Queries run on `conn` if given, on `read_engine` otherwise.
+    """
+
+    if approximate:
+        estimate = estimate_table_rows(dt.meta_table.dbconn, dt.meta_table.sql_table, conn)
+
+        if estimate is not None and estimate >= exact_threshold:
+            return estimate, True
+
+    meta_tbl = dt.meta_table.sql_table
+
+    with connect(conn if conn is not None else read_engine(dt.meta_table.dbconn)) as conn:
+        size = conn.execute(sa.select(count()).select_from(meta_tbl).where(meta_tbl.c.delete_ts.is_(None))).scalar_one()
+
+    return size, False
+
+
+def estimate_query_rows(bind: Union[Engine, Connection], sql: Any) -> Optional[int]:
+    """
+    Get number of rows returned by `sql` as estimated by the query planner.
+
+    Only Postgres is supported, returns None for other databases.
+    """
+
+    if bind.dialect.name != "postgresql":
+        return None
+
+    compiled = sql.compile(dialect=bind.dialect, compile_kwargs={"render_postcompile": True})
+
+    try:
+        with connect(bind) as conn, conn.begin_nested():
+            plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+    except DBAPIError:
+        return None
+
+    if plan is None:
+        return None
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def _count_cache_key(bind: Union[Engine, Connection], sql: Any) -> Tuple[str, str, str]:
+    compiled = sql.compile()
+
+    return (
+        str(bind.engine.url),
+        str(compiled),
+        json.dumps(compiled.params, sort_keys=True, default=str),
+    )
+
+
+def count_rows(
+    bind: Union[Engine, Connection],
+    sql: Any,
+    include_total: Literal["exact", "estimate", "none"] = "exact",
+    cache: Optional[TTLCache[int]] = None,
+) -> Tuple[Optional[int], bool]:
+    """
+    Count rows returned by `sql` and whether this number is an estimate.
+
+    * `exact` runs COUNT, result is cached in `cache` if given
+    * `estimate` takes the number from the query planner when possible and
+      falls back to `exact` otherwise
+    * `none` skips counting and returns None
+    """
+
+    if include_total == "none":
+        return None, False
+
+    if include_total == "estimate":
+        estimate = estimate_query_rows(bind, sql)
+
+        if estimate is not None:
+            return estimate, True
+
+    cache_key = _count_cache_key(bind, sql) if cache is not None else None
+
+    if cache is not None:
+        cached = cache.get(cache_key)
+
+        if cached is not None:
+            return cached, False
+
+    with connect(bind) as conn:
+        total = conn.execute(sa.select(count()).select_from(sql.subquery())).scalar_one_or_none()
+        assert total is not None
+
+    if cache is not None:
+        cache.set(cache_key, total)
+
+    return total, False
+
+
+class Explain(Executable, ClauseElement):
+    """
+    Query plan of `sql`: JSON on Postgres, `EXPLAIN QUERY PLAN` rows on SQLite.
+    """
+
+    inherit_cache = False
+
+    def __init__(self, sql: Any) -> None:
+        self.sql = sql
+
+
+@compiles(Explain)
+def _compile_explain(element: Explain, compiler: Any, **kw: Any) -> str:
+    if compiler.dialect.name == "sqlite":
+        return "EXPLAIN QUERY PLAN " + compiler.process(element.sql, **kw)
+
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.sql, **kw)
+
+
+def _plan_nodes(node: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield node
+
+    for child in node.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+def full_scan_tables(conn: Connection, sql: Any) -> Optional[Set[str]]:
+    """
+    Names of tables which `sql` reads in full according to the query plan.
+    Returns None if the database is not supported or EXPLAIN failed.
+    """
+
+    dialect = conn.dialect.name
+
+    if dialect not in ("postgresql", "sqlite"):
+        return None
+
+    # Result columns of `sql` do not match the plan, so rows are fetched
+    # from DBAPI cursor without type processing
+    try:
+        if dialect == "sqlite":
+            details = [row[-1] for row in conn.execute(Explain(sql)).cursor.fetchall()]
+        else:
+            # Failed statement should not abort the transaction of `conn`
+            with conn.begin_nested():
+                (plan,) = conn.execute(Explain(sql)).cursor.fetchall()[0]
+    except DBAPIError:
+        return None
+
+    if dialect == "sqlite":
+        # "SCAN events" since SQLite 3.36, "SCAN TABLE events" before,
+        # index searches are "SEARCH events USING INDEX ..."
+        matches = [re.match(r"SCAN (?:TABLE )?(\w+)", detail) for detail in details]
+        return {match.group(1) for match in matches if match is not None}
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return {
+        node["Relation Name"]
+        for node in _plan_nodes(plan[0]["Plan"])
+        if node["Node Type"] == "Seq Scan" and "Relation Name" in node
+    }
+
+
+def check_full_scan(conn: Connection, dbconn: DBConn, sql: Any, table: sa.Table) -> None:
+    """
+    Warn about or reject (`API_SETTINGS.full_scan_guard`) `sql` if it reads
+    the whole `table` of at least `API_SETTINGS.full_scan_guard_min_rows`
+    estimated rows. Tables without planner statistics are not checked.
+    """
+
+    if API_SETTINGS.full_scan_guard == "off":
+        return
+
+    rows = estimate_table_rows(dbconn, table, conn)
+    if rows is None or rows < API_SETTINGS.full_scan_guard_min_rows:
+        return
+
+    scanned = full_scan_tables(conn, sql)
+    if scanned is None or table.name not in scanned:
+        return
+
+    message = f"Filters do not use indexes of {table.name} and would scan all ~{rows} rows"
+
+    if API_SETTINGS.full_scan_guard == "reject":
+        raise HTTPException(status_code=400, detail=message)
+
+    logger.warning(message)
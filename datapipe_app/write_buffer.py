@@ -0,0 +1,129 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from datapipe.compute import ComputeStep
+
+from datapipe_app.settings import API_SETTINGS
+
+logger = logging.getLogger("datapipe_app.write_buffer")
+
+
+@dataclass
+class WriteBatch:
+    table_name: str
+    steps: List[ComputeStep]
+    enable_changelist: bool
+    # Upserted rows by primary key, last write wins
+    rows: Dict[Hashable, Dict[str, Any]] = field(default_factory=dict)
+    future: "Future[None]" = field(default_factory=Future)
+
+
+class WriteBuffer:
+    """
+    Coalesces upserts of a table into batches which are flushed with
+    `flush_func` once they have `max_rows` rows or `window` seconds after the
+    first upsert. Batches are flushed one at a time in a background thread.
+
+    Upserts are batched separately for every set of steps to run.
+    """
+
+    def __init__(self, flush_func: Callable[[WriteBatch], None], window: float, max_rows: int = 10_000) -> None:
+        self.flush_func = flush_func
+        self.window = window
+        self.max_rows = max_rows
+
+        self._batches: Dict[Tuple[str, Tuple[str, ...], bool], WriteBatch] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="write-buffer")
+
+    def add(
+        self,
+        table_name: str,
+        primary_keys: List[str],
+        upsert: List[Dict[str, Any]],
+        steps: List[ComputeStep],
+        enable_changelist: bool = True,
+    ) -> "Future[None]":
+        """
+        Add `upsert` to the current batch of `table_name`, returned future is
+        resolved when the batch is flushed.
+        """
+
+        key = (table_name, tuple(step.name for step in steps), enable_changelist)
+
+        with self._lock:
+            batch = self._batches.get(key)
+
+            if batch is None:
+                batch = WriteBatch(table_name=table_name, steps=steps, enable_changelist=enable_changelist)
+                self._batches[key] = batch
+
+                timer = threading.Timer(self.window, self._submit, args=(key, batch))
+                timer.daemon = True
+                timer.start()
+
+            for row in upsert:
+                batch.rows[tuple(row.get(column) for column in primary_keys)] = row
+
+            full = len(batch.rows) >= self.max_rows
+
+        if full:
+            self._submit(key, batch)
+
+        return batch.future
+
+    def _submit(self, key: Tuple[str, Tuple[str, ...], bool], batch: WriteBatch) -> None:
+        with self._lock:
+            # Already flushed by size
+            if self._batches.get(key) is not batch:
+                return
+
+            del self._batches[key]
+
+        self._executor.submit(self._flush, batch)
+
+    def _flush(self, batch: WriteBatch) -> None:
+        try:
+            self.flush_func(batch)
+        except Exception as e:
+            logger.exception(f"Failed to flush {len(batch.rows)} rows of {batch.table_name}")
+            batch.future.set_exception(e)
+        else:
+            batch.future.set_result(None)
+
+    def flush(self) -> None:
+        """
+        Flush all pending batches and wait for them.
+        """
+
+        with self._lock:
+            batches = list(self._batches.items())
+
+        for key, batch in batches:
+            self._submit(key, batch)
+
+        for _, batch in batches:
+            # Failures are already logged
+            batch.future.exception()
+
+    def stop(self) -> None:
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+
+def setup_write_buffer(flush_func: Callable[[WriteBatch], None]) -> Optional[WriteBuffer]:
+    """
+    Create `WriteBuffer` configured by `API_SETTINGS`, None if it is disabled.
+    """
+
+    if API_SETTINGS.write_buffer_window is None:
+        return None
+
+    return WriteBuffer(
+        flush_func,
+        window=API_SETTINGS.write_buffer_window,
+        max_rows=API_SETTINGS.write_buffer_max_rows,
+    )
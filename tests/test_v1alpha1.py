@@ -1,8 +1,27 @@
+import io
+import json
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import cast
 
+import pandas as pd
 import pytest
+from datapipe.types import ChangeList, IndexDF
+from fastapi import BackgroundTasks
 from fastapi.testclient import TestClient
 
+from datapipe_app import DatapipeAPI, api_v1alpha1
+from datapipe_app.api_v1alpha1 import get_data_get_pd, run_changelist, update_data
+from datapipe_app.changelist_scheduler import ChangelistScheduler
+from datapipe_app.graph import downstream_steps_index
+from datapipe_app.job_queue import JobQueue, dump_changelist, load_changelist
+from datapipe_app.settings import API_SETTINGS
+from datapipe_app.step_status import StepStatusCounters
+from datapipe_app.write_buffer import WriteBatch, WriteBuffer
+
 
 def test_graph_works(app):
     client = TestClient(app)
@@ -67,3 +86,529 @@ def test_update_data(app, background):
         "events_count": 1,
         "active": True,
     }
+
+
+def test_step_status_counters(app):
+    counters = StepStatusCounters(app.ds, app.steps, reconcile_interval=3600)
+    step = app.steps[0]
+
+    assert counters.get_status(step).changed_idx_count == 0
+
+    upsert = [
+        {"user_id": 1, "event_id": 1, "event": {"event_type": "click", "offer_id": 1}},
+        {"user_id": 1, "event_id": 2, "event": {"event_type": "click", "offer_id": 2}},
+        {"user_id": 2, "event_id": 1, "event": {"event_type": "click", "offer_id": 1}},
+    ]
+    update_data(
+        ds=app.ds,
+        catalog=app.catalog,
+        steps=app.steps,
+        background_tasks=BackgroundTasks(),
+        table_name="events",
+        upsert=upsert,
+        background=False,
+        enable_changelist=False,
+        step_counters=counters,
+    )
+
+    # Two distinct user_id-s were changed
+    assert counters.get_status(step).changed_idx_count == 2
+    assert step.get_status(app.ds).changed_idx_count == 2
+
+    cl = ChangeList.create("events", app.ds.get_table("events").meta_table.get_existing_idx())
+    run_changelist(ds=app.ds, steps=app.steps, changelist=cl, step_counters=counters)
+
+    assert counters.get_status(step).changed_idx_count == 0
+
+    counters.reconcile()
+    assert counters.get_status(step).total_idx_count == 2
+
+
+def test_get_data_get_joined(app):
+    events = app.ds.get_table("events")
+    events.store_chunk(
+        pd.DataFrame.from_records(
+            [{"user_id": 1, "event_id": i, "event": {"event_type": "view", "n": i}} for i in range(10)]
+        )
+    )
+    events.delete_by_idx(cast(IndexDF, pd.DataFrame.from_records([{"user_id": 1, "event_id": 5}])))
+
+    client = TestClient(app)
+
+    res = client.get("/api/v1alpha1/get-data", params={"table": "events", "page": 1, "page_size": 4})
+    assert res.status_code == 200
+    assert res.json()["total"] == 9
+    assert res.json()["data"] == [
+        {"user_id": 1, "event_id": i, "event": {"event_type": "view", "n": i}} for i in [4, 6, 7, 8]
+    ]
+
+    total, _, meta_df, data_df = get_data_get_pd(
+        app.ds, app.catalog, "events", 0, 3, filters=None, order_by=["event_id"], order="desc"
+    )
+    assert total == 9
+    assert list(data_df.columns) == ["user_id", "event_id", "event"]
+    assert list(data_df["event_id"]) == [9, 8, 7]
+    assert list(meta_df.columns) == [column.name for column in events.meta_table.sql_schema]
+
+
+def test_get_data_with_focus(app):
+    app.ds.get_table("events").store_chunk(
+        pd.DataFrame.from_records(
+            [{"user_id": 1, "event_id": i, "event": {"event_type": "view", "n": i}} for i in range(10)]
+        )
+    )
+
+    client = TestClient(app)
+
+    res = client.post("/api/v1alpha1/get-data-with-focus", json={"table_name": "events", "page": 2, "page_size": 4})
+    assert res.status_code == 200
+    assert res.json()["total"] == 10
+    assert [row["event_id"] for row in res.json()["data"]] == [8, 9]
+
+    res = client.post(
+        "/api/v1alpha1/get-data-with-focus",
+        json={
+            "table_name": "events",
+            "page": 0,
+            "page_size": 2,
+            "focus": {
+                "table_name": "events",
+                "items_idx": [{"user_id": 1, "event_id": i} for i in [7, 3, 5, 42]],
+            },
+        },
+    )
+    assert res.status_code == 200
+    assert res.json()["total"] == 3
+    assert [row["event_id"] for row in res.json()["data"]] == [3, 5]
+
+
+def test_ingest_data_ndjson(app, monkeypatch):
+    monkeypatch.setattr(API_SETTINGS, "ingest_chunk_size", 2)
+    client = TestClient(app)
+
+    events = [
+        {"user_id": user_id, "event_id": 1, "event": {"event_type": "click", "offer_id": 1}} for user_id in range(5)
+    ]
+
+    def body():
+        for event in events:
+            yield (json.dumps(event) + "\n").encode()
+
+    res = client.post(
+        "/api/v1alpha1/ingest-data",
+        params={"table_name": "events"},
+        content=body(),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert res.status_code == 200
+    assert res.json()["rows"] == 5
+    assert res.json()["chunks"] == 3
+    assert res.json()["rows_per_second"] > 0
+
+    # One changelist is run for all chunks
+    assert len(app.ds.get_table("events").get_data()) == 5
+    assert len(app.ds.get_table("user_profile").get_data()) == 5
+
+
+@pytest.mark.parametrize("format", ["csv", "arrow", "parquet"])
+def test_ingest_data_formats(app, format):
+    df = pd.DataFrame({"user_id": [1, 2, 3], "lang": ["en", "es", "ru"]})
+
+    buffer = io.BytesIO()
+    if format == "csv":
+        df.to_csv(buffer, index=False)
+    elif format == "arrow":
+        pa = pytest.importorskip("pyarrow")
+        table = pa.Table.from_pandas(df)
+        with pa.ipc.new_stream(buffer, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pytest.importorskip("pyarrow")
+        df.to_parquet(buffer)
+
+    client = TestClient(app)
+    res = client.post(
+        "/api/v1alpha1/ingest-data",
+        params={"table_name": "user_lang", "format": format},
+        content=buffer.getvalue(),
+    )
+    assert res.status_code == 200
+    assert res.json()["rows"] == 3
+
+    assert app.ds.get_table("user_lang").get_data().sort_values("user_id")["lang"].tolist() == ["en", "es", "ru"]
+
+
+def test_ingest_data_invalid(app):
+    client = TestClient(app)
+
+    res = client.post("/api/v1alpha1/ingest-data", params={"table_name": "events"}, content=b"{}")
+    assert res.status_code == 415
+
+    res = client.post(
+        "/api/v1alpha1/ingest-data", params={"table_name": "events", "format": "ndjson"}, content=b"not json\n"
+    )
+    assert res.status_code == 400
+
+
+def test_ingest_data_partial(app, monkeypatch):
+    monkeypatch.setattr(API_SETTINGS, "ingest_chunk_size", 2)
+    client = TestClient(app)
+
+    events = [
+        json.dumps({"user_id": user_id, "event_id": 1, "event": {"event_type": "click", "offer_id": 1}})
+        for user_id in range(3)
+    ]
+
+    # Bad line follows a full chunk
+    res = client.post(
+        "/api/v1alpha1/ingest-data",
+        params={"table_name": "events", "format": "ndjson"},
+        content="\n".join([*events, "not json"]).encode(),
+    )
+    assert res.status_code == 400
+    assert "2 rows" in res.json()["detail"]
+
+    # Stored chunk is processed by steps
+    assert len(app.ds.get_table("events").get_data()) == 2
+    assert len(app.ds.get_table("user_profile").get_data()) == 2
+
+
+def test_write_buffer():
+    batches = []
+
+    def flush(batch: WriteBatch) -> None:
+        batches.append(list(batch.rows.values()))
+
+    write_buffer = WriteBuffer(flush, window=3600, max_rows=3)
+
+    write_buffer.add("events", ["user_id"], [{"user_id": 1, "value": "a"}, {"user_id": 2, "value": "a"}], [])
+    future = write_buffer.add("events", ["user_id"], [{"user_id": 1, "value": "b"}], [])
+    assert not future.done()
+
+    # Last write wins, batch is flushed once it is full
+    write_buffer.add("events", ["user_id"], [{"user_id": 3, "value": "a"}], [])
+    future.result(timeout=5)
+    assert batches == [[{"user_id": 1, "value": "b"}, {"user_id": 2, "value": "a"}, {"user_id": 3, "value": "a"}]]
+
+    write_buffer.add("events", ["user_id"], [{"user_id": 4, "value": "a"}], [])
+    write_buffer.stop()
+    assert batches[1] == [{"user_id": 4, "value": "a"}]
+
+
+@pytest.mark.parametrize("background", [True, False])
+def test_update_data_write_buffer(app, monkeypatch, background):
+    monkeypatch.setattr(API_SETTINGS, "write_buffer_window", 0.5)
+
+    changelist_runs = []
+    run_steps_changelist = api_v1alpha1.run_steps_changelist
+
+    def counting_run_steps_changelist(**kwargs):
+        changelist_runs.append(kwargs["changelist"])
+        run_steps_changelist(**kwargs)
+
+    monkeypatch.setattr(api_v1alpha1, "run_steps_changelist", counting_run_steps_changelist)
+
+    # Concurrent requests reach the buffer in any order, remember it
+    added_offers = []
+    add_lock = threading.Lock()
+    add = WriteBuffer.add
+
+    def recording_add(self, table_name, primary_keys, upsert, *args, **kwargs):
+        with add_lock:
+            added_offers.extend((row["user_id"], row["event"]["offer_id"]) for row in upsert)
+            return add(self, table_name, primary_keys, upsert, *args, **kwargs)
+
+    monkeypatch.setattr(WriteBuffer, "add", recording_add)
+
+    client = TestClient(api_v1alpha1.make_app(app.ds, app.catalog, app.pipeline, app.steps))
+
+    def annotate(user_id: int, offer_id: int) -> int:
+        res = client.post(
+            "/update-data",
+            json={
+                "table_name": "events",
+                "upsert": [{"user_id": user_id, "event_id": 1, "event": {"event_type": "click", "offer_id": offer_id}}],
+                "background": background,
+            },
+        )
+        return res.status_code
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        statuses = list(executor.map(annotate, [1, 2, 1], [1, 1, 2]))
+
+    assert statuses == [200, 200, 200]
+
+    for _ in range(50):
+        if len(changelist_runs) > 0:
+            break
+        time.sleep(0.1)
+
+    # Three updates are stored with one store_chunk and one changelist run
+    assert len(changelist_runs) == 1
+    assert len(changelist_runs[0].changes["events"]) == 2
+
+    # Last write wins
+    last_offer = [offer_id for user_id, offer_id in added_offers if user_id == 1][-1]
+    events = app.ds.get_table("events").get_data()
+    assert events.set_index("user_id")["event"].to_dict()[1] == {"event_type": "click", "offer_id": last_offer}
+
+
+def test_write_buffer_flushed_on_shutdown(app, monkeypatch):
+    monkeypatch.setattr(API_SETTINGS, "write_buffer_window", 3600)
+
+    api = DatapipeAPI(app.ds, app.catalog, app.pipeline)
+    assert api.write_buffer is not None
+
+    with TestClient(api) as client:
+        res = client.post(
+            "/api/v1alpha1/update-data",
+            json={
+                "table_name": "events",
+                "upsert": [{"user_id": 1, "event_id": 1, "event": {"event_type": "click", "offer_id": 1}}],
+                "background": True,
+            },
+        )
+        assert res.status_code == 200
+        assert len(app.ds.get_table("events").get_data()) == 0
+
+    assert len(app.ds.get_table("events").get_data()) == 1
+    assert len(app.ds.get_table("user_profile").get_data()) == 1
+
+
+def test_job_queue(app, monkeypatch, tmp_path):
+    monkeypatch.setattr(API_SETTINGS, "job_queue_uri", f"sqlite:///{tmp_path}/jobs.sqlite")
+
+    stopped = []
+    stop = JobQueue.stop
+    monkeypatch.setattr(JobQueue, "stop", lambda self: (stopped.append(self), stop(self)))
+
+    v1alpha1_app = api_v1alpha1.make_app(app.ds, app.catalog, app.pipeline, app.steps)
+
+    with TestClient(v1alpha1_app) as client:
+        res = client.post(
+            "/update-data",
+            json={
+                "table_name": "events",
+                "upsert": [{"user_id": 1, "event_id": 1, "event": {"event_type": "click", "offer_id": 1}}],
+                "background": True,
+            },
+        )
+        assert res.status_code == 200
+        job_id = res.json()["job_id"]
+        assert job_id is not None
+
+        for _ in range(50):
+            job = client.get(f"/jobs/{job_id}").json()
+            if job["status"] in ("done", "failed"):
+                break
+            time.sleep(0.1)
+
+        assert job["status"] == "done"
+        assert job["attempts"] == 1
+        assert len(app.ds.get_table("user_profile").get_data()) == 1
+
+        assert client.get("/jobs/unknown").status_code == 404
+
+    assert stopped == [v1alpha1_app.state.job_queue]
+
+    api = DatapipeAPI(app.ds, app.catalog, app.pipeline)
+    assert api.job_queue is not None
+
+    with TestClient(api):
+        pass
+
+    assert stopped[-1] is api.job_queue
+
+
+def test_dump_changelist_round_trip():
+    idx = pd.DataFrame(
+        {
+            "id": [1, 2],
+            "created_at": [datetime(2024, 1, 1, 10, 0, 0, 123456), datetime(2024, 1, 2)],
+            "created_at_utc": [datetime(2024, 1, 1, tzinfo=timezone.utc), datetime(2024, 1, 2, tzinfo=timezone.utc)],
+            "name": ["a", "0012"],
+            "value": [1.5, 2.0],
+        }
+    )
+    cl = ChangeList()
+    cl.append("items", IndexDF(idx))
+
+    loaded = load_changelist(dump_changelist(cl))
+
+    pd.testing.assert_frame_equal(loaded.changes["items"], idx)
+    assert loaded.changes["items"]["created_at"].tolist() == idx["created_at"].tolist()
+
+
+def test_job_queue_retries_interrupted_jobs(app, tmp_path):
+    uri = f"sqlite:///{tmp_path}/jobs.sqlite"
+    dt = app.catalog.get_datatable(app.ds, "events")
+    idx = dt.store_chunk(
+        pd.DataFrame.from_records([{"user_id": 1, "event_id": 1, "event": {"event_type": "click", "offer_id": 1}}])
+    )
+    cl = ChangeList()
+    cl.append(dt.name, idx)
+
+    runs = []
+
+    def run(steps, changelist):
+        runs.append(changelist)
+        run_changelist(app.ds, steps, changelist)
+
+    job_queue = JobQueue(uri, app.steps, run, max_attempts=3)
+
+    # Jobs which were running when the process crashed
+    with job_queue.engine.begin() as conn:
+        for job_id, attempts in [("interrupted", 1), ("crashing", 3)]:
+            conn.execute(
+                job_queue.jobs.insert().values(
+                    job_id=job_id,
+                    status="running",
+                    steps=json.dumps([step.name for step in app.steps]),
+                    changelist=dump_changelist(cl),
+                    attempts=attempts,
+                    created_at=0,
+                    updated_at=0,
+                )
+            )
+
+    job_queue.start()
+
+    for _ in range(50):
+        if job_queue.get("interrupted")["status"] == "done":
+            break
+        time.sleep(0.1)
+    job_queue.stop()
+
+    assert job_queue.get("interrupted")["status"] == "done"
+    assert job_queue.get("interrupted")["attempts"] == 2
+    assert job_queue.get("crashing")["status"] == "failed"
+
+    assert len(runs) == 1
+    assert runs[0].changes["events"]["user_id"].tolist() == [1]
+    assert len(app.ds.get_table("user_profile").get_data()) == 1
+
+
+def test_changelist_scheduler(app):
+    scheduler = ChangelistScheduler()
+
+    started = threading.Event()
+    release = threading.Event()
+    runs = []
+
+    def run(steps, changelist):
+        runs.append(changelist.changes["events"]["user_id"].tolist())
+        started.set()
+        release.wait(timeout=5)
+
+    def changelist(*user_ids):
+        cl = ChangeList()
+        cl.append("events", IndexDF(pd.DataFrame({"user_id": user_ids, "event_id": 1})))
+        return cl
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        first = executor.submit(scheduler.run, app.steps, changelist(1), run)
+        started.wait(timeout=5)
+
+        # Arrive while the first run is in flight
+        second = executor.submit(scheduler.run, app.steps, changelist(2, 3), run)
+        third = executor.submit(scheduler.run, app.steps, changelist(3, 4), run)
+        time.sleep(0.2)
+        release.set()
+
+        for future in [first, second, third]:
+            future.result(timeout=5)
+
+    # One follow-up run with the deduplicated union
+    assert runs == [[1], [2, 3, 4]]
+
+
+def test_changelist_scheduler_returns_after_own_run(app):
+    scheduler = ChangelistScheduler()
+
+    release = threading.Semaphore(0)
+    runs = []
+
+    def run(steps, changelist):
+        runs.append(changelist.changes["events"]["user_id"].tolist())
+        release.acquire(timeout=5)
+
+    def changelist(user_id):
+        cl = ChangeList()
+        cl.append("events", IndexDF(pd.DataFrame({"user_id": [user_id], "event_id": 1})))
+        return cl
+
+    def wait_runs(n):
+        for _ in range(50):
+            if len(runs) >= n:
+                return
+            time.sleep(0.1)
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        first = executor.submit(scheduler.run, app.steps, changelist(1), run)
+        wait_runs(1)
+
+        second = executor.submit(scheduler.run, app.steps, changelist(2), run)
+        time.sleep(0.2)
+
+        # Second run starts once the first one finishes and its caller returns
+        release.release()
+        wait_runs(2)
+        first.result(timeout=5)
+
+        # Writes keep arriving while the second run is in flight
+        third = executor.submit(scheduler.run, app.steps, changelist(3), run)
+        time.sleep(0.2)
+        assert not second.done()
+        assert not third.done()
+
+        release.release()
+        second.result(timeout=5)
+        release.release()
+        third.result(timeout=5)
+
+    assert runs == [[1], [2], [3]]
+
+
+def test_downstream_steps_index():
+    def step(name, inputs, outputs):
+        return SimpleNamespace(
+            name=name,
+            input_dts=[SimpleNamespace(dt=SimpleNamespace(name=i)) for i in inputs],
+            output_dts=[SimpleNamespace(name=o) for o in outputs],
+        )
+
+    steps = [
+        step("a", ["raw"], ["clean"]),
+        step("b", ["other"], ["other_clean"]),
+        step("c", ["clean", "other_clean"], ["report"]),
+        step("d", ["report"], ["clean"]),
+    ]
+
+    index = {table: [s.name for s in table_steps] for table, table_steps in downstream_steps_index(steps).items()}
+
+    assert index == {
+        "raw": ["a", "c", "d"],
+        "clean": ["c", "d"],
+        "other": ["b", "c", "d"],
+        "other_clean": ["c", "d"],
+        "report": ["c", "d"],
+    }
+
+
+def test_update_data_downstream_steps(app):
+    client = TestClient(app)
+
+    res = client.post(
+        "/api/v1alpha1/update-data",
+        json={"table_name": "events", "upsert": [{"user_id": 1, "event_id": 1, "event": {"event_type": "click"}}]},
+    )
+    assert res.status_code == 200
+    assert res.json()["steps"] == [app.steps[0].name]
+
+    # Output tables of the pipeline have nothing downstream
+    res = client.post(
+        "/api/v1alpha1/update-data",
+        json={"table_name": "user_lang", "upsert": [{"user_id": 1, "lang": "en"}]},
+    )
+    assert res.status_code == 200
+    assert res.json()["steps"] == []
@@ -1,11 +1,38 @@
+import asyncio
+import base64
+import json
+import sys
+import time
+import tracemalloc
 import typing as t
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from types import SimpleNamespace
 
 import pandas as pd
 import pytest
+import sqlalchemy as sa
 from datapipe.compute import run_steps
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from sqlalchemy import inspect, text
+from sqlalchemy.dialects import postgresql
 
+from datapipe_app import api_v1alpha1, api_v1alpha2
+from datapipe_app import graph as graph_module
+from datapipe_app import models
+from datapipe_app.api_v1alpha2 import get_table_data
+from datapipe_app.cache import TTLCache
 from datapipe_app.datapipe_api import DatapipeAPI
+from datapipe_app.graph import GraphSnapshotCache, build_graph
+from datapipe_app.query import apply_page, encode_cursor, focus_filter
+from datapipe_app.read_engine import async_read_engine, dispose_read_engines, run_read
+from datapipe_app.result_cache import ResultCache
+from datapipe_app.serialization import dumps_json, fill_missing, iter_ndjson, parse_datetime
+from datapipe_app.settings import API_SETTINGS
+from datapipe_app.sort_indexes import SortIndexes
+from datapipe_app.table_size import get_table_size
 
 
 def test_graph_works(app):
@@ -14,6 +41,62 @@ def test_graph_works(app):
     assert res.status_code == 200
 
 
+def test_graph_snapshot_cache(app: DatapipeAPI):
+    cache = GraphSnapshotCache(app.ds, app.catalog, app.steps, refresh_interval=3600)
+
+    graph = cache.get()
+    assert graph.computed_at is not None
+    assert graph.stale_after is not None
+    assert graph.stale_after > graph.computed_at
+
+    # Served from memory until background refresh
+    assert cache.get() is graph
+
+    cache.stop()
+
+
+def test_graph_item_timeout(app: DatapipeAPI, monkeypatch):
+    get_table_size = graph_module._get_table_size
+
+    def slow_get_table_size(ds, catalog, table_name):
+        if table_name == "events":
+            time.sleep(1)
+        return get_table_size(ds, catalog, table_name)
+
+    monkeypatch.setattr(graph_module, "_get_table_size", slow_get_table_size)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        graph = build_graph(app.ds, app.catalog, app.steps, executor=executor, item_timeout=0.2)
+
+    assert graph.catalog["events"].timed_out
+    assert graph.catalog["events"].size is None
+    assert not graph.catalog["user_profile"].timed_out
+    assert graph.catalog["user_profile"].size == 0
+    assert not graph.catalog["user_profile"].size_is_estimate
+
+
+def test_graph_async_concurrency(app: DatapipeAPI, monkeypatch):
+    running = 0
+    max_running = 0
+
+    async def counting_run_read(dbconn, func, *args, **kwargs):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        try:
+            await asyncio.sleep(0.05)
+            return await run_read(dbconn, func, *args, **kwargs)
+        finally:
+            running -= 1
+
+    monkeypatch.setattr(graph_module, "run_read", counting_run_read)
+
+    graph = asyncio.run(graph_module.build_graph_async(app.ds, app.catalog, app.steps, max_concurrency=2))
+
+    assert max_running == 2
+    assert graph.catalog["events"].size == 0
+
+
 @pytest.fixture
 def test_client(app: DatapipeAPI) -> t.Iterator[TestClient]:
     events_table = app.ds.get_table("events")
@@ -84,3 +167,625 @@ def test_update_data(test_client: TestClient, request_data: t.Dict[str, t.Any]):
     assert response.status_code == 200
     print(response.json())
     assert response.json()["data"][0] == request_data["result"]
+
+
+def test_approximate_table_size(test_client: TestClient, app: DatapipeAPI):
+    dt = app.ds.get_table("events")
+
+    # No statistics yet
+    assert get_table_size(dt, approximate=True) == (1, False)
+
+    with app.ds.meta_dbconn.con.begin() as conn:
+        conn.execute(text("ANALYZE"))
+
+    assert get_table_size(dt, approximate=True) == (1, True)
+    assert get_table_size(dt, approximate=True, exact_threshold=100) == (1, False)
+
+
+@pytest.mark.parametrize("order_by,order", [(None, "asc"), ("event_id", "desc")])
+def test_table_data_cursor_pagination(test_client: TestClient, app: DatapipeAPI, order_by, order):
+    app.ds.get_table("events").store_chunk(
+        pd.DataFrame.from_records(
+            [
+                {"user_id": user_id, "event_id": event_id, "event": {"event_type": "click", "offer_id": 1}}
+                for user_id in range(2, 4)
+                for event_id in range(3)
+            ]
+        )
+    )
+
+    request = {"table": "events", "page_size": 2, "order_by": order_by, "order": order}
+
+    offset_rows = []
+    for page in range(4):
+        res = test_client.post("/api/v1alpha2/get-table-data", json={**request, "page": page})
+        assert res.status_code == 200
+        offset_rows.extend(res.json()["data"])
+
+    cursor_rows = []
+    cursor = None
+    while True:
+        res = test_client.post("/api/v1alpha2/get-table-data", json={**request, "cursor": cursor})
+        assert res.status_code == 200
+        cursor_rows.extend(res.json()["data"])
+        cursor = res.json()["next_cursor"]
+        if cursor is None:
+            break
+
+    assert len(cursor_rows) == 7
+    assert cursor_rows == offset_rows
+
+    res = test_client.post("/api/v1alpha2/get-table-data", json={**request, "order": "asc", "cursor": "garbage"})
+    assert res.status_code == 400
+
+
+def test_large_table_read_memory(test_client: TestClient, app: DatapipeAPI):
+    with app.ds.meta_dbconn.con.begin() as conn:
+        conn.execute(
+            text(
+                """
+                WITH RECURSIVE seq(n) AS (SELECT 2 UNION ALL SELECT n + 1 FROM seq WHERE n < 1000000)
+                INSERT INTO user_lang (user_id, lang) SELECT n, 'lang_' || n FROM seq
+                """
+            )
+        )
+
+    tracemalloc.start()
+    try:
+        res = test_client.post(
+            "/api/v1alpha2/get-table-data",
+            json={"table": "user_lang", "page": 10, "page_size": 10_000_000},
+        )
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert res.status_code == 200
+    assert res.json()["total"] == 1_000_000
+    assert len(res.json()["data"]) == API_SETTINGS.max_page_size
+
+    assert peak < 20 * 1024 * 1024
+
+
+def test_max_response_bytes(test_client: TestClient, app: DatapipeAPI, monkeypatch):
+    app.ds.get_table("events").store_chunk(
+        pd.DataFrame.from_records(
+            [{"user_id": user_id, "event_id": 1, "event": {"event_type": "click"}} for user_id in range(2, 5)]
+        )
+    )
+
+    # Every page is cut down to the single row which is always kept
+    monkeypatch.setattr(API_SETTINGS, "max_response_bytes", 1)
+
+    res = test_client.post("/api/v1alpha2/get-table-data", json={"table": "events", "page_size": 10})
+    assert res.status_code == 200
+    assert [row["user_id"] for row in res.json()["data"]] == [1]
+    assert res.json()["truncated"]
+    assert res.json()["next_cursor"] is not None
+
+    # Next page starts right after the truncated one
+    res = test_client.post(
+        "/api/v1alpha2/get-table-data",
+        json={"table": "events", "page_size": 10, "cursor": res.json()["next_cursor"]},
+    )
+    assert res.status_code == 200
+    assert [row["user_id"] for row in res.json()["data"]] == [2]
+    assert res.json()["truncated"]
+
+
+def test_page_validation(test_client: TestClient, monkeypatch):
+    monkeypatch.setattr(API_SETTINGS, "max_page_size", 2)
+
+    for params in [{"page_size": -1}, {"page_size": 0}, {"page": -1}]:
+        res = test_client.post("/api/v1alpha2/get-table-data", json={"table": "events", **params})
+        assert res.status_code == 422
+
+        res = test_client.post("/api/v1alpha1/get-data", json={"table": "events", **params})
+        assert res.status_code == 422
+
+
+def test_dumps_json_datetimes(monkeypatch):
+    content = {
+        "utc": datetime(2024, 1, 2, 3, 4, 5, 678000, tzinfo=timezone.utc),
+        "offset": datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone(timedelta(hours=3))),
+        "naive": datetime(2024, 1, 2, 3, 4, 5),
+        "date": date(2024, 1, 2),
+    }
+    expected = {
+        "utc": "2024-01-02T03:04:05.678000Z",
+        "offset": "2024-01-02T03:04:05+03:00",
+        "naive": "2024-01-02T03:04:05",
+        "date": "2024-01-02",
+    }
+
+    assert json.loads(dumps_json(content)) == expected
+
+    # Same output without orjson
+    monkeypatch.setitem(sys.modules, "orjson", None)
+    assert json.loads(dumps_json(content)) == expected
+
+
+def test_iter_ndjson_non_finite_floats():
+    rows = [{"id": 1, "score": float("nan")}, {"id": 2, "score": float("inf")}, {"id": 3, "score": 0.5}]
+
+    lines = b"".join(iter_ndjson([rows])).decode().splitlines()
+
+    # Strict parser
+    def reject(value: str) -> t.Any:
+        raise ValueError(value)
+
+    assert [json.loads(line, parse_constant=reject) for line in lines] == [
+        {"id": 1, "score": None},
+        {"id": 2, "score": None},
+        {"id": 3, "score": 0.5},
+    ]
+
+
+def test_include_total(test_client: TestClient, app: DatapipeAPI):
+    res = test_client.post("/api/v1alpha2/get-table-data", json={"table": "events", "include_total": "none"})
+    assert res.status_code == 200
+    assert res.json()["total"] is None
+    assert len(res.json()["data"]) == 1
+
+    # SQLite has no planner estimates, exact count is used
+    res = test_client.post("/api/v1alpha2/get-table-data", json={"table": "events", "include_total": "estimate"})
+    assert res.status_code == 200
+    assert res.json()["total"] == 1
+    assert not res.json()["total_is_estimate"]
+
+
+def test_focus_count_cache(test_client: TestClient, app: DatapipeAPI, monkeypatch):
+    # Temporary table path
+    monkeypatch.setattr(API_SETTINGS, "focus_in_max_items", 0)
+
+    count_cache: TTLCache[int] = TTLCache(ttl=3600)
+
+    def total(items_idx: t.List[t.Dict[str, t.Any]]) -> t.Optional[int]:
+        req = models.GetDataRequest(table="events", focus=models.FocusFilter(table_name="events", items_idx=items_idx))
+        return get_table_data(app.ds, app.catalog, req, count_cache).total
+
+    assert total([{"user_id": 1, "event_id": 1}]) == 1
+    assert total([{"user_id": 1, "event_id": 1}]) == 1
+    assert len(count_cache._data) == 1
+
+    assert total([{"user_id": 2, "event_id": 1}]) == 0
+    assert len(count_cache._data) == 2
+
+
+def test_focus_filter_temporary_table_transaction(monkeypatch):
+    monkeypatch.setattr(API_SETTINGS, "focus_in_max_items", 0)
+
+    sql_table = sa.Table("items", sa.MetaData(), sa.Column("id", sa.Integer(), primary_key=True))
+    engine = sa.create_engine("sqlite://")
+    sql_table.create(engine)
+
+    def temp_tables(conn: t.Any) -> int:
+        return conn.execute(text("SELECT count(*) FROM sqlite_temp_master")).scalar()
+
+    with engine.connect() as conn:
+        with focus_filter(conn, sql_table, ["id"], [{"id": 1}]) as clause:
+            assert conn.execute(sa.select(sql_table.c.id).where(clause)).scalars().all() == []
+
+        assert not conn.in_transaction()
+        assert temp_tables(conn) == 0
+
+    # Caller's transaction is neither committed nor rolled back
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        conn.execute(sql_table.insert(), [{"id": 1}, {"id": 2}])
+
+        with focus_filter(conn, sql_table, ["id"], [{"id": 1}]) as clause:
+            assert conn.execute(sa.select(sql_table.c.id).where(clause)).scalars().all() == [1]
+
+        assert transaction.is_active
+        assert temp_tables(conn) == 0
+        transaction.commit()
+
+    with engine.connect() as conn:
+        assert conn.execute(sa.select(sa.func.count()).select_from(sql_table)).scalar() == 2
+
+
+def test_focus_filter_postgres_values(app: DatapipeAPI, monkeypatch):
+    monkeypatch.setattr(API_SETTINGS, "focus_in_max_items", 1)
+
+    sql_table = app.ds.get_table("events").table_store.data_table
+    conn = t.cast(t.Any, SimpleNamespace(dialect=postgresql.dialect(), get_execution_options=lambda: {}))
+    items_idx = [{"user_id": 1, "event_id": 1}, {"user_id": 2, "event_id": 1}]
+
+    with focus_filter(conn, sql_table, ["user_id", "event_id"], items_idx) as clause:
+        compiled = clause.compile(dialect=postgresql.dialect())
+
+    assert "VALUES" in str(compiled)
+    assert "focus_idx" in str(compiled)
+    assert list(compiled.params.values()) == [1, 1, 2, 1]
+
+
+def test_count_cache(test_client: TestClient, app: DatapipeAPI):
+    count_cache: TTLCache[int] = TTLCache(ttl=3600)
+    req = models.GetDataRequest(table="events")
+
+    assert get_table_data(app.ds, app.catalog, req, count_cache).total == 1
+
+    app.ds.get_table("events").store_chunk(
+        pd.DataFrame.from_records([{"user_id": 2, "event_id": 1, "event": {"event_type": "click", "offer_id": 1}}])
+    )
+
+    # Cached total is served until it expires
+    assert get_table_data(app.ds, app.catalog, req, count_cache).total == 1
+
+    count_cache.clear()
+    assert get_table_data(app.ds, app.catalog, req, count_cache).total == 2
+
+
+def test_export_table_data(test_client: TestClient, app: DatapipeAPI):
+    res = test_client.get("/api/v1alpha2/export-table-data", params={"table": "events"})
+    assert res.status_code == 200
+    assert [json.loads(line) for line in res.text.splitlines()] == [
+        {"user_id": 1, "event_id": 1, "event": {"event_type": "click", "offer_id": 1}}
+    ]
+
+    res = test_client.get("/api/v1alpha2/export-table-data", params={"table": "user_profile", "format": "csv"})
+    assert res.status_code == 200
+    assert res.text.splitlines() == [
+        "user_id,offer_clicks,events_count,active",
+        "1,[1],1,True",
+    ]
+
+    step_name = app.steps[0].get_name()
+    res = test_client.get("/api/v1alpha2/export-transform-data", params={"transform": step_name})
+    assert res.status_code == 200
+    [row] = [json.loads(line) for line in res.text.splitlines()]
+    assert row["user_id"] == 1
+    assert row["is_success"]
+
+
+def test_table_data_arrow(test_client: TestClient, app: DatapipeAPI):
+    pa = pytest.importorskip("pyarrow")
+
+    headers = {"Accept": "application/vnd.apache.arrow.stream"}
+
+    res = test_client.post("/api/v1alpha2/get-table-data", json={"table": "events"}, headers=headers)
+    assert res.status_code == 200
+    assert res.headers["X-Total-Count"] == "1"
+    table = pa.ipc.open_stream(res.content).read_all()
+    assert table.to_pylist() == [{"user_id": 1, "event_id": 1, "event": '{"event_type": "click", "offer_id": 1}'}]
+
+    res = test_client.post(
+        "/api/v1alpha2/get-transform-data", json={"table": app.steps[0].get_name()}, headers=headers
+    )
+    assert res.status_code == 200
+    table = pa.ipc.open_stream(res.content).read_all()
+    assert table.column("user_id").to_pylist() == [1]
+    assert "priority" not in table.column_names
+
+    res = test_client.get("/api/v1alpha1/get-data", params={"table": "user_profile"}, headers=headers)
+    assert res.status_code == 200
+    table = pa.ipc.open_stream(res.content).read_all()
+    assert table.column("events_count").to_pylist() == [1]
+
+
+def test_fill_missing():
+    assert fill_missing([{"a": float("nan"), "b": None, "c": 1}], "-") == [{"a": "-", "b": "-", "c": 1}]
+
+
+def test_table_data_missing_values(test_client: TestClient, app: DatapipeAPI):
+    app.ds.get_table("user_lang").store_chunk(pd.DataFrame.from_records([{"user_id": 2, "lang": None}]))
+
+    res = test_client.post("/api/v1alpha2/get-table-data", json={"table": "user_lang", "filters": {"user_id": 2}})
+    assert res.status_code == 200
+    assert res.json()["data"] == [{"user_id": 2, "lang": "-"}]
+
+    res = test_client.post("/api/v1alpha1/get-data", json={"table": "user_lang", "filters": {"user_id": 2}})
+    assert res.status_code == 200
+    assert res.json()["data"] == [{"user_id": 2, "lang": ""}]
+
+    res = test_client.post("/api/v1alpha2/get-transform-data", json={"table": app.steps[0].get_name()})
+    assert res.status_code == 200
+    [row] = res.json()["data"]
+    assert "priority" not in row
+    assert row["process_ts"].endswith("Z")
+    models.GetDataResponse.model_validate(res.json())
+
+
+@pytest.mark.parametrize("focus_in_max_items", [10_000, 0])
+def test_table_data_large_focus(test_client: TestClient, app: DatapipeAPI, monkeypatch, focus_in_max_items):
+    monkeypatch.setattr(API_SETTINGS, "focus_in_max_items", focus_in_max_items)
+
+    app.ds.get_table("events").store_chunk(
+        pd.DataFrame.from_records(
+            [{"user_id": 2, "event_id": i, "event": {"event_type": "view"}} for i in range(10_000)]
+        )
+    )
+
+    # Every other event and some which do not exist
+    items_idx = [{"user_id": 2, "event_id": i} for i in range(0, 12_000, 2)]
+
+    res = test_client.post(
+        "/api/v1alpha2/get-table-data",
+        json={
+            "table": "events",
+            "page_size": 10,
+            "order_by": "event_id",
+            "order": "desc",
+            "focus": {"table_name": "events", "items_idx": items_idx},
+        },
+    )
+    assert res.status_code == 200
+    assert res.json()["total"] == 5000
+    assert [row["event_id"] for row in res.json()["data"]] == list(range(9998, 9978, -2))
+
+    with app.ds.meta_dbconn.con.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM sqlite_temp_master")).scalar() == 0
+
+
+def test_async_reads(test_client: TestClient, app: DatapipeAPI, monkeypatch):
+    pytest.importorskip("aiosqlite")
+    pytest.importorskip("greenlet")
+
+    monkeypatch.setattr(API_SETTINGS, "async_reads", True)
+    monkeypatch.setattr(API_SETTINGS, "show_step_status", True)
+    monkeypatch.setattr(API_SETTINGS, "focus_in_max_items", 0)
+
+    try:
+        assert async_read_engine(app.ds.meta_dbconn) is not None
+
+        res = test_client.post(
+            "/api/v1alpha2/get-table-data",
+            json={"table": "events", "focus": {"table_name": "events", "items_idx": [{"user_id": 1, "event_id": 1}]}},
+        )
+        assert res.status_code == 200
+        assert res.json()["total"] == 1
+        assert res.json()["data"][0]["event"] == {"event_type": "click", "offer_id": 1}
+
+        res = test_client.post("/api/v1alpha2/get-transform-data", json={"table": app.steps[0].get_name()})
+        assert res.status_code == 200
+        assert res.json()["data"][0]["process_ts"].endswith("Z")
+
+        res = test_client.get("/api/v1alpha1/get-data", params={"table": "user_profile"})
+        assert res.status_code == 200
+        assert res.json()["data"] == [{"user_id": 1, "offer_clicks": [1], "events_count": 1, "active": True}]
+
+        res = test_client.post("/api/v1alpha1/get-data", json={"table": "user_lang"})
+        assert res.status_code == 200
+        assert res.json()["total"] == 1
+
+        res = test_client.get("/api/v1alpha2/graph")
+        assert res.status_code == 200
+        assert res.json()["catalog"]["events"]["size"] == 1
+        [step] = [step for step in res.json()["pipeline"] if step["total_idx_count"] is not None]
+        assert step["total_idx_count"] == 1
+    finally:
+        dispose_read_engines()
+
+
+def test_result_cache(test_client: TestClient, app: DatapipeAPI):
+    cache = ResultCache(version_check_interval=3600)
+    v1alpha1 = TestClient(api_v1alpha1.make_app(app.ds, app.catalog, app.pipeline, app.steps, result_cache=cache))
+    v1alpha2 = TestClient(api_v1alpha2.make_app(app.ds, app.catalog, app.pipeline, app.steps, result_cache=cache))
+
+    def get_total() -> int:
+        res = v1alpha2.post("/get-table-data", json={"table": "events"})
+        assert res.status_code == 200
+        return res.json()["total"]
+
+    def event(user_id: int) -> t.Dict[str, t.Any]:
+        return {"user_id": user_id, "event_id": 1, "event": {"event_type": "click", "offer_id": 1}}
+
+    assert get_total() == 1
+
+    # Write outside of the API is not seen until the next version check
+    app.ds.get_table("events").store_chunk(pd.DataFrame.from_records([event(2)]))
+    assert get_total() == 1
+
+    # API write invalidates cached pages of the table
+    res = v1alpha1.post("/update-data", json={"table_name": "events", "upsert": [event(3)]})
+    assert res.status_code == 200
+    assert get_total() == 3
+
+    cache.version_check_interval = 0
+    assert get_total() == 3
+
+    app.ds.get_table("events").store_chunk(pd.DataFrame.from_records([event(4)]))
+    assert get_total() == 4
+
+
+@pytest.mark.parametrize(
+    "filters,user_ids",
+    [
+        ({"user_id": {"in": [1, 3]}}, [1, 3]),
+        ({"user_id": {"between": [2, 3]}}, [2, 3]),
+        ({"user_id": {"gt": 1, "lte": 2}}, [2]),
+        ({"lang": {"prefix": "e"}}, [1, 2]),
+        ({"lang": {"prefix": "%"}}, []),
+        ({"lang": {"is_null": True}}, [3]),
+        ({"lang": "ru"}, []),
+    ],
+)
+def test_table_data_filter_operators(test_client: TestClient, app: DatapipeAPI, filters, user_ids):
+    app.ds.get_table("user_lang").store_chunk(
+        pd.DataFrame.from_records(
+            [
+                {"user_id": 1, "lang": "en"},
+                {"user_id": 2, "lang": "es"},
+                {"user_id": 3, "lang": None},
+            ]
+        )
+    )
+
+    res = test_client.post("/api/v1alpha2/get-table-data", json={"table": "user_lang", "filters": filters})
+    assert res.status_code == 200
+    assert [row["user_id"] for row in res.json()["data"]] == user_ids
+
+
+def test_table_data_invalid_filters(test_client: TestClient, app: DatapipeAPI):
+    for filters in [
+        {"unknown": 1},
+        {"user_id": {"in": 1}},
+        {"user_id": {"prefix": "1"}},
+        {"user_id": {"gt": {"x": 1}}},
+        {"user_id": {"in": [[1]]}},
+        {"user_id": [1]},
+        {"user_id": {"like": 1, "gt": 0}},
+    ]:
+        res = test_client.post("/api/v1alpha2/get-table-data", json={"table": "events", "filters": filters})
+        assert res.status_code == 400
+
+    res = test_client.post(
+        "/api/v1alpha2/get-table-data", json={"table": "user_lang", "filters": {"lang": {"like": "e%"}}}
+    )
+    assert res.status_code == 400
+    assert res.json()["detail"] == "Unknown filter operator(s) like of lang"
+
+    res = test_client.post(
+        "/api/v1alpha2/get-table-data",
+        json={"table": "events", "filters": {"event": {"event_type": "click", "offer_id": 1}}},
+    )
+    assert res.status_code == 200
+
+    for filters in [{"process_ts": {"gt": "not a date"}}, {"process_ts": "2024-13-01"}]:
+        res = test_client.post(
+            "/api/v1alpha2/get-transform-data", json={"table": app.steps[0].get_name(), "filters": filters}
+        )
+        assert res.status_code == 400
+
+
+def test_returned_datetimes_round_trip(test_client: TestClient, app: DatapipeAPI):
+    assert parse_datetime("2024-01-01T10:00:00.123456Z") == datetime(2024, 1, 1, 10, 0, 0, 123456, tzinfo=timezone.utc)
+
+    res = test_client.post("/api/v1alpha2/get-transform-data", json={"table": app.steps[0].get_name()})
+    [row] = res.json()["data"]
+
+    res = test_client.post(
+        "/api/v1alpha2/get-transform-data",
+        json={"table": app.steps[0].get_name(), "filters": {"process_ts": row["process_ts"]}},
+    )
+    assert res.status_code == 200
+    assert len(res.json()["data"]) == 1
+
+    sql_table = sa.Table(
+        "created",
+        sa.MetaData(),
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("created_at", sa.DateTime()),
+    )
+    rows = [{"id": i, "created_at": datetime(2024, 1, 1, i, tzinfo=timezone.utc)} for i in range(3)]
+
+    cursor = encode_cursor(rows[0], sql_table, ["id"], "created_at", "asc")
+    assert json.loads(base64.urlsafe_b64decode(cursor))["values"][0].endswith("Z")
+
+    engine = sa.create_engine("sqlite://")
+    with engine.begin() as conn:
+        sql_table.create(conn)
+        conn.execute(sql_table.insert(), rows)
+
+        sql = apply_page(sa.select(sql_table.c.id), sql_table, ["id"], "created_at", "asc", 0, 10, cursor=cursor)
+        assert conn.execute(sql).scalars().all() == [1, 2]
+
+    cursor = base64.urlsafe_b64encode(
+        json.dumps({"order_by": "created_at", "order": "asc", "values": ["not a date", 0]}).encode()
+    ).decode()
+    with pytest.raises(HTTPException) as e:
+        apply_page(sa.select(sql_table.c.id), sql_table, ["id"], "created_at", "asc", 0, 10, cursor=cursor)
+    assert e.value.status_code == 400
+
+
+def test_full_scan_guard(test_client: TestClient, app: DatapipeAPI, monkeypatch):
+    monkeypatch.setattr(API_SETTINGS, "full_scan_guard", "reject")
+    monkeypatch.setattr(API_SETTINGS, "full_scan_guard_min_rows", 1)
+
+    def get_data(filters: t.Dict[str, t.Any]) -> int:
+        res = test_client.post("/api/v1alpha2/get-table-data", json={"table": "user_profile", "filters": filters})
+        return res.status_code
+
+    # No planner statistics yet
+    assert get_data({"events_count": 1}) == 200
+
+    with app.ds.meta_dbconn.con.begin() as conn:
+        conn.execute(text("ANALYZE"))
+
+    assert get_data({"user_id": 1}) == 200
+    assert get_data({"events_count": 1}) == 400
+
+    monkeypatch.setattr(API_SETTINGS, "full_scan_guard", "warn")
+    assert get_data({"events_count": 1}) == 200
+
+
+SLOW_QUERY = text(
+    "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 1000000000) SELECT count(*) FROM c"
+)
+
+
+class DisconnectedRequest:
+    async def is_disconnected(self) -> bool:
+        return True
+
+
+@pytest.mark.parametrize("async_reads", [False, True])
+@pytest.mark.parametrize(
+    "request_,timeout,status_code,metric",
+    [
+        (None, 0.2, 504, "datapipe_app_read_queries_timed_out_total"),
+        (DisconnectedRequest(), None, 499, "datapipe_app_read_queries_cancelled_total"),
+    ],
+)
+def test_read_cancellation(app: DatapipeAPI, monkeypatch, async_reads, request_, timeout, status_code, metric):
+    monkeypatch.setattr(API_SETTINGS, "async_reads", async_reads)
+    before = REGISTRY.get_sample_value(metric)
+
+    try:
+        start = time.monotonic()
+        with pytest.raises(HTTPException) as e:
+            asyncio.run(
+                run_read(
+                    app.ds.meta_dbconn,
+                    lambda conn: conn.execute(SLOW_QUERY).scalar(),
+                    request_,  # type: ignore
+                    timeout,
+                )
+            )
+
+        assert e.value.status_code == status_code
+        assert time.monotonic() - start < 5
+        assert REGISTRY.get_sample_value(metric) == before + 1
+
+        # Connection is usable after the interrupted query
+        assert asyncio.run(run_read(app.ds.meta_dbconn, lambda conn: conn.execute(text("SELECT 1")).scalar())) == 1
+    finally:
+        dispose_read_engines()
+
+
+def test_order_by(test_client: TestClient, app: DatapipeAPI):
+    app.ds.get_table("user_profile").store_chunk(
+        pd.DataFrame.from_records(
+            [
+                {"user_id": user_id, "offer_clicks": [], "events_count": 10 - user_id, "active": True}
+                for user_id in [2, 3]
+            ]
+        )
+    )
+
+    for url in ["/api/v1alpha2/get-table-data", "/api/v1alpha1/get-data"]:
+        res = test_client.post(url, json={"table": "user_profile", "order_by": "events_count"})
+        assert res.status_code == 200
+        assert [row["user_id"] for row in res.json()["data"]] == [1, 3, 2]
+
+        res = test_client.post(url, json={"table": "user_profile", "order_by": "events_count; DROP TABLE events"})
+        assert res.status_code == 400
+
+
+def test_sort_indexes(test_client: TestClient, app: DatapipeAPI):
+    sort_indexes = SortIndexes(min_requests=2)
+    client = TestClient(api_v1alpha2.make_app(app.ds, app.catalog, app.pipeline, app.steps, sort_indexes=sort_indexes))
+
+    def get_indexes(table_name: str) -> t.List[t.List[str]]:
+        with app.ds.meta_dbconn.con.connect() as conn:
+            return [index["column_names"] for index in inspect(conn).get_indexes(table_name)]
+
+    for order_by in ["events_count", "events_count", "user_id", "user_id"]:
+        res = client.post("/get-table-data", json={"table": "user_profile", "order_by": order_by})
+        assert res.status_code == 200
+
+    sort_indexes.stop()
+
+    # Primary key already serves sorting by user_id
+    assert get_indexes("user_profile") == [["events_count", "user_id"]]